@@ -0,0 +1,55 @@
+# AdaptiveConcurrency.py - decide how many BMCs to talk to at once, based on how they're responding
+#
+# Uses AIMD (additive increase, multiplicative decrease), the same idea TCP uses for its congestion window:
+# every time a full "round" of requests comes back healthy the limit goes up by one.  The limit is cut back when
+# requests fail or when latency climbs well above the best latency seen so far (the BMCs or the management network
+# are saturating).
+import threading
+from logging import getLogger
+
+log = getLogger(__name__)
+
+
+class AdaptiveConcurrency(object):
+    def __init__(self, initial=10, minimum=2, maximum=256, latency_factor=2.0, smoothing=0.2):
+        self.limit = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.latency_factor = latency_factor    # how far above the baseline latency counts as "slow"
+        self.smoothing = smoothing              # weight of each new sample in the moving average
+        self.latency = None         # moving average of recent latencies
+        self.baseline = None        # the best moving average seen - what an unloaded BMC looks like
+        self.errors = 0
+        self.completed = 0
+        self._since_change = 0      # results recorded since the limit last changed
+        self._lock = threading.Lock()
+
+    def record(self, latency, error=False):
+        # record one completed request (latency in seconds) and adjust the limit
+        with self._lock:
+            self.completed += 1
+            self._since_change += 1
+            if error:
+                self.errors += 1
+                self._decrease(0.75, "errors")
+                return
+
+            self.latency = latency if self.latency is None else \
+                self.smoothing * latency + (1 - self.smoothing) * self.latency
+            if self.baseline is None or self.latency < self.baseline:
+                self.baseline = self.latency
+
+            if self.latency > self.baseline * self.latency_factor:
+                self._decrease(0.9, f"latency {self.latency:.2f}s vs baseline {self.baseline:.2f}s")
+            elif self._since_change >= self.limit and self.limit < self.maximum:
+                # a full round at this limit went well - allow one more
+                self.limit += 1
+                self._since_change = 0
+
+    def _decrease(self, factor, reason):
+        # only back off once per round, so a burst of slow results from one round doesn't collapse the limit
+        if self._since_change < self.limit or self.limit <= self.minimum:
+            return
+        self.limit = max(self.minimum, int(self.limit * factor))
+        self._since_change = 0
+        log.debug(f"Concurrency reduced to {self.limit} ({reason})")
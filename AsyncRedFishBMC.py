@@ -0,0 +1,64 @@
+# AsyncRedFishBMC.py - asyncio front end for RedFishBMC
+#
+# RedFishBMC walks its discovery chain one GET at a time.  Most of that chain isn't really a chain - once the
+# Systems member is known, the Processors, Bios, Managers and ActionInfo subtrees don't depend on each other.
+# AsyncRedFishBMC runs those branches concurrently, and lets a single event loop keep hundreds of hosts in flight.
+#
+# The redfish library only has a blocking transport, so each request is dispatched to a worker pool owned by the
+# event loop; the loop (not the pool) decides how many hosts are in flight.
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from logging import getLogger
+
+from RedFishBMC import RedFishBMC, DISCOVERY_STEPS
+
+log = getLogger(__name__)
+
+
+class AsyncRedFishBMC(RedFishBMC):
+    # options are passed on to RedFishBMC (ie: session_cache, discovery_cache)
+    def __init__(self, hostname, username=None, password=None, executor=None, **options):
+        super().__init__(hostname, username=username, password=password, connect=False, **options)
+        self.executor = executor
+
+    @classmethod
+    async def open(cls, hostname, username=None, password=None, executor=None, discover=DISCOVERY_STEPS, **options):
+        # create, log in and run discovery - the awaitable equivalent of RedFishBMC(hostname, username, password)
+        bmc = cls(hostname, username=username, password=password, executor=executor, **options)
+        await bmc.run(bmc.open_client)
+        await bmc.run(bmc.login)
+        await bmc.run(bmc.check_firmware)
+        if discover:
+            await bmc.discover_async(discover)
+        return bmc
+
+    async def run(self, func, *args, **kwargs):
+        # run one of the blocking RedFishBMC methods on the executor
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, partial(func, *args, **kwargs))
+
+    async def discover_async(self, steps=DISCOVERY_STEPS):
+        # Systems must come first; everything else hangs off of it (or off the service root) and can run together
+        if any(step != "managers" for step in steps):
+            await self.run(self.discover_step, "system")
+        await asyncio.gather(*[self.run(self.discover_step, step) for step in self.pending_steps(steps)
+                               if step != "system"])
+
+    # awaitable versions of the RedFishBMC operations
+    async def change_settings_async(self, settings_dict):
+        return await self.run(self.change_settings, settings_dict)
+
+    async def reset_settings_to_default_async(self):
+        return await self.run(self.reset_settings_to_default)
+
+    async def reboot_async(self):
+        return await self.run(self.reboot)
+
+    async def close_async(self):
+        return await self.run(self.close)
+
+
+def async_executor(max_in_flight):
+    # each host in flight can have up to 4 discovery branches running at once
+    return ThreadPoolExecutor(max_workers=max_in_flight * 4, thread_name_prefix="redfish")
@@ -0,0 +1,146 @@
+# AttributeRegistry.py - check BIOS settings against the BMC's BIOS AttributeRegistry before sending them
+#
+# The registry describes every BIOS attribute: its type, the values it allows, whether it's read-only, and which other
+# settings make it read-only.  It's big and the same for every server of a manufacturer/model/bios version, so it's
+# fetched once, boiled down to an index by attribute name (see index_registry()), and cached on disk (see
+# BMCcache.RegistryCache).  A bad setting is then dropped before the PATCH instead of failing the whole PATCH.
+import re
+from logging import getLogger
+
+log = getLogger(__name__)
+
+
+class RegistryUnavailable(Exception):
+    # the BMC didn't answer for its registry (ie: a 503) - which isn't the same as it not having one
+    pass
+
+
+def index_registry(registry):
+    # the parts of a registry (the JSON document) that validation needs, keyed by attribute name
+    entries = registry.get('RegistryEntries', {})
+    attributes = dict()
+    for entry in entries.get('Attributes', []):
+        name = entry.get('AttributeName')
+        if name is None:
+            continue
+        attribute = {'type': entry.get('Type'),
+                     'read_only': bool(entry.get('ReadOnly') or entry.get('Immutable'))}
+        if entry.get('Type') == 'Enumeration':
+            attribute['values'] = [value.get('ValueName') for value in entry.get('Value', [])]
+        for field, key in (('LowerBound', 'min'), ('UpperBound', 'max'), ('MinLength', 'min_length'),
+                           ('MaxLength', 'max_length'), ('ValueExpression', 'pattern')):
+            if entry.get(field) is not None:
+                attribute[key] = entry[field]
+        attributes[name] = attribute
+
+    # dependencies that make an attribute read-only, depending on the values of others
+    dependencies = list()
+    for dependency in entries.get('Dependencies', []):
+        rule = dependency.get('Dependency', {})
+        if dependency.get('Type', 'Map') != 'Map' or rule.get('MapToProperty') not in ('ReadOnly', 'GrayOut') or \
+                rule.get('MapToValue') is not True:
+            continue
+        conditions = [{'attribute': condition.get('MapFromAttribute'),
+                       'condition': condition.get('MapFromCondition', 'EQU'),
+                       'value': condition.get('MapFromValue'),
+                       'terms': condition.get('MapTerms', 'AND')}
+                      for condition in rule.get('MapFrom', [])
+                      if condition.get('MapFromProperty', 'CurrentValue') == 'CurrentValue']
+        if len(conditions) > 0:
+            dependencies.append({'attribute': rule.get('MapToAttribute', dependency.get('DependencyFor')),
+                                 'conditions': conditions})
+    return {'registry': registry.get('Id'), 'attributes': attributes, 'dependencies': dependencies}
+
+
+CONDITIONS = {'EQU': lambda a, b: a == b,
+              'NEQ': lambda a, b: a != b,
+              'GTR': lambda a, b: a > b,
+              'GEQ': lambda a, b: a >= b,
+              'LSS': lambda a, b: a < b,
+              'LEQ': lambda a, b: a <= b}
+
+
+class AttributeRegistry(object):
+    def __init__(self, index):
+        self.name = index.get('registry')
+        self.attributes = index['attributes']
+        self.dependencies = index['dependencies']
+
+    def check_value(self, key, value):
+        # returns why the value can't be set, or None if it can
+        attribute = self.attributes.get(key)
+        if attribute is None:
+            return "not in the BIOS attribute registry"
+        if attribute['read_only']:
+            return "read-only"
+        kind = attribute['type']
+        if kind == 'Enumeration':
+            if value not in attribute['values']:
+                return f"{value} is not one of {', '.join(str(allowed) for allowed in attribute['values'])}"
+        elif kind == 'Integer':
+            if type(value) is not int:
+                return f"{value} is not an integer"
+            if value < attribute.get('min', value) or value > attribute.get('max', value):
+                return f"{value} is not between {attribute.get('min')} and {attribute.get('max')}"
+        elif kind == 'Boolean':
+            if type(value) is not bool:
+                return f"{value} is not true or false"
+        elif kind in ('String', 'Password'):
+            if type(value) is not str:
+                return f"{value} is not a string"
+            if not attribute.get('min_length', 0) <= len(value) <= attribute.get('max_length', len(value)):
+                return f"'{value}' is not {attribute.get('min_length', 0)}-{attribute.get('max_length')} characters"
+            try:
+                if 'pattern' in attribute and re.fullmatch(attribute['pattern'], value) is None:
+                    return f"'{value}' does not match {attribute['pattern']}"
+            except re.error:
+                pass    # not every BMC's expressions are valid python regexes
+        return None
+
+    def locked(self, values):
+        # the attributes that are read-only, given these (current plus desired) values
+        locked = set()
+        for dependency in self.dependencies:
+            result = None
+            for condition in dependency['conditions']:
+                try:
+                    met = CONDITIONS.get(condition['condition'], CONDITIONS['EQU'])(
+                        values.get(condition['attribute']), condition['value'])
+                except TypeError:
+                    met = False
+                if result is None:
+                    result = met
+                elif condition['terms'] == 'OR':
+                    result = result or met
+                else:
+                    result = result and met
+            if result:
+                locked.add(dependency['attribute'])
+        return locked
+
+    def validate(self, settings, current):
+        """
+        Check settings before they're sent to the BMC
+        :param settings: the desired settings {key: value}
+        :param current: the server's current BIOS settings
+        :return: (the settings that can be set, {key: why not} for the ones that can't)
+        """
+        valid = dict()
+        problems = dict()
+        for key, value in settings.items():
+            if key not in self.attributes and key in current:
+                valid[key] = value      # the registry is incomplete - let the BMC decide
+                continue
+            problem = self.check_value(key, value)
+            if problem is None:
+                valid[key] = value
+            else:
+                problems[key] = problem
+
+        # some settings are only read-only because of another setting's value (ie: sub-options of a disabled feature)
+        values = dict(current)
+        values.update(valid)
+        for key in self.locked(values) & set(valid):
+            problems[key] = "read-only with the other settings' values"
+            del valid[key]
+        return valid, problems
@@ -0,0 +1,174 @@
+# BMCTransport.py - the HTTP connections to the BMCs (see --bmc-connections)
+#
+# The redfish library gives each client a plain requests.Session.  BMC web servers are slow embedded stacks, and a TLS
+# handshake with one can take hundreds of milliseconds, so BMCTransport mounts an adapter on each client's session
+# that:
+#   - keeps a small pool of persistent (keep-alive) connections per BMC, and blocks rather than opening more than
+#     the per-host limit (many BMCs only allow a handful of connections),
+#   - resumes the last TLS session with the BMC when it does have to open a new connection, so the handshake is an
+#     abbreviated one, and
+#   - counts the connections opened and the handshakes done, so a run can report them (see summary()).
+import socket
+import ssl
+import threading
+import time
+import weakref
+from logging import getLogger
+
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+log = getLogger(__name__)
+
+
+class TransportStats(object):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.connections = 0
+        self.handshakes = 0
+        self.resumed = 0
+        self.handshake_time = 0.0
+        self.hosts = set()
+
+    def connection(self, host):
+        with self._lock:
+            self.connections += 1
+            self.hosts.add(host)
+
+    def handshake(self, resumed, elapsed):
+        with self._lock:
+            self.handshakes += 1
+            self.resumed += 1 if resumed else 0
+            self.handshake_time += elapsed
+
+    def as_dict(self):
+        with self._lock:
+            return {"hosts": len(self.hosts), "connections": self.connections, "tls_handshakes": self.handshakes,
+                    "tls_resumed": self.resumed, "tls_handshake_seconds": round(self.handshake_time, 3)}
+
+
+class ResumableSSLSocket(ssl.SSLSocket):
+    # with TLS 1.3 the session ticket arrives after the handshake, so the session is (also) picked up on close
+    def close(self):
+        self.context.remember(self)
+        super().close()
+
+
+class ResumingSSLContext(ssl.SSLContext):
+    # an SSLContext that offers each BMC the TLS session from our last connection to it.  Python only resumes a
+    # session when it's handed one, so the sessions are kept here, by peer address (BMCs are mostly reached by IP,
+    # so there's often no server_hostname).
+    sslsocket_class = ResumableSSLSocket
+
+    def __new__(cls, stats, resume=True):
+        return super().__new__(cls, ssl.PROTOCOL_TLS_CLIENT)
+
+    def __init__(self, stats, resume=True):
+        super().__init__()
+        # BMCs nearly all have self-signed certificates; the redfish library doesn't verify them either
+        self.check_hostname = False
+        self.verify_mode = ssl.CERT_NONE
+        self.stats = stats
+        self.resume = resume
+        self.sessions = dict()          # peer -> the last TLS session with it
+        self.last_sockets = dict()      # peer -> weakref to the last socket, whose session may have been updated
+        self._lock = threading.Lock()
+
+    def remember(self, sock):
+        if not self.resume:
+            return
+        try:
+            peer = sock.getpeername()[:2]
+            session = sock.session
+        except (OSError, ValueError):
+            return
+        if session is not None:
+            with self._lock:
+                self.sessions[peer] = session
+
+    def session_for(self, peer):
+        # an open connection may have had a newer session ticket since it was opened, so look at that first
+        with self._lock:
+            last = self.last_sockets.get(peer)
+            sock = last() if last is not None else None
+            session = sock.session if sock is not None else None     # None once it's closed
+            return session or self.sessions.get(peer)
+
+    def wrap_socket(self, sock, *args, **kwargs):
+        try:
+            peer = sock.getpeername()[:2]
+        except OSError:
+            peer = None
+        if self.resume and peer is not None and kwargs.get('session') is None:
+            kwargs['session'] = self.session_for(peer)
+        start = time.monotonic()
+        ssl_sock = super().wrap_socket(sock, *args, **kwargs)
+        self.stats.handshake(ssl_sock.session_reused, time.monotonic() - start)
+        if self.resume and peer is not None:
+            with self._lock:
+                if ssl_sock.session is not None:
+                    self.sessions[peer] = ssl_sock.session
+                self.last_sockets[peer] = weakref.ref(ssl_sock)
+        return ssl_sock
+
+
+def counting_pool(base, stats):
+    # a urllib3 connection pool class that counts the connections it opens
+    class CountingPool(base):
+        def _new_conn(self):
+            stats.connection(self.host)
+            log.debug(f"Opening connection {stats.connections} to {self.host}:{self.port}")
+            return super()._new_conn()
+    CountingPool.__name__ = "Counting" + base.__name__
+    return CountingPool
+
+
+class BMCAdapter(HTTPAdapter):
+    def __init__(self, transport):
+        self.transport = transport
+        # one BMC per session, so one pool; pool_block keeps us to the per-host connection limit
+        super().__init__(pool_connections=1, pool_maxsize=transport.connections, pool_block=True, max_retries=0)
+
+    def init_poolmanager(self, connections, maxsize, block=False, **pool_kwargs):
+        pool_kwargs['ssl_context'] = self.transport.ssl_context
+        super().init_poolmanager(connections, maxsize, block=block, **pool_kwargs)
+        self.poolmanager.pool_classes_by_scheme = self.transport.pool_classes
+        # TCP keep-alive, so an idle connection to a BMC isn't silently dropped by a firewall in between
+        self.poolmanager.connection_pool_kw['socket_options'] = \
+            HTTPConnectionPool.ConnectionCls.default_socket_options + [(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)]
+
+
+class BMCTransport(object):
+    def __init__(self, connections=2, keep_alive=True, tls_resume=True):
+        """
+        :param connections: the most connections open to any one BMC at once
+        :param keep_alive: reuse connections between requests.  If False, every request has a connection of its own
+            (for BMCs that mishandle persistent connections)
+        :param tls_resume: offer BMCs the previous TLS session when opening a new connection
+        """
+        self.connections = max(1, connections)
+        self.keep_alive = keep_alive
+        self.stats = TransportStats()
+        self.ssl_context = ResumingSSLContext(self.stats, resume=tls_resume)
+        self.pool_classes = {"http": counting_pool(HTTPConnectionPool, self.stats),
+                             "https": counting_pool(HTTPSConnectionPool, self.stats)}
+
+    def mount(self, session):
+        # route a requests.Session (ie: a redfish client's _session) through this transport
+        adapter = BMCAdapter(self)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        if not self.keep_alive:
+            session.headers["Connection"] = "close"
+        return session
+
+    def summary(self):
+        stats = self.stats.as_dict()
+        if stats["connections"] == 0:
+            return
+        per_host = stats["connections"] / max(1, stats["hosts"])
+        message = f"Opened {stats['connections']} connections to {stats['hosts']} BMCs ({per_host:.1f} per BMC)"
+        if stats["tls_handshakes"] > 0:
+            message += f", {stats['tls_handshakes']} TLS handshakes ({stats['tls_resumed']} resumed, " + \
+                       f"{stats['tls_handshake_seconds']:.1f}s in total)"
+        log.info(message)
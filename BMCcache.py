@@ -0,0 +1,237 @@
+# BMCcache.py - on-disk caches that let one bios_tool run pick up where the previous one left off
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+import threading
+import time
+from logging import getLogger
+
+log = getLogger(__name__)
+
+
+def cache_dir():
+    # ~/.cache/bios_tool (or under $XDG_CACHE_HOME), readable only by the user - the caches hold session tokens
+    path = os.path.join(os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")), "bios_tool")
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    return path
+
+
+def load_json(filename):
+    try:
+        with open(filename) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return dict()
+    except Exception as exc:
+        log.warning(f"Ignoring unreadable cache file {filename}: {exc}")
+        return dict()
+
+
+def save_json(filename, data):
+    # write atomically, with the file created 0600 from the start, so a reader never sees a partial file
+    fd, tmpname = tempfile.mkstemp(dir=os.path.dirname(filename), prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f)
+        os.replace(tmpname, filename)
+    except Exception:
+        os.unlink(tmpname)
+        raise
+
+
+def save_pickle(filename, data):
+    # same as save_json(), for the compiled config cache
+    fd, tmpname = tempfile.mkstemp(dir=os.path.dirname(filename), prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmpname, filename)
+    except Exception:
+        os.unlink(tmpname)
+        raise
+
+
+class ConfigCache(object):
+    # parsed copies of the config files (defaults-db.yml, bios_settings.yml), pickled so a repeat run doesn't parse
+    # the YAML again.  An entry is only used if the file's path, mtime and size all still match.
+    def __init__(self, directory=None):
+        self.directory = directory if directory is not None else os.path.join(cache_dir(), "config")
+        os.makedirs(self.directory, mode=0o700, exist_ok=True)
+
+    def _filename(self, path):
+        return os.path.join(self.directory, hashlib.sha1(path.encode()).hexdigest() + ".pickle")
+
+    @staticmethod
+    def _stamp(path):
+        stat = os.stat(path)
+        return stat.st_mtime_ns, stat.st_size
+
+    def get(self, inputfile):
+        path = os.path.abspath(inputfile)
+        try:
+            with open(self._filename(path), "rb") as f:
+                entry = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as exc:
+            log.warning(f"Ignoring unreadable config cache for {inputfile}: {exc}")
+            return None
+        if entry["path"] != path or entry["stamp"] != self._stamp(path):
+            return None
+        return entry["data"]
+
+    def put(self, inputfile, data):
+        path = os.path.abspath(inputfile)
+        try:
+            save_pickle(self._filename(path), {"path": path, "stamp": self._stamp(path), "data": data})
+        except Exception as exc:
+            log.warning(f"Unable to cache {inputfile}: {exc}")
+
+
+class SessionCache(object):
+    # RedFish session tokens (X-Auth-Token and session location), keyed by host and user, so that back-to-back runs
+    # can reuse live sessions instead of logging in again.  BMC sessions time out when idle, so each entry expires
+    # ttl seconds after it was last used.
+    def __init__(self, filename=None, ttl=25 * 60):
+        self.filename = filename if filename is not None else os.path.join(cache_dir(), "sessions.json")
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._sessions = load_json(self.filename)
+        self._changed = dict()      # entries added, refreshed or dropped (None) by this run
+
+    @staticmethod
+    def _key(host, user):
+        return f"{user}@{host}"
+
+    def get(self, host, user):
+        # returns (token, location), or None if there's no live session cached
+        with self._lock:
+            entry = self._sessions.get(self._key(host, user))
+        if entry is None or entry["expires"] < time.time():
+            return None
+        return entry["token"], entry["location"]
+
+    def put(self, host, user, token, location):
+        entry = {"token": token, "location": location, "expires": time.time() + self.ttl}
+        with self._lock:
+            self._sessions[self._key(host, user)] = entry
+            self._changed[self._key(host, user)] = entry
+
+    def forget(self, host, user):
+        with self._lock:
+            self._sessions.pop(self._key(host, user), None)
+            self._changed[self._key(host, user)] = None
+
+    def save(self):
+        # merge our changes into whatever is on disk now, in case another run has saved since we loaded
+        with self._lock:
+            sessions = load_json(self.filename)
+            for key, entry in self._changed.items():
+                if entry is None:
+                    sessions.pop(key, None)
+                else:
+                    sessions[key] = entry
+            now = time.time()
+            sessions = {key: entry for key, entry in sessions.items() if entry["expires"] >= now}
+            save_json(self.filename, sessions)
+            self._changed = dict()
+
+
+class DiscoveryCache(object):
+    # what RedFishBMC discovered about each host - the URIs of the resources it uses, and the last Bios payload along
+    # with its ETag - so the next run can go straight to the Bios resource and fetch it with If-None-Match.
+    # Each host has its own file, so hosts can be saved as they finish without rewriting everyone else's.
+    def __init__(self, directory=None):
+        self.directory = directory if directory is not None else os.path.join(cache_dir(), "discovery")
+        os.makedirs(self.directory, mode=0o700, exist_ok=True)
+
+    def _filename(self, host):
+        return os.path.join(self.directory, host.replace("/", "_").replace(":", "_") + ".json")
+
+    def get(self, host):
+        entry = load_json(self._filename(host))
+        return entry if len(entry) > 0 else None
+
+    def put(self, host, entry):
+        save_json(self._filename(host), entry)
+
+    def forget(self, host):
+        try:
+            os.unlink(self._filename(host))
+        except FileNotFoundError:
+            pass
+
+
+class ComplianceCache(object):
+    # hosts found to be compliant: for each host, the fingerprint of the desired settings it was checked against and
+    # the state of its Bios resource at the time (its ETag).  If both still match, the host needn't be checked again.
+    def __init__(self, filename=None):
+        self.filename = filename if filename is not None else os.path.join(cache_dir(), "compliance.json")
+        self._lock = threading.Lock()
+        self._hosts = load_json(self.filename)
+        self._changed = dict()
+
+    def is_compliant(self, host, desired, state):
+        with self._lock:
+            entry = self._hosts.get(host)
+        return entry is not None and entry["desired"] == desired and entry["state"] == state
+
+    def record(self, host, desired, state):
+        entry = {"desired": desired, "state": state}
+        with self._lock:
+            self._hosts[host] = entry
+            self._changed[host] = entry
+
+    def save(self):
+        with self._lock:
+            hosts = load_json(self.filename)
+            hosts.update(self._changed)
+            save_json(self.filename, hosts)
+            self._changed = dict()
+
+
+NO_REGISTRY_TTL = 24 * 60 * 60       # seconds to believe that a kind of BMC has no attribute registry
+
+
+class RegistryCache(object):
+    # BIOS attribute registries (indexed - see AttributeRegistry), one per manufacturer/model/bios version.  They're
+    # kept in memory for this run and on disk for the next; only the first host of each kind fetches its registry.
+    # An entry of None means that kind of BMC has no registry we can use.  That's only believed for a day, in case it
+    # was wrong.  fetch raises on failures that may be passing (ie: a 503), and those aren't cached at all, so the
+    # next host of the same kind tries again.
+    def __init__(self, directory=None):
+        self.directory = directory if directory is not None else os.path.join(cache_dir(), "registries")
+        os.makedirs(self.directory, mode=0o700, exist_ok=True)
+        self._lock = threading.Lock()
+        self._entries = dict()
+        self._fetching = dict()     # key -> lock held while one host fetches it
+
+    def _filename(self, key):
+        return os.path.join(self.directory, hashlib.sha1(json.dumps(key).encode()).hexdigest() + ".json")
+
+    def get(self, key, fetch):
+        """
+        :param key: (manufacturer, model, bios_version)
+        :param fetch: called to fetch the indexed registry if it isn't cached; returns None if there isn't one
+        """
+        key = list(key)
+        with self._lock:
+            if repr(key) in self._entries:
+                return self._entries[repr(key)]
+            fetching = self._fetching.setdefault(repr(key), threading.Lock())
+        with fetching:      # other hosts of the same kind wait for the first one
+            with self._lock:
+                if repr(key) in self._entries:
+                    return self._entries[repr(key)]
+            entry = load_json(self._filename(key))
+            if entry.get('key') == key and (entry['index'] is not None or
+                                            entry.get('saved', 0) > time.time() - NO_REGISTRY_TTL):
+                index = entry['index']
+            else:
+                index = fetch()
+                save_json(self._filename(key), {'key': key, 'index': index, 'saved': time.time()})
+            with self._lock:
+                self._entries[repr(key)] = index
+            return index
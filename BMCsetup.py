@@ -1,8 +1,8 @@
 # BMC setup.py - setup the BMC for the host; check for brand and ensure redfish and ipmi over lan are enabled
+import socket
 import time
 import subprocess
-
-from wekapyutils.wekassh import RemoteServer
+from concurrent.futures import ThreadPoolExecutor
 
 # from paramiko.util import log_to_file
 import logging
@@ -63,80 +63,155 @@ def get_ipmi_ip(channel=1):
                 if key.strip() == "IP Address":
                     return val.strip()
     except Exception as e:
-        log.error(f"Failed to run ipmitool: {e}, {e.stderr}")
+        log.error(f"Failed to run ipmitool: {e}, {getattr(e, 'stderr', '')}")
         log.error("Are you not running as 'root' and don't have passwordless sudo?")
     return None
 
 
-def bmc_setup(host, user, password):
+# the prompt each vendor's BMC shell ends with
+PROMPTS = (("system>", "Lenovo"), ("racadm>>", "Dell"), ("</>hpiLO->", "HPe"))
+
+
+class SetupResult(object):
+    # the outcome of bmc_setup() for one host
+    def __init__(self, host):
+        self.host = host
+        self.vendor = None
+        self.ok = False
+        self.message = None
+        self.elapsed = None
+
+    def failed(self, message):
+        log.error(f"{self.host}: {message}")
+        self.message = message
+        return self
+
+
+def read_until_prompt(shell, timeout=10.0):
+    # read the shell's output until it ends with one of the known prompts, or until timeout seconds have passed.
+    # Returns (vendor, output); vendor is None if no known prompt was seen.
+    deadline = time.monotonic() + timeout
+    output = ""
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        shell.settimeout(remaining)
+        try:
+            data = shell.recv(4096)
+        except socket.timeout:
+            break
+        if not data:    # the BMC closed the channel
+            break
+        output += data.decode("utf-8", errors="replace")
+        stripped = output.strip()
+        for prompt, vendor in PROMPTS:
+            if stripped.endswith(prompt):
+                return vendor, stripped
+    return None, output.strip()
+
+
+def bmc_setup(host, user, password, timeout=10.0):
     # check for brand and ensure redfish and ipmi over lan are enabled
     # enable redfish
     # enable ipmi over lan
-    # return True if all is well, False if not
-
-
+    # returns a SetupResult
+    from wekapyutils.wekassh import RemoteServer     # paramiko is slow to import, and only needed here
+    result = SetupResult(host)
+    start = time.monotonic()
     ssh_sess = RemoteServer(host)
 
     ssh_sess.user = user
     ssh_sess.password = password
     ssh_sess.kwargs = {"allow_agent": False, "look_for_keys": False}
-    #ssh_sess.connect(allow_agent=False, look_for_keys=False)
-    ssh_sess.connect()
-    shell = ssh_sess.invoke_shell()
-    time.sleep(0.5)
-    output = shell.recv(500).strip().decode("utf-8")
-
-    # try Lenovo:
-    if output.endswith("system>"):
-        log.info(f"Lenovo server detected at {host}")
-        # To effectively enable this service, you must ensure that 'ipmi' is selected in the '-ai' option of the 'users' command.
-        ssh_sess.run("portcontrol -ipmi on") # lenovo
-        # try to find our user id number - it doesn't take names
-        user_id = None
-        ssh_sess.run(f"users")
-        all_users = ssh_sess.output.stdout.splitlines()
-        for line in all_users:
-            if user in line:
-                user_id = line.split()[0].strip()
-                #print(f"Lenovo host {host}: {user_id}")
-                break
-
-        if user_id is None:
-            log.error(f"Lenovo server {host}: Unable to determine user_id")
-            return False
-        ret = ssh_sess.run(f"users -{user_id} -ai web|redfish|ssh|ipmi")
-        message = lenovo_parse_return(ret.stdout)
-        if message != "ok":
-            log.error(f"Lenovo server {host}: Error enabling IPMI over LAN: {message}")
-    elif output.endswith("racadm>>"):  # Dell
-        log.info(f"Dell server detected at {host}")
-        # ret.stdout starts with ERROR: if there's a problem. status is always 0
-        ret = ssh_sess.run("racadm set iDRAC.Redfish.Enable Enabled")
-        if ret.stdout.startswith("ERROR:"):
-            log.error(f"Error enabling RedFish on {host}: {ret.stdout}")
-            return False
-        ret = ssh_sess.run("racadm set iDRAC.IPMIlan.Enable Enabled")
-        if ret.stdout.startswith("ERROR:"):
-            log.error(f"Error enabling IPMIlan on {host}: {ret.stdout}")
-            return False
-        return True
-    elif output.endswith("</>hpiLO->"): # HPe
-        log.info(f"HPe server detected at {host}")
-        # HPe:
-        # set /map1/config1 oemHPE_ipmi_dcmi_overlan_enable=yes
-        # redfish appears to always be set to enabled
-        # might be able to do this via RedFish...
-        ret = ssh_sess.run("set /map1/config1 oemHPE_ipmi_dcmi_overlan_enable=yes")
-        parsed_ret = hpe_string_to_dict(ret.stdout)
-        if len(parsed_ret) > 0 and parsed_ret["status"] != "0":
-            log.error(f"Error enabling IPMI over LAN on {host}: {parsed_ret['message']}")
-            return False
-    else:
-        log.error(f"Unknown BMC type detected at {host}")
-        return False
-    ssh_sess.run("exit")
-    return True
+    ssh_sess.___interactive = False     # never prompt for credentials - we may be one of many hosts at once
+    try:
+        ssh_sess.connect()
+        if not ssh_sess.connected:
+            return result.failed("Unable to ssh to the BMC")
+        shell = ssh_sess.invoke_shell()
+        result.vendor, output = read_until_prompt(shell, timeout=timeout)
+        if result.vendor is None:
+            return result.failed(f"Unknown BMC type detected (no known prompt after {timeout} seconds)")
+        log.info(f"{result.vendor} server detected at {host}")
+        setup = {"Lenovo": lenovo_setup, "Dell": dell_setup, "HPe": hpe_setup}[result.vendor]
+        message = setup(ssh_sess, host, user)
+        if message is not None:
+            return result.failed(message)
+        ssh_sess.run("exit")
+        result.ok = True
+        return result
+    except Exception as exc:
+        return result.failed(f"Error configuring the BMC: {exc}")
+    finally:
+        result.elapsed = time.monotonic() - start
+        if ssh_sess.connected:
+            try:
+                ssh_sess.close()
+            except Exception:
+                pass
+
+
+# each vendor's setup returns None if all is well, or an error message
+def lenovo_setup(ssh_sess, host, user):
+    # To effectively enable this service, you must ensure that 'ipmi' is selected in the '-ai' option of the 'users' command.
+    ssh_sess.run("portcontrol -ipmi on") # lenovo
+    # try to find our user id number - it doesn't take names
+    user_id = None
+    ssh_sess.run(f"users")
+    all_users = ssh_sess.output.stdout.splitlines()
+    for line in all_users:
+        if user in line:
+            user_id = line.split()[0].strip()
+            #print(f"Lenovo host {host}: {user_id}")
+            break
+
+    if user_id is None:
+        return "Unable to determine user_id"
+    ret = ssh_sess.run(f"users -{user_id} -ai web|redfish|ssh|ipmi")
+    message = lenovo_parse_return(ret.stdout)
+    if message != "ok":
+        return f"Error enabling IPMI over LAN: {message}"
+    return None
+
+
+def dell_setup(ssh_sess, host, user):
+    # ret.stdout starts with ERROR: if there's a problem. status is always 0
+    ret = ssh_sess.run("racadm set iDRAC.Redfish.Enable Enabled")
+    if ret.stdout.startswith("ERROR:"):
+        return f"Error enabling RedFish: {ret.stdout}"
+    ret = ssh_sess.run("racadm set iDRAC.IPMIlan.Enable Enabled")
+    if ret.stdout.startswith("ERROR:"):
+        return f"Error enabling IPMIlan: {ret.stdout}"
+    return None
+
+
+def hpe_setup(ssh_sess, host, user):
+    # HPe:
+    # set /map1/config1 oemHPE_ipmi_dcmi_overlan_enable=yes
+    # redfish appears to always be set to enabled
+    # might be able to do this via RedFish...
+    ret = ssh_sess.run("set /map1/config1 oemHPE_ipmi_dcmi_overlan_enable=yes")
+    parsed_ret = hpe_string_to_dict(ret.stdout)
+    if len(parsed_ret) > 0 and parsed_ret["status"] != "0":
+        return f"Error enabling IPMI over LAN: {parsed_ret.get('message')}"
+    return None
+
+
+def parallel_bmc_setup(hosts, workers=10, timeout=10.0):
+    # run bmc_setup() on hosts [(host, user, password), ...], workers at a time.  Returns the SetupResults in order.
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bmc_setup") as executor:
+        return list(executor.map(lambda host: bmc_setup(*host, timeout=timeout), hosts))
+
 
+def print_setup_report(results):
+    from tabulate import tabulate
+    print(tabulate([[result.host, result.vendor or "", "ok" if result.ok else "FAILED",
+                     f"{result.elapsed:.1f}" if result.elapsed is not None else "", result.message or ""]
+                    for result in results], headers=["Host", "Vendor", "Result", "Seconds", "Message"]))
+    failed = [result for result in results if not result.ok]
+    print()
+    print(f"{len(results) - len(failed)} BMCs configured, {len(failed)} failed")
 
 
 if __name__ == '__main__':
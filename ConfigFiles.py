@@ -0,0 +1,84 @@
+# ConfigFiles.py - load the host config, bios settings and defaults database files (CSV or YAML)
+import os
+from logging import getLogger
+
+from BMCcache import ConfigCache
+
+log = getLogger(__name__)
+
+
+def csv_load(f):
+    """
+    Load a CSV file into a list of dictionaries
+    :param f: file object
+    :return: list of dictionaries
+    """
+    import csv
+    reader = None
+    exc = None
+    try:
+        reader = csv.DictReader(f)
+    except Exception as exc:
+        #log.error(f"Error reading CSV file: {exc}")
+        return None, exc
+    return {"hosts":list(reader)}, exc
+
+def yaml_load(f):
+    # yaml is imported here, so a run whose files all come from the ConfigCache never loads it
+    import yaml
+    data = None
+    exc = None
+    try:
+        # use libyaml's C loader if PyYAML was built with it - it's many times faster on the big defaults database
+        data = yaml.load(f, Loader=getattr(yaml, "CUnsafeLoader", yaml.UnsafeLoader))
+    except Exception as error:
+        exc = error     # (exc itself is unset at the end of the except block)
+        #log.error(f"Error reading YAML file: {exc}")
+        #raise
+    return data, exc
+
+# tell CSV from YAML by the file extension, or failing that by the first line that isn't blank or a comment
+def config_format(inputfile, f):
+    extension = os.path.splitext(inputfile)[1].lower()
+    if extension == ".csv":
+        return "csv"
+    if extension in (".yml", ".yaml"):
+        return "yaml"
+    for line in f:
+        line = line.strip()
+        if len(line) > 0 and not line.startswith("#"):
+            f.seek(0)
+            return "yaml" if ":" in line or line.startswith("-") else "csv"
+    f.seek(0)
+    return "yaml"
+
+config_cache = None
+
+# load a config file - either CSV or YAML
+# With cache=True, the parsed file is kept in the ConfigCache and reused until the file changes.  This is for the
+# big files (the defaults database and bios settings), not host configs, which contain passwords.
+def load_config(inputfile, cache=False):
+    global config_cache
+    data = None
+    if cache:
+        if config_cache is None:
+            config_cache = ConfigCache()
+        data = config_cache.get(inputfile)
+        if data is not None:
+            return data
+
+    try:
+        f = open(inputfile)
+    except Exception as exc:
+        raise
+    with f:
+        if config_format(inputfile, f) == "csv":
+            data, exc = csv_load(f)
+        else:
+            data, exc = yaml_load(f)
+    if type(data) is not dict:   # both loaders return a dict; if not a dict, it's an error reading file
+        log.error(f"Error reading config file: {exc}")
+        return None
+    if cache:
+        config_cache.put(inputfile, data)
+    return data
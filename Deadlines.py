@@ -0,0 +1,309 @@
+# Deadlines.py - time limits for the RedFish requests to each BMC (see --request-timeout and friends)
+#
+# Once logged in, a request would otherwise wait as long as the BMC likes - a BMC that hangs mid-GET or mid-PATCH
+# held a worker thread (and so the run) forever.  Instead:
+#   - every request has a timeout: GETs get --request-timeout, the BIOS PATCH --patch-timeout and the reset POSTs
+#     --reset-timeout, as BMCs can take a long time over those last two,
+#   - each discovery step, with all its requests and retries, has to finish within --discovery-timeout, and
+#   - each host gets --host-timeout seconds of requests in all, so a BMC that is slow at everything is given up on.
+# GETs are idempotent, so a failed GET is retried (within those limits), and one that runs far past the fleet's p95
+# latency is hedged: it's sent again on another connection, and whichever answer comes back first is used.
+# A BMC that fails several requests in a row (with an error, or a 5xx answer other than the "busy" ones RateShaper
+# backs off from) trips its circuit breaker.  Its requests then fail straight away rather
+# than each waiting out a timeout, until the breaker lets one through again to see if the BMC has come back.
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED, TimeoutError as FutureTimeout
+from contextlib import contextmanager
+from logging import getLogger
+
+from RateShaper import BUSY_STATUSES
+
+log = getLogger(__name__)
+
+RETRY_PAUSE = 1.0           # seconds between attempts at a GET, as the redfish library did
+HEDGE_WORKERS = 128         # threads sending requests at once, if Deadlines isn't told (see workers below)
+
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+
+class CircuitOpen(ConnectionError):
+    pass
+
+
+class LatencyWindow(object):
+    # the latency of the fleet's recent GETs; the p95 is recalculated every so often rather than on every request
+    def __init__(self, size=1000, min_samples=20, every=50):
+        self.samples = deque(maxlen=size)
+        self.min_samples = min_samples
+        self.every = every
+        self._since = 0
+        self._p95 = None
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            self.samples.append(seconds)
+            self._since += 1
+            if len(self.samples) >= self.min_samples and (self._p95 is None or self._since >= self.every):
+                ordered = sorted(self.samples)
+                self._p95 = ordered[int(len(ordered) * 0.95)]
+                self._since = 0
+
+    def p95(self):
+        return self._p95      # None until there are enough samples
+
+
+class CircuitBreaker(object):
+    def __init__(self, host, failures=3, reset_after=60.0):
+        self.host = host
+        self.limit = failures
+        self.reset_after = reset_after
+        self.failures = 0
+        self.opened = None          # when it tripped
+        self.trial = False          # a request has been let through to see if the BMC is back
+        self.trips = 0
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        return self.opened is not None
+
+    def check(self):
+        # raises CircuitOpen if the BMC's requests shouldn't be sent
+        with self._lock:
+            if self.opened is None:
+                return
+            if self.trial or time.monotonic() - self.opened < self.reset_after:
+                raise CircuitOpen(f"{self.host} failed {self.failures} requests in a row; not trying it again yet")
+            self.trial = True
+
+    def success(self):
+        with self._lock:
+            if self.opened is not None:
+                log.info(f"{self.host} is answering again")
+            self.failures = 0
+            self.opened = None
+            self.trial = False
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            self.trial = False
+            if self.failures >= self.limit:
+                if self.opened is None:
+                    self.trips += 1
+                    log.warning(f"{self.host} failed {self.failures} requests in a row; giving up on it for " +
+                                f"{self.reset_after:.0f} seconds")
+                self.opened = time.monotonic()
+
+
+class HostBudget(object):
+    # one BMC's share of the limits: its circuit breaker, the request time it has used, and the deadline of the
+    # phase (ie: discovery step) that each thread working on it is in
+    def __init__(self, deadlines, host, hedge=True):
+        self.deadlines = deadlines
+        self.host = host
+        self.hedge = hedge          # hedging needs a second connection to the BMC
+        self.breaker = deadlines.breaker(host)
+        self.spent = 0.0
+        self._current = threading.local()
+        self._lock = threading.Lock()
+
+    def restart(self):
+        # start the host's budget over (ie: for each round of a long-running watch)
+        with self._lock:
+            self.spent = 0.0
+
+    def spend(self, seconds):
+        with self._lock:
+            self.spent += seconds
+
+    @contextmanager
+    def phase(self, name):
+        # nested phases (ie: a discovery step that needs another one done first) share the outer one's deadline
+        if getattr(self._current, "phase", None) is not None:
+            yield
+            return
+        self._current.phase = (name, time.monotonic() + self.deadlines.budgets[name])
+        try:
+            yield
+        finally:
+            self._current.phase = None
+
+    def timeout(self, method):
+        # how long the next request may take - raises DeadlineExceeded if there's no time left for it
+        timeout = self.deadlines.timeouts.get(method, self.deadlines.timeouts["GET"])
+        remaining = self.deadlines.host_timeout - self.spent
+        if remaining <= 0:
+            self.deadlines.count("deadlines")
+            raise DeadlineExceeded(f"{self.host} has used its {self.deadlines.host_timeout:.0f} seconds of requests")
+        timeout = min(timeout, remaining)
+        phase = getattr(self._current, "phase", None)
+        if phase is not None:
+            name, deadline = phase
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self.deadlines.count("deadlines")
+                raise DeadlineExceeded(f"{self.host} took longer than {self.deadlines.budgets[name]:.0f} seconds " +
+                                       f"over {name}")
+            timeout = min(timeout, remaining)
+        return timeout
+
+
+class Deadlines(object):
+    def __init__(self, request=30.0, patch=300.0, reset=120.0, discovery=120.0, host=900.0, retries=2, hedge=True,
+                 hedge_factor=3.0, hedge_min=1.0, breaker_failures=3, breaker_reset=60.0, workers=HEDGE_WORKERS):
+        """
+        :param request: seconds each GET may take
+        :param patch: seconds a PATCH (of the BIOS settings) may take
+        :param reset: seconds a POST (ie: a BIOS or system reset) may take
+        :param discovery: seconds each discovery step may take, with all of its requests and retries
+        :param host: seconds of requests each host may use in all
+        :param retries: how many times a failed GET is tried again.  Other requests are never resent.
+        :param hedge: send a second copy of GETs that run long, and use whichever answer comes first
+        :param hedge_factor: hedge a GET once it has taken this many times the fleet's p95 GET latency ...
+        :param hedge_min: ... and at least this many seconds
+        :param breaker_failures: stop sending requests to a BMC after this many failures in a row ...
+        :param breaker_reset: ... for this many seconds
+        :param workers: the most threads that may be sending requests at once.  The hedging pool has room for a copy
+            of a GET from each of them, and a hedge of each.
+        """
+        self.timeouts = {"GET": request, "PATCH": patch, "POST": reset}
+        self.budgets = {"discovery": discovery}
+        self.host_timeout = host
+        self.retries = retries
+        self.hedging = hedge
+        self.hedge_factor = hedge_factor
+        self.hedge_min = hedge_min
+        self.breaker_failures = breaker_failures
+        self.breaker_reset = breaker_reset
+        self.latency = LatencyWindow()
+        self.breakers = dict()
+        self.workers = workers
+        self.counts = {"hedges": 0, "hedges_won": 0, "retries": 0, "deadlines": 0}
+        self._pool = None
+        self._slots = threading.BoundedSemaphore(workers * 2)     # free threads in the pool
+        self._lock = threading.Lock()
+
+    def host(self, hostname, hedge=True):
+        return HostBudget(self, hostname, hedge=hedge)
+
+    def breaker(self, hostname):
+        # one breaker per BMC, shared by every RedFishBMC opened to it
+        with self._lock:
+            if hostname not in self.breakers:
+                self.breakers[hostname] = CircuitBreaker(hostname, self.breaker_failures, self.breaker_reset)
+            return self.breakers[hostname]
+
+    def count(self, name):
+        with self._lock:
+            self.counts[name] += 1
+
+    def send(self, budget, method, send):
+        # send(timeout) makes the request once and returns the response.  GETs are retried and hedged; other
+        # requests aren't idempotent, so they're sent just once.
+        attempts = 1 + (self.retries if method == "GET" else 0)
+        if method == "GET":
+            send = self.timed(send)
+        for attempt in range(attempts):
+            budget.breaker.check()
+            timeout = budget.timeout(method)
+            start = time.monotonic()
+            try:
+                if method == "GET" and self.hedging and budget.hedge:
+                    resp = self.hedged(budget, send, timeout)
+                else:
+                    resp = send(timeout)
+            except Exception as exc:
+                budget.spend(time.monotonic() - start)
+                budget.breaker.failure()
+                if attempt + 1 >= attempts:
+                    raise
+                # the redfish library's RetriesExhaustedError says nothing itself; what went wrong is its cause
+                log.debug(f"{budget.host}: retrying a {method} after: {exc.__cause__ if str(exc) == '' else exc}")
+                self.count("retries")
+                time.sleep(RETRY_PAUSE)
+                continue
+            budget.spend(time.monotonic() - start)
+            if resp.status >= 500 and resp.status not in BUSY_STATUSES:
+                # the BMC answered, but it's broken
+                budget.breaker.failure()
+            else:
+                budget.breaker.success()
+            return resp
+
+    def timed(self, send):
+        # the fleet's GET latency is measured for each copy of a request that's answered, from when it was sent
+        def timed_send(timeout):
+            start = time.monotonic()
+            resp = send(timeout)
+            self.latency.record(time.monotonic() - start)
+            return resp
+        return timed_send
+
+    def hedge_after(self):
+        p95 = self.latency.p95()
+        return None if p95 is None else max(self.hedge_min, p95 * self.hedge_factor)
+
+    def hedged(self, budget, send, timeout):
+        hedge_after = self.hedge_after()
+        if hedge_after is None or hedge_after >= timeout:
+            return send(timeout)
+        # the first copy goes to the pool too, so we can stop waiting for it.  If the pool is full, it's sent (unhedged)
+        # from this thread instead - it's never queued behind other hosts' requests.
+        first = self.submit(send, timeout)
+        if first is None:
+            return send(timeout)
+        try:
+            return first.result(timeout=hedge_after)
+        except FutureTimeout:
+            pass
+        log.debug(f"{budget.host}: no answer after {hedge_after:.1f}s; sending the request again")
+        self.count("hedges")
+        second = self.submit(send, timeout - hedge_after)
+        if second is None:
+            return first.result()
+        pending = {first, second}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is second:
+                        self.count("hedges_won")
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    def submit(self, send, timeout):
+        # send the request from the hedging pool - returns its Future, or None if the pool has no thread free
+        if not self._slots.acquire(blocking=False):
+            return None
+        future = self.pool().submit(send, timeout)
+        future.add_done_callback(lambda future: self._slots.release())
+        return future
+
+    def pool(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.workers * 2, thread_name_prefix="hedge")
+            return self._pool
+
+    def summary(self):
+        tripped = sorted(host for host, breaker in self.breakers.items() if breaker.trips > 0)
+        if self.counts["hedges"] > 0:
+            log.info(f"Hedged {self.counts['hedges']} slow requests ({self.counts['hedges_won']} answered first by " +
+                     f"the second copy)")
+        if self.counts["deadlines"] > 0:
+            log.warning(f"{self.counts['deadlines']} requests were not sent because their host ran out of time")
+        if len(tripped) > 0:
+            log.warning(f"Gave up on {len(tripped)} unresponsive BMCs: {', '.join(tripped[:10])}" +
+                        (", ..." if len(tripped) > 10 else ""))
+
+
+# used by RedFishBMCs that aren't given any
+default_deadlines = Deadlines()
@@ -0,0 +1,174 @@
+# DefaultsDB.py - the factory-defaults database (see --save-defaults and --diff-defaults)
+#
+# Two storage formats:
+#   - a single YAML file (defaults-db.yml) - simple to read and edit, but every change rewrites the whole thing (under
+#     a lock, so concurrent runs saving to it don't lose each other's models)
+#   - a sharded directory, one YAML file per model: <dir>/<manufacturer>/<arch>/<model>.yml.  Looking up a model
+#     reads only that model's file, and saving a model writes only that file, so databases with many models stay
+#     fast and concurrent runs only contend when they save the same model.
+# open_defaults_db() picks the format from the path: a .yml/.yaml file, or anything else as a directory.
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+from logging import getLogger
+from urllib.parse import quote, unquote
+
+from ConfigFiles import load_config
+
+log = getLogger(__name__)
+
+HEADER = '# Bios Defaults Database\n# This should contain the default/factory reset values\n'
+
+
+def open_defaults_db(path):
+    if os.path.splitext(path)[1].lower() in (".yml", ".yaml"):
+        return YamlDefaultsDB(path)
+    return ShardedDefaultsDB(path)
+
+
+def atomic_write_yaml(filename, data):
+    # write to a temp file in the same directory and rename it into place, so readers never see a partial file
+    import yaml
+    fd, tmpname = tempfile.mkstemp(dir=os.path.dirname(filename) or ".", prefix=".tmp-", suffix=".yml")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(HEADER)
+            yaml.dump(data, f, default_flow_style=False, Dumper=getattr(yaml, "CDumper", yaml.Dumper))
+        os.chmod(tmpname, 0o644)
+        os.replace(tmpname, filename)
+    except Exception:
+        os.unlink(tmpname)
+        raise
+
+
+@contextmanager
+def file_lock(filename):
+    # an exclusive lock on <filename>.lock, held by a run while it reads, changes and rewrites filename
+    import fcntl
+    with open(filename + ".lock", "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+class YamlDefaultsDB(object):
+    # the whole database in one YAML file; changes are kept in memory until save()
+    def __init__(self, filename):
+        self.filename = filename
+        self.changes = dict()       # (manufacturer, arch, model) -> settings, for the models put() since the last save
+        self._lock = threading.Lock()
+        try:
+            self.db = load_config(filename, cache=True)
+        except FileNotFoundError:  # it's ok if it doesn't exist - we'll create it
+            log.info(f"Bios database {filename} does not exist, creating")
+            self.db = None
+        if self.db is None:
+            self.db = dict()
+
+    def has(self, *path):
+        # has("Dell Inc."), has("Dell Inc.", "AMD") or has("Dell Inc.", "AMD", "PowerEdge R6615")
+        level = self.db
+        for name in path:
+            if type(level) is not dict or name not in level:
+                return False
+            level = level[name]
+        return True
+
+    def get(self, manufacturer, arch, model):
+        return self.db.get(manufacturer, {}).get(arch, {}).get(model, None)
+
+    def put(self, manufacturer, arch, model, settings):
+        with self._lock:
+            self.db.setdefault(manufacturer, dict()).setdefault(arch, dict())[model] = settings
+            self.changes[(manufacturer, arch, model)] = settings
+
+    def save(self):
+        # another run may have saved since we loaded the file, so our changes are made to it as it is now
+        with self._lock:
+            if len(self.changes) == 0:
+                return
+            with file_lock(self.filename):
+                try:
+                    db = load_config(self.filename)
+                except FileNotFoundError:
+                    db = None
+                if db is None:
+                    db = dict()
+                for (manufacturer, arch, model), settings in self.changes.items():
+                    db.setdefault(manufacturer, dict()).setdefault(arch, dict())[model] = settings
+                atomic_write_yaml(self.filename, db)
+            self.db = db
+            self.changes = dict()
+
+    def models(self):
+        # (manufacturer, arch, model) for everything in the database
+        for manufacturer, archs in self.db.items():
+            for arch, models in archs.items():
+                for model in models:
+                    yield manufacturer, arch, model
+
+
+class ShardedDefaultsDB(object):
+    # one YAML file per model; put() writes that model's file immediately
+    def __init__(self, directory):
+        self.directory = directory
+        self._loaded = dict()
+        if not os.path.isdir(directory):
+            log.info(f"Bios database {directory} does not exist, creating")
+            os.makedirs(directory, exist_ok=True)
+
+    def _path(self, *path):
+        # names can contain anything (ie: '/'), so quote them to make safe file names
+        names = [quote(str(name), safe=" -_.,()+") for name in path]
+        if len(names) == 3:
+            names[2] += ".yml"
+        return os.path.join(self.directory, *names)
+
+    def has(self, *path):
+        return os.path.exists(self._path(*path))
+
+    def get(self, manufacturer, arch, model):
+        key = (manufacturer, arch, model)
+        if key not in self._loaded:
+            try:
+                self._loaded[key] = load_config(self._path(*key), cache=True)
+            except FileNotFoundError:
+                self._loaded[key] = None
+        return self._loaded[key]
+
+    def put(self, manufacturer, arch, model, settings):
+        filename = self._path(manufacturer, arch, model)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        atomic_write_yaml(filename, settings)
+        self._loaded[(manufacturer, arch, model)] = settings
+
+    def save(self):
+        pass    # put() has already written everything
+
+    def models(self):
+        for manufacturer in sorted(os.listdir(self.directory)):
+            mfr_dir = os.path.join(self.directory, manufacturer)
+            if manufacturer.startswith(".") or not os.path.isdir(mfr_dir):
+                continue
+            for arch in sorted(os.listdir(mfr_dir)):
+                arch_dir = os.path.join(mfr_dir, arch)
+                if not os.path.isdir(arch_dir):
+                    continue
+                for model_file in sorted(os.listdir(arch_dir)):
+                    if model_file.endswith(".yml") and not model_file.startswith("."):
+                        yield unquote(manufacturer), unquote(arch), unquote(model_file[:-4])
+
+
+def convert_defaults_db(source, destination):
+    # copy every model from one defaults database to another (ie: from defaults-db.yml to a sharded directory)
+    source_db = open_defaults_db(source)
+    destination_db = open_defaults_db(destination)
+    count = 0
+    for manufacturer, arch, model in source_db.models():
+        destination_db.put(manufacturer, arch, model, source_db.get(manufacturer, arch, model))
+        count += 1
+    destination_db.save()
+    return count
@@ -0,0 +1,135 @@
+# FleetDiff.py - compare the BIOS settings of a whole fleet at once (see --fleet-diff)
+#
+# Rather than diffing hosts pairwise, each host's settings are fingerprinted and hosts with identical settings are
+# grouped into a cluster ("configuration").  Hosts are only compared within the same manufacturer/arch/model.
+# The settings that differ between the configurations are then reported, along with how many hosts differ from
+# the most common value.
+import json
+import re
+from collections import Counter
+from logging import getLogger
+
+from RedFishBMC import settings_fingerprint as fingerprint
+
+log = getLogger(__name__)
+
+
+# settings known to identify a host rather than configure it, so they're left out of the comparison: these, and any
+# setting whose name matches one of the patterns (serial numbers, service and asset tags, MAC addresses, UUIDs)
+IDENTITY_SETTINGS = ("SerialNumber", "SystemServiceTag", "ServiceTag")
+# (they end the name, so ie: SerialConsolePort or AssetTagProtection are still compared)
+IDENTITY_PATTERNS = re.compile(r"(serial_?(number|num|no)|service_?tag|asset_?tag|mac_?addr(ess)?|(^|_)mac|uuid)$",
+                               re.IGNORECASE)
+
+
+def is_identity_setting(setting):
+    return setting in IDENTITY_SETTINGS or IDENTITY_PATTERNS.search(setting) is not None
+
+
+def normalized_settings(server):
+    # Supermicro keys carry a _XXXX suffix that changes between BIOS versions - compare on the trimmed keys
+    if server.manufacturer == "Supermicro":
+        return server.bmc.trimmed_bios_settings()
+    return server.bios_settings
+
+
+def config_label(index):
+    # A, B, ... Z, AA, AB, ...
+    label = ""
+    index += 1
+    while index > 0:
+        index, remainder = divmod(index - 1, 26)
+        label = chr(ord("A") + remainder) + label
+    return label
+
+
+def fleet_diff(servers):
+    """
+    Cluster the servers by their BIOS settings
+    :param servers: list of connected Servers
+    :return: list of dicts, one per manufacturer/arch/model, with its configurations and the settings that differ
+    """
+    groups = dict()
+    for server in servers:
+        key = (server.manufacturer, server.arch, server.model)
+        groups.setdefault(key, list()).append((server.hostname, normalized_settings(server)))
+
+    report = list()
+    for (manufacturer, arch, model), hosts in groups.items():
+        # settings that identify a host rather than configure it (ie: SystemServiceTag) have a different value on
+        # every host - leave them out, or every host would be its own configuration.  Other settings that differ on
+        # every host are still compared, as that may well be drift, but are pointed out.
+        values = dict()
+        for _, settings in hosts:
+            for setting, value in settings.items():
+                values.setdefault(setting, Counter())[value] += 1
+        identity = sorted(setting for setting in values if is_identity_setting(setting))
+        unique = sorted(setting for setting, counts in values.items()
+                        if setting not in identity and len(hosts) > 2 and len(counts) == len(hosts))
+
+        clusters = dict()
+        for hostname, settings in hosts:
+            relevant = {setting: value for setting, value in settings.items() if setting not in identity}
+            cluster = clusters.setdefault(fingerprint(relevant), {"hosts": list(), "settings": relevant})
+            cluster["hosts"].append(hostname)
+
+        configs = sorted(clusters.items(), key=lambda item: len(item[1]["hosts"]), reverse=True)
+        configs = [{"config": config_label(index), "fingerprint": fp, "hosts": cluster["hosts"],
+                    "settings": cluster["settings"]} for index, (fp, cluster) in enumerate(configs)]
+
+        # the settings that aren't the same in every configuration, and how many hosts differ from the usual value
+        divergent = list()
+        all_settings = set()
+        for config in configs:
+            all_settings.update(config["settings"].keys())
+        for setting in sorted(all_settings):
+            by_config = {config["config"]: config["settings"].get(setting, None) for config in configs}
+            if len(set(by_config.values())) <= 1:
+                continue
+            counts = Counter()
+            for config in configs:
+                counts[config["settings"].get(setting, None)] += len(config["hosts"])
+            usual, usual_count = counts.most_common(1)[0]
+            divergent.append({"setting": setting, "usual": usual, "hosts_differing": len(hosts) - usual_count,
+                              "values": by_config})
+
+        report.append({"manufacturer": manufacturer, "arch": arch, "model": model, "hosts": len(hosts),
+                       "ignored_settings": identity,
+                       "unique_settings": unique,
+                       "configs": [{key: config[key] for key in ("config", "fingerprint", "hosts")}
+                                   for config in configs],
+                       "divergent_settings": divergent})
+    return report
+
+
+def print_fleet_diff(report, as_json=False):
+    from tabulate import tabulate
+    if as_json:
+        print(json.dumps(report, indent=4))
+        return
+
+    for group in report:
+        configs = group["configs"]
+        print()
+        print(f"{group['manufacturer']}/{group['arch']}/{group['model']}: {group['hosts']} hosts in " +
+              f"{len(configs)} configuration{'s' if len(configs) != 1 else ''}")
+        if len(group["ignored_settings"]) > 0:
+            print(f"  (ignoring per-host settings: {', '.join(group['ignored_settings'])})")
+        if len(group["unique_settings"]) > 0:
+            print(f"  (different on every host: {', '.join(group['unique_settings'])})")
+        print(tabulate([[config["config"], len(config["hosts"]), ", ".join(config["hosts"][:5]) +
+                         (", ..." if len(config["hosts"]) > 5 else "")] for config in configs],
+                       headers=["Config", "Hosts", "Members"]))
+        if len(group["divergent_settings"]) == 0:
+            continue
+
+        print()
+        labels = [config["config"] for config in configs]
+        print(tabulate([[entry["setting"]] + [entry["values"][label] if entry["values"][label] is not None
+                                              else "setting not present" for label in labels]
+                        for entry in group["divergent_settings"]], headers=["Setting"] + labels))
+        print()
+        usual_config = configs[0]
+        print(f"{len(usual_config['hosts'])} hosts in config {usual_config['config']}")
+        for entry in group["divergent_settings"]:
+            print(f"{entry['hosts_differing']} hosts differ on {entry['setting']} (usually {entry['usual']})")
@@ -0,0 +1,85 @@
+# HostState.py - a compact in-memory form of each host's BIOS settings
+#
+# Every server of the same model and BIOS version has the same few hundred BIOS attribute names, in the same order.
+# Rather than each host keeping its own dict (and its own copies of all those names), the names are kept once, in a
+# KeyTable shared by every host with that set of names, and each host keeps only a tuple of its values, in the
+# table's order.  String values (ie: "Enabled", "Disabled") are interned too, so they're shared across the fleet.
+# BiosAttributes wraps the two up as a read-only mapping, so it can be used wherever the settings dict was.
+import sys
+import threading
+from collections.abc import Mapping
+
+
+def intern_value(value):
+    return sys.intern(value) if type(value) is str else value
+
+
+class KeyTable(object):
+    __slots__ = ("keys", "index", "_trimmed")
+
+    def __init__(self, keys):
+        self.keys = keys                                        # the attribute names, interned
+        self.index = {key: position for position, key in enumerate(keys)}
+        self._trimmed = None
+
+    def trimmed_index(self, trim):
+        # trimmed name -> the real name (see RedFishBMC.index_supermicro_keys); built once per table.  The first
+        # key wins if two of them trim to the same name.
+        if self._trimmed is None:
+            trimmed = dict()
+            for key in self.keys:
+                trimmed.setdefault(trim(key), key)
+            self._trimmed = trimmed
+        return self._trimmed
+
+
+class KeyTables(object):
+    # the KeyTables in use, keyed by their attribute names - usually one per model and BIOS version in the fleet
+    def __init__(self):
+        self.tables = dict()
+        self._lock = threading.Lock()
+
+    def get(self, keys):
+        keys = tuple(keys)
+        table = self.tables.get(keys)
+        if table is None:
+            with self._lock:
+                table = self.tables.get(keys)
+                if table is None:
+                    table = self.tables[keys] = KeyTable(tuple(sys.intern(key) for key in keys))
+        return table
+
+    def __len__(self):
+        return len(self.tables)
+
+
+key_tables = KeyTables()
+
+
+class BiosAttributes(Mapping):
+    # a host's BIOS attributes: read-only, and otherwise used just like the dict it was made from.  Use dict() on it
+    # to get a real dict (ie: to write it out as JSON or YAML).
+    __slots__ = ("table", "values")
+
+    def __init__(self, attributes, tables=key_tables):
+        self.table = tables.get(attributes.keys())
+        self.values = tuple(intern_value(value) for value in attributes.values())
+
+    def __getitem__(self, key):
+        return self.values[self.table.index[key]]
+
+    def __contains__(self, key):
+        return key in self.table.index
+
+    def __iter__(self):
+        return iter(self.table.keys)
+
+    def __len__(self):
+        return len(self.values)
+
+    def get(self, key, default=None):
+        position = self.table.index.get(key)
+        return default if position is None else self.values[position]
+
+    def __repr__(self):
+        return f"BiosAttributes({dict(zip(self.table.keys, self.values))!r})"
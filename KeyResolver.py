@@ -0,0 +1,85 @@
+# KeyResolver.py - match the keys in a bios settings definition to the actual BIOS keys on a server
+#
+# Most keys match exactly (or exactly once Supermicro's _XXXX hex suffix is trimmed), so those are found with a hash
+# lookup.  Only the keys that miss are fuzzy matched, all together in one rapidfuzz cdist() call.
+# Servers of the same manufacturer/model/bios version have the same keys, so the answer is remembered and a fleet of
+# identical nodes is only resolved once.
+import threading
+from logging import getLogger
+
+log = getLogger(__name__)
+
+
+def ends_with_hex(s):
+    """Check if string ends with _ and 4 hex digits"""
+    if len(s) < 5:  # Need at least 5 chars: _XXXX
+        return False
+    if s[-5] != '_':  # Must have underscore
+        return False
+    try:
+        # Try to convert last 4 chars to hex
+        int(s[-4:], 16)
+        return True
+    except ValueError:
+        return False
+
+def trim_trailing_hex(s):
+    """Trim trailing hex digits from string, return the string without trailing hex digits"""
+    if not ends_with_hex(s):
+        return s
+    else:
+        return s[:-5]
+
+
+class KeyResolver(object):
+    def __init__(self):
+        self._resolved = dict()
+        self._lock = threading.Lock()
+
+    def resolve(self, wanted_keys, server_keys, trim_hex=False, identity=None):
+        """
+        Find the closest server key for each of the wanted keys
+        :param wanted_keys: the keys from the bios settings definition
+        :param server_keys: all the BIOS keys on the server
+        :param trim_hex: ignore Supermicro-style _XXXX suffixes when comparing
+        :param identity: (manufacturer, model, bios_version) - servers with the same identity share the result
+        :return: dict of wanted key -> (server key, similarity), where similarity is 0-100 (100.0 is an exact match)
+        """
+        memo_key = (identity, trim_hex, frozenset(wanted_keys)) if identity is not None else None
+        if memo_key is not None:
+            with self._lock:
+                if memo_key in self._resolved:
+                    return self._resolved[memo_key]
+
+        server_keys = list(server_keys)
+        if trim_hex:
+            choices = [trim_trailing_hex(key) for key in server_keys]
+        else:
+            choices = server_keys
+
+        # exact matches - the first server key wins, just as it would with a fuzzy match
+        index = dict()
+        for position, choice in enumerate(choices):
+            index.setdefault(choice, position)
+
+        resolved = dict()
+        misses = list()
+        for wanted in wanted_keys:
+            query = trim_trailing_hex(wanted) if trim_hex else wanted
+            if query in index:
+                resolved[wanted] = (server_keys[index[query]], 100.0)
+            else:
+                misses.append((wanted, query))
+
+        # fuzzy match the rest in one batch.  rapidfuzz is only imported if there are any - often there aren't
+        if len(misses) > 0 and len(choices) > 0:
+            from rapidfuzz import process, fuzz
+            scores = process.cdist([query for _, query in misses], choices, scorer=fuzz.ratio)
+            for (wanted, _), row in zip(misses, scores):
+                best = int(row.argmax())
+                resolved[wanted] = (server_keys[best], float(row[best]))
+
+        if memo_key is not None:
+            with self._lock:
+                self._resolved[memo_key] = resolved
+        return resolved
@@ -0,0 +1,182 @@
+# Metrics.py - per-host timing spans for a bios_tool run (see --metrics-out)
+#
+# Every RedFish request, discovery step and pipeline phase (connect, find settings, check, fix, reboot, ...) is
+# recorded as a span: which host, what kind of span, its name, when it started and how long it took.  At the end of
+# the run the spans are written as JSON, and summarized into a Prometheus textfile (for node_exporter's textfile
+# collector) and a table of the slowest hosts and endpoints.
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from logging import getLogger
+
+log = getLogger(__name__)
+
+# kinds of span
+REQUEST = "request"        # one HTTP request to a BMC; name is "METHOD uri"
+DISCOVERY = "discovery"    # one RedFishBMC discovery step
+PHASE = "phase"            # one step of the pipeline for a host (connect, check, fix, reboot, ...)
+
+
+class Span(object):
+    __slots__ = ("host", "kind", "name", "start", "duration", "status")
+
+    def __init__(self, host, kind, name, start):
+        self.host = host
+        self.kind = kind
+        self.name = name
+        self.start = start
+        self.duration = None
+        self.status = None
+
+    def as_dict(self):
+        return {"host": self.host, "kind": self.kind, "name": self.name, "start": round(self.start, 6),
+                "duration": round(self.duration, 6), "status": self.status}
+
+
+class Tracer(object):
+    def __init__(self):
+        self.started = time.time()
+        self._origin = time.monotonic()
+        self._lock = threading.Lock()
+        self.spans = list()
+
+    @contextmanager
+    def span(self, host, kind, name):
+        # times the body of the with statement.  The span is yielded so the caller can set its status
+        # (ie: the HTTP status); a span that raises gets the exception's name.
+        span = Span(host, kind, name, time.monotonic() - self._origin)
+        try:
+            yield span
+        except BaseException as exc:
+            span.status = type(exc).__name__
+            raise
+        finally:
+            span.duration = time.monotonic() - self._origin - span.start
+            with self._lock:
+                self.spans.append(span)
+
+    def elapsed(self):
+        return time.monotonic() - self._origin
+
+    # summaries
+    def _totals(self, kind, key):
+        # key(span) -> [count, total seconds, max seconds, errors]
+        totals = dict()
+        with self._lock:
+            spans = [span for span in self.spans if span.kind == kind]
+        for span in spans:
+            entry = totals.setdefault(key(span), [0, 0.0, 0.0, 0])
+            entry[0] += 1
+            entry[1] += span.duration
+            entry[2] = max(entry[2], span.duration)
+            if not is_ok(span.status):
+                entry[3] += 1
+        return totals
+
+    def host_times(self):
+        # each host's wall time, from its first span to the end of its last one
+        hosts = dict()
+        with self._lock:
+            for span in self.spans:
+                first, last = hosts.get(span.host, (span.start, span.start + span.duration))
+                hosts[span.host] = (min(first, span.start), max(last, span.start + span.duration))
+        return {host: last - first for host, (first, last) in hosts.items()}
+
+    def endpoint_times(self):
+        # endpoints are grouped across hosts - BMCs of the same make use the same URIs
+        return self._totals(REQUEST, lambda span: span.name)
+
+    def phase_times(self):
+        return self._totals(PHASE, lambda span: (span.host, span.name))
+
+    def summary(self, top=10):
+        from tabulate import tabulate
+        print()
+        hosts = sorted(self.host_times().items(), key=lambda item: item[1], reverse=True)[:top]
+        phases = self.phase_times()
+        phase_names = list(dict.fromkeys(name for _, name in phases))
+        rows = list()
+        for host, seconds in hosts:
+            rows.append([host, round(seconds, 2)] + [round(phases[(host, name)][1], 2) if (host, name) in phases
+                                                     else "" for name in phase_names])
+        print("Slowest hosts:")
+        print(tabulate(rows, headers=["Host", "Total (s)"] + phase_names))
+
+        print()
+        endpoints = sorted(self.endpoint_times().items(), key=lambda item: item[1][1], reverse=True)[:top]
+        print("Slowest endpoints:")
+        print(tabulate([[endpoint, count, round(total, 2), round(total / count * 1000, 1), round(longest * 1000, 1),
+                         errors] for endpoint, (count, total, longest, errors) in endpoints],
+                       headers=["Endpoint", "Requests", "Total (s)", "Mean (ms)", "Max (ms)", "Errors"]))
+
+    # export
+    def save(self, filename):
+        # the spans as JSON in filename, and the Prometheus textfile alongside it (ie: metrics.json and metrics.prom)
+        with self._lock:
+            spans = [span.as_dict() for span in self.spans]
+        atomic_write(filename, json.dumps({"started": self.started, "duration": round(self.elapsed(), 6),
+                                           "spans": spans}, indent=1))
+        prom_filename = os.path.splitext(filename)[0] + ".prom"
+        atomic_write(prom_filename, self.prometheus())
+        log.info(f"Metrics written to {filename} and {prom_filename}")
+
+    def prometheus(self):
+        lines = ["# HELP bios_tool_run_seconds Wall time of the bios_tool run",
+                 "# TYPE bios_tool_run_seconds gauge",
+                 f"bios_tool_run_seconds {self.elapsed():.6f}",
+                 "# HELP bios_tool_run_timestamp_seconds When the bios_tool run started",
+                 "# TYPE bios_tool_run_timestamp_seconds gauge",
+                 f"bios_tool_run_timestamp_seconds {self.started:.3f}"]
+
+        lines += ["# HELP bios_tool_host_phase_seconds Time spent in each pipeline phase, per host",
+                  "# TYPE bios_tool_host_phase_seconds gauge"]
+        for (host, phase), (count, total, longest, errors) in sorted(self.phase_times().items()):
+            lines.append(f'bios_tool_host_phase_seconds{{host="{label(host)}",phase="{label(phase)}"}} {total:.6f}')
+
+        lines += ["# HELP bios_tool_request_seconds Time spent in RedFish requests, per endpoint",
+                  "# TYPE bios_tool_request_seconds summary"]
+        endpoints = sorted(self.endpoint_times().items())
+        for endpoint, (count, total, longest, errors) in endpoints:
+            lines.append(f'bios_tool_request_seconds_sum{{endpoint="{label(endpoint)}"}} {total:.6f}')
+            lines.append(f'bios_tool_request_seconds_count{{endpoint="{label(endpoint)}"}} {count}')
+        lines += ["# HELP bios_tool_request_errors_total RedFish requests that failed, per endpoint",
+                  "# TYPE bios_tool_request_errors_total counter"]
+        for endpoint, (count, total, longest, errors) in endpoints:
+            lines.append(f'bios_tool_request_errors_total{{endpoint="{label(endpoint)}"}} {errors}')
+        return "\n".join(lines) + "\n"
+
+
+class NullTracer(object):
+    # stands in for a Tracer when metrics aren't wanted
+    def span(self, host, kind, name):
+        return nullcontext(Span(host, kind, name, 0.0))
+
+
+null_tracer = NullTracer()
+
+
+def is_ok(status):
+    # spans with no status (ie: phases) or an HTTP status under 400 succeeded
+    return status is None or (type(status) is int and status < 400)
+
+
+def label(value):
+    # escape a Prometheus label value
+    return re.sub(r'(["\\])', r"\\\1", str(value)).replace("\n", "\\n")
+
+
+def atomic_write(filename, text):
+    # node_exporter may read the textfile at any time, so never let it see a partial file
+    fd, tmpname = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(filename)), prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(text)
+        os.chmod(tmpname, 0o644)
+        os.replace(tmpname, filename)
+    except Exception:
+        os.unlink(tmpname)
+        raise
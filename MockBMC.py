@@ -0,0 +1,530 @@
+# MockBMC.py - a local mock RedFish service that simulates a fleet of BMCs, for testing and benchmarking bios_tool
+#
+# One server simulates many BMCs: each loopback address (127.1.0.1, 127.1.0.2, ...) is a different BMC, so a fleet
+# of thousands needs just one listening socket.  (Linux routes all of 127.0.0.0/8 to the loopback interface.)
+# Each BMC is a Dell, HPE, Lenovo or Supermicro system whose BIOS attributes are seeded from defaults-db.yml, and
+# serves enough of the RedFish tree for bios_tool: sessions, Systems, Processors, Bios (with ETags), Bios/Settings,
+# Managers, ResetBios, ComputerSystem.Reset and (except on Supermicro) a server-sent event stream of BIOS changes.
+#
+# Per-request latency, jitter, an error rate and a per-BMC session limit can be configured to simulate real BMCs.
+# So can BMCs that hang: a fraction of requests can stall, and every Nth BMC can stop answering once logged in to.
+# With a rate limit, each BMC answers the requests beyond it in any one second with a 429 and a Retry-After.
+# With a certificate (--tls-cert/--tls-key) it serves HTTPS, and counts the TLS handshakes (and resumed ones).
+#
+# usage: python MockBMC.py --hosts 100 --latency 0.3 --jitter 0.1 > host_config.csv
+import argparse
+import collections
+import copy
+import json
+import random
+import secrets
+import ssl
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import yaml
+
+# the vendors simulated, in order: (manufacturer in defaults-db.yml, root Oem key, system id, manager id)
+VENDORS = (("Dell Inc.", "Dell", "System.Embedded.1", "iDRAC.Embedded.1"),
+           ("HPE", "Hpe", "1", "1"),
+           ("Lenovo", "Lenovo", "1", "1"),
+           ("Supermicro", "Supermicro", "1", "1"))
+
+# request phases, for the latency report
+PHASES = ("login", "discovery", "bios", "patch", "reset")
+
+
+def host_address(index):
+    # the loopback address of the index'th simulated BMC: 127.1.0.1, 127.1.0.2, ... 127.1.0.250, 127.1.1.1, ...
+    return f"127.1.{index // 250}.{index % 250 + 1}"
+
+
+class SimulatedBMC(object):
+    def __init__(self, vendor, arch, model, attributes, session_limit=None, boot_time=0.0):
+        self.manufacturer, self.oem, self.system_id, self.manager_id = vendor
+        self.arch = arch
+        self.model = model
+        self.defaults = attributes
+        self.attributes = dict(attributes)
+        self.pending = dict()           # PATCHed to Bios/Settings, applied at the next reset
+        self.reset_pending = False      # ResetBios was requested, applied at the next reset
+        self.boot_time = boot_time
+        self.reset_at = None            # when the last reset started
+        self.bios_etag = 1
+        self.sessions = dict()          # token -> session id
+        self.session_limit = session_limit
+        self.lock = threading.Lock()
+        self.dead = False               # hangs on every request once logged in to (see MockBMCServer.stalls())
+        self.recent = collections.deque()   # when the requests of the last second arrived
+        self.settings_etag = 1
+        self.events = list()            # origins of the ResourceChanged events sent on the event stream
+        self.event_ready = threading.Condition(self.lock)
+
+    def over_rate(self, rate):
+        # would one more request this second be more than the BMC can take?
+        with self.lock:
+            now = time.monotonic()
+            while len(self.recent) > 0 and now - self.recent[0] >= 1.0:
+                self.recent.popleft()
+            if len(self.recent) >= rate:
+                return True
+            self.recent.append(now)
+            return False
+
+    # URIs
+    @property
+    def system_uri(self):
+        return f"/redfish/v1/Systems/{self.system_id}"
+
+    @property
+    def manager_uri(self):
+        return f"/redfish/v1/Managers/{self.manager_id}"
+
+    def resource(self, path):
+        # the JSON for a GET of path, or None if there's no such resource
+        system = self.system_uri
+        if path == "/redfish/v1":
+            return {"@odata.id": "/redfish/v1", "RedfishVersion": "1.11.0", "Oem": {self.oem: {}},
+                    "Systems": {"@odata.id": "/redfish/v1/Systems"},
+                    "Managers": {"@odata.id": "/redfish/v1/Managers"},
+                    "SessionService": {"@odata.id": "/redfish/v1/SessionService"},
+                    "EventService": {"@odata.id": "/redfish/v1/EventService"},
+                    "Registries": {"@odata.id": "/redfish/v1/Registries"},
+                    "Links": {"Sessions": {"@odata.id": "/redfish/v1/SessionService/Sessions"}}}
+        if path == "/redfish/v1/Registries":
+            return {"Members": [{"@odata.id": "/redfish/v1/Registries/Messages"},
+                                {"@odata.id": "/redfish/v1/Registries/BiosAttributeRegistry"}]}
+        if path == "/redfish/v1/Registries/BiosAttributeRegistry":
+            return {"Id": "BiosAttributeRegistry", "Registry": "BiosAttributeRegistry.v1_0_0",
+                    "Location": [{"Language": "en", "Uri": f"{path}/BiosAttributeRegistry.v1_0_0.json"}]}
+        if path == "/redfish/v1/Registries/BiosAttributeRegistry/BiosAttributeRegistry.v1_0_0.json":
+            return self.attribute_registry()
+        if path == "/redfish/v1/EventService":
+            data = {"@odata.id": path, "ServiceEnabled": True}
+            if self.oem != "Supermicro":    # make some of the fleet poll
+                data["ServerSentEventUri"] = "/redfish/v1/EventService/SSE"
+            return data
+        if path == "/redfish/v1/Systems":
+            return {"Members": [{"@odata.id": system}], "Members@odata.count": 1}
+        if path == system:
+            reset = {"target": f"{system}/Actions/ComputerSystem.Reset"}
+            if self.oem == "Supermicro":
+                reset["@Redfish.ActionInfo"] = f"{system}/ResetActionInfo"   # Supermicro doesn't list the types here
+            else:
+                reset["ResetType@Redfish.AllowableValues"] = ["On", "ForceOff", "GracefulRestart", "ForceRestart"]
+            data = {"@odata.id": system, "Manufacturer": self.manufacturer, "Model": self.model,
+                    "BiosVersion": "1.0.0", "PowerState": self.power_state(),
+                    "BootProgress": {"LastState": self.boot_progress()},
+                    "Processors": {"@odata.id": f"{system}/Processors"},
+                    "Bios": {"@odata.id": f"{system}/Bios"},
+                    "Actions": {"#ComputerSystem.Reset": reset}}
+            if self.oem != "Supermicro":    # make some of the fleet walk the Processors collection
+                data["ProcessorSummary"] = {"Count": 1, "Model": self.cpu_model()}
+            return data
+        if path == f"{system}/ResetActionInfo":
+            return {"Parameters": [{"Name": "ResetType", "AllowableValues": ["On", "ForceOff", "ForceRestart"]}]}
+        if path == f"{system}/Processors":
+            return {"Members": [{"@odata.id": f"{system}/Processors/CPU.1"}]}
+        if path == f"{system}/Processors/CPU.1":
+            return {"Model": self.cpu_model()}
+        if path == f"{system}/Bios":
+            return {"@odata.id": path, "AttributeRegistry": "BiosAttributeRegistry.v1_0_0",
+                    "Attributes": self.attributes,
+                    "Actions": {"#Bios.ResetBios": {"target": f"{system}/Bios/Actions/Bios.ResetBios"}},
+                    "@Redfish.Settings": {"SettingsObject": {"@odata.id": f"{system}/Bios/Settings"},
+                                          "SupportedApplyTimes": ["OnReset"]}}
+        if path == f"{system}/Bios/Settings":
+            return {"@odata.id": path, "Attributes": self.pending}
+        if path == "/redfish/v1/Managers":
+            return {"Members": [{"@odata.id": self.manager_uri}]}
+        if path == self.manager_uri:
+            return {"@odata.id": self.manager_uri, "FirmwareVersion": "7.00.00.00", "Actions": {}}
+        return None
+
+    def attribute_registry(self):
+        # a registry that accepts any value of the right type for each attribute
+        types = {bool: "Boolean", int: "Integer"}
+        return {"Id": "BiosAttributeRegistry.v1_0_0", "RegistryVersion": "1.0.0",
+                "RegistryEntries": {"Attributes": [{"AttributeName": name, "Type": types.get(type(value), "String"),
+                                                    "ReadOnly": False}
+                                                   for name, value in self.defaults.items()],
+                                    "Dependencies": []}}
+
+    def power_state(self):
+        # after a reset, the system is off for the first third of boot_time and POSTing for the rest
+        if self.reset_at is not None and time.monotonic() < self.reset_at + self.boot_time / 3:
+            return "Off"
+        return "On"
+
+    def boot_progress(self):
+        if self.reset_at is None or time.monotonic() >= self.reset_at + self.boot_time:
+            return "OSRunning"
+        if self.power_state() == "Off":
+            return "None"
+        return "MemoryInitializationStarted"
+
+    def cpu_model(self):
+        return "AMD EPYC 9354 32-Core Processor" if self.arch == "AMD" else "Intel(R) Xeon(R) Gold 6430"
+
+    def reset(self):
+        # a reboot applies any pending settings (or a pending ResetBios)
+        with self.lock:
+            if self.reset_pending:
+                self.attributes = dict(self.defaults)
+                self.reset_pending = False
+            if len(self.pending) > 0:
+                self.attributes.update(self.pending)
+                self.pending = dict()
+            self.bios_etag += 1
+            self.settings_etag += 1
+            self.reset_at = time.monotonic()
+            self.send_event(f"{self.system_uri}/Bios")
+
+    def change(self, key, value):
+        # change a setting behind bios_tool's back (ie: someone in the BIOS setup screen), to simulate drift
+        with self.lock:
+            self.attributes[key] = value
+            self.bios_etag += 1
+            self.send_event(f"{self.system_uri}/Bios")
+
+    def send_event(self, origin):
+        # call with the lock held
+        self.events.append(origin)
+        self.event_ready.notify_all()
+
+
+class MockBMCServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, port=0, latency=0.0, jitter=0.0, error_rate=0.0, session_limit=None, boot_time=0.0,
+                 defaults_database="defaults-db.yml", seed=None, certfile=None, keyfile=None, stall_rate=0.0,
+                 stall_time=60.0, dead_every=None, bmc_rate=None):
+        super().__init__(("0.0.0.0", port), MockBMCHandler)
+        self.ssl_context = None
+        if certfile is not None:
+            self.ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            self.ssl_context.load_cert_chain(certfile, keyfile)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.stall_rate = stall_rate        # fraction of requests that hang for stall_time seconds
+        self.stall_time = stall_time
+        self.dead_every = dead_every        # every dead_every'th BMC hangs on everything but the root and logins
+        self.session_limit = session_limit
+        self.bmc_rate = bmc_rate            # most requests/second each BMC answers; the rest get a 429
+        self.boot_time = boot_time
+        self.random = random.Random(seed)
+        self.bmcs = dict()      # address -> SimulatedBMC, created on first contact
+        self.bmcs_lock = threading.Lock()
+        self.stats_lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.connections = 0
+        self.handshakes = 0
+        self.resumed = 0
+        self.phase_latencies = {phase: list() for phase in PHASES}
+
+        # one model per vendor, from the defaults database
+        with open(defaults_database) as f:
+            db = yaml.load(f, Loader=getattr(yaml, "CSafeLoader", yaml.SafeLoader))
+        self.models = list()
+        for vendor in VENDORS:
+            arch, models = next(iter(db[vendor[0]].items()))
+            model, attributes = next(iter(models.items()))
+            self.models.append((vendor, arch, model, attributes))
+
+    @property
+    def scheme(self):
+        return "https" if self.ssl_context is not None else "http"
+
+    def get_request(self):
+        # the TLS handshake is left to the handler's thread (see MockBMCHandler.setup()), so a slow one doesn't hold
+        # up accepting other connections
+        sock, address = super().get_request()
+        if self.ssl_context is not None:
+            sock = self.ssl_context.wrap_socket(sock, server_side=True, do_handshake_on_connect=False)
+        return sock, address
+
+    def handle_error(self, request, client_address):
+        # clients dropping connections (or failing handshakes) aren't worth a traceback
+        if not isinstance(sys.exc_info()[1], (ConnectionError, ssl.SSLError, TimeoutError)):
+            super().handle_error(request, client_address)
+
+    def verify_request(self, request, client_address):
+        # we listen on all addresses to get all of 127.0.0.0/8, but only talk to the local machine
+        return client_address[0].startswith("127.")
+
+    def bmc(self, address):
+        with self.bmcs_lock:
+            if address not in self.bmcs:
+                octets = [int(octet) for octet in address.split(".")]
+                index = octets[2] * 250 + octets[3] - 1     # the inverse of host_address()
+                vendor, arch, model, attributes = self.models[index % len(self.models)]
+                self.bmcs[address] = SimulatedBMC(vendor, arch, model, attributes, self.session_limit,
+                                                   self.boot_time)
+                self.bmcs[address].dead = self.dead_every is not None and index % self.dead_every == \
+                    self.dead_every - 1
+            return self.bmcs[address]
+
+    def delay(self):
+        # simulated BMC processing time
+        delay = self.latency + (self.random.uniform(-self.jitter, self.jitter) if self.jitter > 0 else 0)
+        if delay > 0:
+            time.sleep(delay)
+
+    def stalls(self, bmc, path, phase):
+        # does this request hang?  (The client will likely have given up on it by the time it's answered.)
+        if bmc.dead and path != "/redfish/v1" and phase != "login":
+            return True
+        return self.stall_rate > 0 and self.random.random() < self.stall_rate
+
+    def record(self, phase, elapsed, error):
+        with self.stats_lock:
+            self.requests += 1
+            if error:
+                self.errors += 1
+            self.phase_latencies[phase].append(elapsed)
+
+    def record_connection(self, handshake=False, resumed=False):
+        with self.stats_lock:
+            self.connections += 1
+            self.handshakes += 1 if handshake else 0
+            self.resumed += 1 if resumed else 0
+
+    def stats(self):
+        with self.stats_lock:
+            return {"requests": self.requests, "errors": self.errors, "connections": self.connections,
+                    "tls_handshakes": self.handshakes, "tls_resumed": self.resumed,
+                    "phase_latencies": {phase: list(values) for phase, values in self.phase_latencies.items()}}
+
+    def reset_stats(self):
+        with self.stats_lock:
+            self.requests = 0
+            self.errors = 0
+            self.connections = 0
+            self.handshakes = 0
+            self.resumed = 0
+            self.phase_latencies = {phase: list() for phase in PHASES}
+
+
+class MockBMCHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    timeout = 60    # drop idle keep-alive connections
+
+    def log_message(self, format, *args):
+        pass
+
+    def setup(self):
+        if self.server.ssl_context is not None:
+            self.request.settimeout(self.timeout)
+            self.request.do_handshake()
+            self.server.record_connection(handshake=True, resumed=self.request.session_reused)
+        else:
+            self.server.record_connection()
+        super().setup()
+
+    def do_GET(self):
+        self.handle_request("GET")
+
+    def do_POST(self):
+        self.handle_request("POST")
+
+    def do_PATCH(self):
+        self.handle_request("PATCH")
+
+    def do_DELETE(self):
+        self.handle_request("DELETE")
+
+    def handle_request(self, method):
+        start = time.monotonic()
+        bmc = self.server.bmc(self.connection.getsockname()[0])
+        path = self.path.split("?")[0].rstrip("/") or "/"
+        phase = self.phase(method, path, bmc)
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length)) if length > 0 else None
+
+        if method == "GET" and path == "/redfish/v1/EventService/SSE" and bmc.oem != "Supermicro" and \
+                self.headers.get("X-Auth-Token") in bmc.sessions:
+            return self.stream_events(bmc)
+
+        self.server.delay()
+        if self.server.stalls(bmc, path, phase):
+            time.sleep(self.server.stall_time)
+        if self.server.bmc_rate is not None and bmc.over_rate(self.server.bmc_rate):
+            status = self.reply(429, error="Too many requests", headers={"Retry-After": "1"})
+        elif self.server.error_rate > 0 and self.server.random.random() < self.server.error_rate:
+            status = self.reply(503, error="Service temporarily unavailable")
+        elif path != "/redfish/v1" and not (method == "POST" and phase == "login") and \
+                self.headers.get("X-Auth-Token") not in bmc.sessions:
+            status = self.reply(401, error="Unauthorized")
+        else:
+            status = self.dispatch(method, path, body, bmc)
+        self.server.record(phase, time.monotonic() - start, status >= 500 or status == 429)
+
+    def phase(self, method, path, bmc):
+        if path.startswith("/redfish/v1/SessionService"):
+            return "login"
+        if method == "PATCH":
+            return "patch"
+        if method == "POST":
+            return "reset"
+        if path.startswith(f"{bmc.system_uri}/Bios"):
+            return "bios"
+        return "discovery"
+
+    def dispatch(self, method, path, body, bmc):
+        system = bmc.system_uri
+        if method == "GET":
+            with bmc.lock:
+                data = bmc.resource(path)
+                data = copy.deepcopy(data) if data is not None else None
+                etag = f'W/"{bmc.bios_etag}"' if path == f"{system}/Bios" else \
+                    f'W/"{bmc.settings_etag}"' if path == f"{system}/Bios/Settings" else None
+            if data is None:
+                return self.reply(404, error=f"{path} not found")
+            if etag is not None and self.headers.get("If-None-Match") == etag:
+                return self.reply(304, etag=etag)
+            return self.reply(200, data, etag=etag)
+
+        if method == "POST" and path == "/redfish/v1/SessionService/Sessions":
+            with bmc.lock:
+                if bmc.session_limit is not None and len(bmc.sessions) >= bmc.session_limit:
+                    return self.reply(503, error="Maximum number of sessions reached")
+                token = secrets.token_hex(16)
+                session_id = secrets.token_hex(4)
+                bmc.sessions[token] = session_id
+            location = f"/redfish/v1/SessionService/Sessions/{session_id}"
+            return self.reply(201, {"Id": session_id, "UserName": (body or {}).get("UserName")},
+                              headers={"X-Auth-Token": token, "Location": location})
+        if method == "DELETE" and path.startswith("/redfish/v1/SessionService/Sessions/"):
+            with bmc.lock:
+                bmc.sessions.pop(self.headers.get("X-Auth-Token"), None)
+            return self.reply(204)
+
+        if method == "PATCH" and path == f"{system}/Bios/Settings":
+            unknown = [key for key in (body or {}).get("Attributes", {}) if key not in bmc.attributes]
+            if len(unknown) > 0:
+                return self.reply(400, error="Unknown attributes",
+                                  info=[{"MessageId": "Base.1.8.PropertyUnknown", "MessageArgs": [key]}
+                                        for key in unknown])
+            with bmc.lock:
+                bmc.pending.update(body["Attributes"])
+                bmc.settings_etag += 1
+                bmc.send_event(f"{system}/Bios/Settings")
+            return self.reply(200, {"Attributes": bmc.pending})
+        if method == "POST" and path == f"{system}/Bios/Actions/Bios.ResetBios":
+            with bmc.lock:
+                bmc.reset_pending = True
+            return self.reply(204)
+        if method == "POST" and path == f"{system}/Actions/ComputerSystem.Reset":
+            bmc.reset()
+            return self.reply(204)
+        return self.reply(405, error=f"{method} not allowed on {path}")
+
+    def stream_events(self, bmc):
+        # send each event as it happens, until the client goes away (or the server shuts down)
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        with bmc.lock:
+            sent = len(bmc.events)
+        try:
+            while True:
+                with bmc.lock:
+                    bmc.event_ready.wait_for(lambda: len(bmc.events) > sent, timeout=15)
+                    origins = bmc.events[sent:]
+                    sent = len(bmc.events)
+                if len(origins) == 0:
+                    self.wfile.write(b": keep-alive\n\n")
+                for number, origin in enumerate(origins, start=sent - len(origins) + 1):
+                    event = {"@odata.type": "#Event.v1_4_0.Event", "Id": str(number),
+                             "Events": [{"EventType": "ResourceUpdated",
+                                         "MessageId": "ResourceEvent.1.0.ResourceChanged",
+                                         "OriginOfCondition": {"@odata.id": origin}}]}
+                    self.wfile.write(f"id: {number}\ndata: {json.dumps(event)}\n\n".encode())
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def reply(self, status, data=None, etag=None, headers=None, error=None, info=None):
+        if error is not None:
+            data = {"error": {"message": error, "@Message.ExtendedInfo": info or [{"Message": error}]}}
+        payload = json.dumps(data).encode() if data is not None and status != 304 else b""
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        if etag is not None:
+            self.send_header("ETag", etag)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+        return status
+
+
+def start_server(**kwargs):
+    # start a MockBMCServer on a background thread, and return it.  server.server_address[1] is the port.
+    server = MockBMCServer(**kwargs)
+    thread = threading.Thread(target=server.serve_forever, name="MockBMC", daemon=True)
+    thread.start()
+    return server
+
+
+def host_config(hosts, port, filename=None, scheme="http"):
+    # a host_config.csv for the first `hosts` simulated BMCs
+    lines = ["name,user,password"] + [f"{scheme}://{host_address(index)}:{port},root,calvin"
+                                      for index in range(hosts)]
+    if filename is None:
+        return "\n".join(lines) + "\n"
+    with open(filename, "w") as f:
+        f.write("\n".join(lines) + "\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate a fleet of RedFish BMCs on the loopback addresses")
+    parser.add_argument("--port", type=int, default=8000, help="Port to listen on. Default is 8000")
+    parser.add_argument("--hosts", type=int, default=10, help="Number of BMCs to list in the printed host config")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds each request takes")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Random +/- seconds added to each request")
+    parser.add_argument("--error-rate", dest="error_rate", type=float, default=0.0,
+                        help="Fraction of requests that fail with a 503")
+    parser.add_argument("--session-limit", dest="session_limit", type=int, default=None,
+                        help="Maximum number of open sessions per BMC")
+    parser.add_argument("--stall-rate", dest="stall_rate", type=float, default=0.0,
+                        help="Fraction of requests that hang for --stall-time seconds")
+    parser.add_argument("--stall-time", dest="stall_time", type=float, default=60.0,
+                        help="Seconds a stalled request hangs for. Default is 60")
+    parser.add_argument("--dead-every", dest="dead_every", type=int, default=None,
+                        help="Every Nth BMC stops answering (except logins) once it has been logged in to")
+    parser.add_argument("--bmc-rate", dest="bmc_rate", type=float, default=None,
+                        help="Most requests/second each BMC answers; the rest get a 429 (Too Many Requests)")
+    parser.add_argument("--boot-time", dest="boot_time", type=float, default=0.0,
+                        help="Seconds a simulated reboot takes (off, then POST, then running)")
+    parser.add_argument("--defaults-database", dest="defaults_database", default="defaults-db.yml",
+                        help="Defaults database to seed the BIOS attributes from. Default is defaults-db.yml")
+    parser.add_argument("--tls-cert", dest="tls_cert", default=None,
+                        help="Serve HTTPS with this certificate (PEM) instead of HTTP")
+    parser.add_argument("--tls-key", dest="tls_key", default=None,
+                        help="The private key for --tls-cert, if it isn't in the same file")
+    args = parser.parse_args()
+
+    server = MockBMCServer(port=args.port, latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                           session_limit=args.session_limit, boot_time=args.boot_time,
+                           defaults_database=args.defaults_database, certfile=args.tls_cert, keyfile=args.tls_key,
+                           stall_rate=args.stall_rate, stall_time=args.stall_time, dead_every=args.dead_every,
+                           bmc_rate=args.bmc_rate)
+    sys.stdout.write(host_config(args.hosts, server.server_address[1], scheme=server.scheme))
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
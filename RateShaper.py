@@ -0,0 +1,157 @@
+# RateShaper.py - keep the RedFish request rate to what the BMCs and the management network can take (see --host-rate)
+#
+# Raising --workers used to just get more 503s and session-limit errors out of iDRACs and iLOs, and flood the
+# out-of-band network.  Instead, each request takes a token from up to three token buckets: one for its BMC, one for
+# its vendor (ie: all the iDRACs) and one for the whole run, each refilled at its rate.  With no token to hand, the
+# request waits for one, so the workers only go as fast as the limits allow.
+# When a BMC answers 429 (Too Many Requests) or 503 (Service Unavailable), its bucket's rate is halved (and its
+# vendor's cut back a little), and its requests pause for as long as its Retry-After header asks (or for a backoff
+# that doubles with each busy answer in a row).  The request is then sent again - the BMC didn't act on it.  The
+# rates creep back up as requests succeed, so a run settles at the rate the BMCs actually sustain.
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from logging import getLogger
+
+log = getLogger(__name__)
+
+BUSY_STATUSES = (429, 503)
+BACKOFF = 1.0               # seconds to back off after the first busy answer without a Retry-After; doubles each time
+MAX_BACKOFF = 60.0          # the longest we'll pause a BMC for, whatever its Retry-After says
+MIN_RATE = 0.2              # requests/second - the slowest a bucket is ever cut back to
+
+
+def retry_after_seconds(value):
+    # Retry-After is either a number of seconds or an HTTP date
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket(object):
+    def __init__(self, name, rate, burst=None):
+        if not rate > 0:
+            raise ValueError(f"{name}: the request rate must be more than 0, not {rate}")
+        self.name = name
+        self.limit = rate               # the rate it's configured for...
+        self.rate = rate                # ...and what it's currently allowed, after any busy answers
+        self.burst = burst if burst is not None else max(1.0, rate)     # a second's worth
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.busy = 0                   # busy answers in a row
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        # take a token, returning how long to wait before using it.  Tokens can be borrowed against the future, so
+        # waiting requests queue up in the order they asked.
+        with self._lock:
+            now = time.monotonic()
+            if self.rate == float("inf"):
+                return max(0.0, self.paused_until - now)
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+            return max(wait, self.paused_until - now)
+
+    def note_busy(self):
+        # returns the number of busy answers in a row
+        with self._lock:
+            self.busy += 1
+            return self.busy
+
+    def slow_down(self, factor, pause=None):
+        # (an unlimited bucket stays unlimited, but is still paused)
+        with self._lock:
+            self.rate = max(MIN_RATE, self.rate * factor)
+            self.tokens = min(self.tokens, self.rate)
+            if pause is not None:
+                self.paused_until = max(self.paused_until, time.monotonic() + pause)
+
+    def speed_up(self):
+        # additive increase: back to the full rate after some 20 seconds' worth of successful requests
+        with self._lock:
+            self.busy = 0
+            if self.rate < self.limit:
+                self.rate = min(self.limit, self.rate + self.limit * 0.05 / self.rate)
+
+
+class RateShaper(object):
+    def __init__(self, host_rate=None, vendor_rates=None, max_rate=None, retries=4):
+        """
+        :param host_rate: most requests/second to any one BMC (None for no limit)
+        :param vendor_rates: {vendor: most requests/second to all of that vendor's BMCs}.  The vendor is the Oem key
+            of the BMC's service root, ie: Dell, Hpe, Lenovo, Supermicro
+        :param max_rate: most requests/second to all the BMCs together (None for no limit)
+        :param retries: how many times a request that got a busy answer is sent again
+        """
+        self.host_rate = host_rate
+        self.vendors = {vendor: TokenBucket(vendor, rate) for vendor, rate in (vendor_rates or {}).items()}
+        self.fleet = TokenBucket("all BMCs", max_rate) if max_rate is not None else None
+        self.retries = retries
+        self.hosts = dict()
+        self.busy_answers = 0
+        self.waited = 0.0
+        self._lock = threading.Lock()
+
+    def host(self, hostname):
+        with self._lock:
+            if hostname not in self.hosts:
+                # every host has a bucket, even with no host_rate, so it can be paused and slowed when it's busy
+                rate = self.host_rate if self.host_rate is not None else float("inf")
+                self.hosts[hostname] = TokenBucket(hostname, rate, burst=None if self.host_rate is not None else 1.0)
+            return self.hosts[hostname]
+
+    def buckets(self, hostname, vendor):
+        buckets = [self.host(hostname), self.vendors.get(vendor), self.fleet]
+        return [bucket for bucket in buckets if bucket is not None]
+
+    def acquire(self, hostname, vendor=None):
+        # wait for a token from each of the host's buckets
+        wait = max(bucket.reserve() for bucket in self.buckets(hostname, vendor))
+        if wait > 0:
+            with self._lock:
+                self.waited += wait
+            time.sleep(wait)
+
+    def record(self, hostname, vendor, status, retry_after=None):
+        # note a response; returns True if the BMC was too busy to act on the request, and it should be sent again
+        host = self.host(hostname)
+        if status not in BUSY_STATUSES:
+            host.speed_up()
+            if vendor in self.vendors:
+                self.vendors[vendor].speed_up()
+            return False
+
+        with self._lock:
+            self.busy_answers += 1
+        busy = host.note_busy()
+        pause = retry_after_seconds(retry_after)
+        if pause is None:
+            pause = BACKOFF * 2 ** (busy - 1) * random.uniform(0.5, 1.5)
+        pause = min(pause, MAX_BACKOFF)
+        log.debug(f"{hostname} answered {status}; slowing down, and pausing it for {pause:.1f}s")
+        # a busy BMC says nothing about the network, so only its own bucket and its vendor's are cut back
+        host.slow_down(0.5, pause)
+        if vendor in self.vendors:
+            self.vendors[vendor].slow_down(0.9)
+        return busy <= self.retries
+
+    def summary(self):
+        if self.busy_answers > 0:
+            log.info(f"BMCs were too busy to answer {self.busy_answers} requests (429 or 503), and were backed off from")
+        if self.waited > 1.0:
+            log.info(f"Requests waited {self.waited:.1f}s in all to keep to the request rate limits")
+
+
+# used by RedFishBMCs that aren't given one - no limits, but busy BMCs are still backed off from
+default_shaper = RateShaper()
@@ -1,10 +1,18 @@
+import hashlib
 import json
+import re
+import threading
 #from pprint import pprint
 
-import redfish
-
+import logging
 from logging import getLogger
 
+from AttributeRegistry import AttributeRegistry, RegistryUnavailable, index_registry
+from Deadlines import default_deadlines
+from HostState import BiosAttributes
+from Metrics import null_tracer, REQUEST, DISCOVERY
+from RateShaper import default_shaper, BUSY_STATUSES
+
 #from setuptools.command.build_ext import if_dl
 
 #from paramiko.util import log_to_file
@@ -18,18 +26,133 @@ def is_hex(param):
 
 def trim_supermicro_key(key):
     # Supermicro uses a _XXXX (hex) suffix for the key - trim it off
-    return key[:-5] if (key[-5] == "_" and is_hex(key[-4])) else key
+    return key[:-5] if (len(key) > 5 and key[-5] == "_" and is_hex(key[-4:])) else key
+
+
+def settings_fingerprint(settings):
+    # a canonical hash of a settings dict (or BiosAttributes) - equal settings always give the same fingerprint
+    return hashlib.sha256(json.dumps(dict(settings), sort_keys=True, default=str).encode()).hexdigest()
+
+
+_desired_fingerprints = dict()
+
+
+def desired_fingerprint(settings):
+    # every host of a model is checked against the same desired settings, so their fingerprint is only worked out once
+    try:
+        key = frozenset((setting, type(value), value) for setting, value in settings.items())
+    except TypeError:       # a value that isn't hashable (ie: a list)
+        return settings_fingerprint(settings)
+    fingerprint = _desired_fingerprints.get(key)
+    if fingerprint is None:
+        fingerprint = _desired_fingerprints[key] = settings_fingerprint(settings)
+    return fingerprint
+
+
+def busy_answer(exc):
+    # the redfish library makes some requests itself (the service root, login and logout), and turns a busy answer
+    # to them into an exception.  Returns (status, Retry-After) if exc is one of those, else None.
+    response = getattr(exc, "response", None)       # ServerDownOrUnreachableError keeps the response
+    if response is not None:
+        return (response.status, response.getheader('Retry-After')) if response.status in BUSY_STATUSES else None
+    # ... the others only have the status in their message, ie: "HTTP 503: Failed to create the session"
+    match = re.search(r"(?:HTTP |return code: )(\d{3})\b", str(exc))
+    if match is not None and int(match.group(1)) in BUSY_STATUSES:
+        return int(match.group(1)), None
+    return None
+
+
+def print_bios_settings(name, settings):
+    print(f"{name} Current BIOS settings:")
+    print(json.dumps(dict(settings), indent=4, sort_keys=True))
 
 
 def trim_supermicro_dict(settings_dict):
+    # the settings keyed by their trimmed names.  If two keys trim to the same name, the first one wins, as in the
+    # key index (see HostState.KeyTable.trimmed_index) - which a BiosAttributes' trimmed names come from.
+    if isinstance(settings_dict, BiosAttributes):
+        index = settings_dict.table.trimmed_index(trim_supermicro_key)
+        return {trimmed: settings_dict[key] for trimmed, key in index.items()}
     new_settings_dict = dict()
     for key, value in settings_dict.items():
-        new_settings_dict[trim_supermicro_key(key)] = value
+        new_settings_dict.setdefault(trim_supermicro_key(key), value)
     return new_settings_dict
 
 
+class discovered(object):
+    # an attribute that is filled in by one of RedFishBMC's discover_* steps the first time it's read.
+    # The step assigns the attribute on the instance, which then shadows this (non-data) descriptor, so later reads
+    # are plain attribute lookups.
+    def __init__(self, step):
+        self.step = step
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        obj.discover_step(self.step)
+        return obj.__dict__[self.name]
+
+
+# the discovery steps, in dependency order
+DISCOVERY_STEPS = ("system", "reset_types", "arch", "bios", "managers")
+
+# the URIs worth remembering between runs - they almost never change for a given BMC firmware
+CACHED_URIS = ("systems_members_uri", "bios_uri", "bios_settings_uri", "reset_bios_uri", "managers_members_uri",
+               "reset_target")
+
+
+class CachedResponse(object):
+    # stands in for a redfish RestResponse when the resource came from the discovery cache (a 304 Not Modified)
+    def __init__(self, data):
+        self.status = 200
+        self.dict = data
+
+
 class RedFishBMC(object):
-    def __init__(self, hostname, username=None, password=None):
+    # discovered lazily - only the RedFish resources that are actually used get fetched.  Only the fields we use are
+    # kept from each resource; the responses themselves are dropped, so a host costs little memory however many
+    # hosts there are (see HostState).
+    systems_uri = discovered("system")
+    systems_members_uri = discovered("system")
+    reset_action = discovered("system")         # the #ComputerSystem.Reset action
+    reset_target = discovered("system")
+    manufacturer = discovered("system")
+    model = discovered("system")
+    bios_version = discovered("system")
+    power_state = discovered("system")          # as of discovery
+    cpu_model = discovered("system")            # from the ProcessorSummary, if the BMC has one
+    proc_uri = discovered("system")
+    system_bios_uri = discovered("system")
+    system_reset_types = discovered("reset_types")
+    arch = discovered("arch")
+    proc_members_uri = discovered("processors")
+    proc_model = discovered("processors")
+    bios_uri = discovered("bios")
+    bios_attributes = discovered("bios")        # a HostState.BiosAttributes
+    reset_bios_uri = discovered("bios")
+    bios_settings_uri = discovered("bios")
+    supported_apply_times = discovered("bios")
+    supermicro_index = discovered("bios")
+    attribute_registry_name = discovered("bios")
+    attribute_registry = discovered("registry")
+    managers_uri = discovered("managers")
+    managers_members_uri = discovered("managers")
+    bmc_firmware_version = discovered("managers")
+    virtual_media_uri = discovered("managers")
+
+    # session_cache is an optional BMCcache.SessionCache - sessions are then reused from (and left open for) other runs
+    # discovery_cache is an optional BMCcache.DiscoveryCache - discovery starts from what the last run found
+    # tracer is an optional Metrics.Tracer - every request and discovery step is timed
+    # registry_cache is an optional BMCcache.RegistryCache - settings are checked against the BIOS AttributeRegistry
+    # transport is an optional BMCTransport.BMCTransport - pooled keep-alive connections with TLS session reuse
+    # deadlines is an optional Deadlines.Deadlines - request timeouts, hedging and circuit breakers for the fleet
+    # shaper is an optional RateShaper.RateShaper - request rate limits, and backing off from busy BMCs
+    def __init__(self, hostname, username=None, password=None, discover=None, connect=True, session_cache=None,
+                 discovery_cache=None, tracer=None, registry_cache=None, transport=None, deadlines=None,
+                 shaper=None):
         # create the redfish object
         self.cdrom_eject_uri = None
         self.cdrom_mount_uri = None
@@ -37,100 +160,411 @@ class RedFishBMC(object):
         self.cdrom_uri = None
         self.virtual_media_list = None
         self.virtual_media_data = None
-        self.virtual_media_uri = None
-        self.redfish = redfish.redfish_client(base_url="https://" + hostname, username=username, password=password,
-                                              default_prefix='/redfish/v1', timeout=10, max_retry=2)
+        self.redfish = None
+        self.vendor = None          # the Oem key of the service root, once logged in
 
-        # login
         self.name = hostname
         self.username = username
         self.password = password
-        try:
-            self.redfish.login(auth="session")
-        except redfish.rest.v1.InvalidCredentialsError:
-            log.error(f"Error logging into {hostname} - invalid credentials")
-            raise
-        except Exception as exc:
-            log.error(f"Error logging into {hostname}: {exc}")
-            raise
+        self.session_cache = session_cache
+        self.reused_session = False
+        self.keep_alive = False     # set for long-lived sessions (see Watch) - log in again if the BMC drops them
+        self.discovery_cache = discovery_cache
+        self.discovery = discovery_cache.get(hostname) if discovery_cache is not None else None
+        self.bios_etag = None
+        self.deltas = dict()        # the settings that differed at the last check_settings(): {key: (current, desired)}
+        self.tracer = tracer if tracer is not None else null_tracer
+        self.registry_cache = registry_cache
+        self.transport = transport
+        self.deadlines = deadlines if deadlines is not None else default_deadlines
+        # a hedged GET needs a second connection to the BMC
+        self.budget = self.deadlines.host(hostname, hedge=transport is None or transport.connections > 1)
+        self.shaper = shaper if shaper is not None else default_shaper
+        self._login_lock = threading.Lock()
+
+        # connect=False leaves the client unopened, so the caller can drive the steps itself (see AsyncRedFishBMC)
+        if not connect:
+            return
+
+        self.open_client()
+        self.login()
+        self.check_firmware()
+
+        # anything not discovered here is fetched on first use
+        if discover:
+            self.discover(discover)
+
+    def discover(self, steps=DISCOVERY_STEPS):
+        # fetch up front the parts of the RedFish tree the caller knows it will need, so errors surface now
+        for step in self.pending_steps(steps):
+            self.discover_step(step)
+
+    def pending_steps(self, steps):
+        # the managers step may already have been run, by check_firmware()
+        return [step for step in steps if step != "managers" or "bmc_firmware_version" not in self.__dict__]
+
+    def check_firmware(self):
+        # the cached URIs are only good for the BMC firmware they were discovered on, so with a discovery cache the
+        # firmware version is fetched (to be compared, and saved with the URIs) before any other step uses them
+        if self.discovery_cache is not None:
+            self.discover_step("managers")
+
+    def discover_step(self, step):
+        with self.tracer.span(self.name, DISCOVERY, step), self.budget.phase("discovery"):
+            getattr(self, "discover_" + step)()
+
+    def open_client(self):
+        import redfish      # (and requests) - imported here, as it's slow to import and short runs don't need it
+        # note: this fetches the service root, so it blocks on the network
+        # hostname is normally an address, but may be a full URL (ie: http://127.1.0.1:8000 for MockBMC)
+        base_url = self.name if "://" in self.name else "https://" + self.name
+
+        def open_root():
+            with self.tracer.span(self.name, REQUEST, "GET /redfish/v1"):
+                self.redfish = redfish.redfish_client(base_url=base_url, username=self.username,
+                                                      password=self.password, default_prefix='/redfish/v1',
+                                                      timeout=10, max_retry=2,
+                                                      check_connectivity=self.transport is None)
+                if self.transport is not None:
+                    # the service root is fetched over the transport's connections too
+                    self.transport.mount(self.redfish._session)
+                    self.redfish.get_root_object()
+        self.busy_retry(open_root)
+
+    def login(self):
+        if self.session_cache is not None:
+            cached = self.session_cache.get(self.name, self.username)
+            if cached is not None:
+                # pick up the session a previous run left open; if it's gone stale, _request() logs in again
+                token, location = cached
+                self.redfish.set_session_key(token)
+                self.redfish.set_session_location(location)
+                self.reused_session = True
+                log.debug(f"Reusing cached session for {self.name}")
+            else:
+                self.new_session()
+        else:
+            self.new_session()
 
-        # increase timeout for all future operations
-        self.redfish._timeout = None
+        # the requests we make have their own timeouts (see _send()); this is for any the library makes itself
+        self.redfish._timeout = self.deadlines.timeouts["GET"]
 
         # get the Vendor ID
         self.vendor = next(iter(self.redfish.root.get("Oem", {}).keys()), None)
         if self.vendor is None:
             self.vendor = self.redfish.root.get("Vendor", None)
 
+    def new_session(self):
+        from redfish.rest.v1 import InvalidCredentialsError
+
+        def login():
+            with self.tracer.span(self.name, REQUEST, "login"):
+                self.redfish.login(auth="session")
+        try:
+            self.busy_retry(login)
+        except InvalidCredentialsError:
+            log.error(f"Error logging into {self.name} - invalid credentials")
+            raise
+        except Exception as exc:
+            log.error(f"Error logging into {self.name}: {exc}")
+            raise
+        self.reused_session = False
+        if self.session_cache is not None:
+            self.session_cache.put(self.name, self.username,
+                                   self.redfish.get_session_key(), self.redfish.get_session_location())
+
+    def close(self):
+        if self.discovery_cache is not None:
+            self.discovery_cache.put(self.name, self.discovery_entry())
+        if self.session_cache is not None:
+            # leave the session open for the next run, and note that it's just been used
+            self.session_cache.put(self.name, self.username,
+                                   self.redfish.get_session_key(), self.redfish.get_session_location())
+        elif self.budget.breaker.is_open:
+            # the BMC isn't answering - don't wait on it just to log out
+            log.debug(f"Not logging out of {self.name}")
+        else:
+            def logout():
+                with self.tracer.span(self.name, REQUEST, "logout"):
+                    self.redfish.logout()
+            self.busy_retry(logout)
+
+    def busy_retry(self, request):
+        # for the requests the redfish library makes itself - back off from a busy BMC, and try again, as _send() does
+        while True:
+            self.shaper.acquire(self.name, self.vendor)
+            try:
+                result = request()
+            except Exception as exc:
+                busy = busy_answer(exc)
+                if busy is None or not self.shaper.record(self.name, self.vendor, *busy):
+                    raise
+                continue
+            self.shaper.record(self.name, self.vendor, None)
+            return result
+
+    # all RedFish requests go through here
+    def _request(self, method, uri, body=None, headers=None):
+        session_key = self.redfish.get_session_key()
+        resp = self._send(method, uri, body, headers)
+        if resp.status == 401 and (self.reused_session or self.keep_alive):
+            # the session has expired (or was deleted) on the BMC - log in again and retry
+            self.relogin(session_key)
+            resp = self._send(method, uri, body, headers)
+        return resp
+
+    def relogin(self, session_key):
+        # Every request to the BMC, from any thread (and both copies of a hedged GET - see Deadlines), goes over the
+        # redfish client's one requests.Session.  The session token isn't kept in the Session's headers, though: the
+        # client adds it to each request's own headers as it's sent, so logging in again doesn't change the requests
+        # already in flight.  When several requests are refused at once, the first to get here logs in, and the rest
+        # (finding the token changed since they were sent) just use the new session.
+        with self._login_lock:
+            if self.redfish.get_session_key() != session_key:
+                return
+            log.info(f"Session for {self.name} is no longer valid; logging in again")
+            if self.session_cache is not None:
+                self.session_cache.forget(self.name, self.username)
+            self.redfish.set_session_key(None)
+            self.redfish.set_session_location(None)
+            self.new_session()
+
+    def _send(self, method, uri, body, headers):
+        # the deadlines decide each attempt's timeout, and whether it's retried or hedged
+        def send(timeout):
+            if method == "GET":
+                return self.redfish.get(uri, headers=headers, timeout=timeout, max_retry=0)
+            elif method == "PATCH":
+                return self.redfish.patch(uri, body=body, headers=headers, timeout=timeout, max_retry=0)
+            else:
+                return self.redfish.post(uri, body=body, headers=headers, timeout=timeout, max_retry=0)
+
+        # a BMC too busy to act on a request (429 or 503) is backed off from, and the request sent again
+        while True:
+            self.shaper.acquire(self.name, self.vendor)
+            with self.tracer.span(self.name, REQUEST, f"{method} {uri}") as span:
+                resp = self.deadlines.send(self.budget, method, send)
+                span.status = resp.status
+            if not self.shaper.record(self.name, self.vendor, resp.status, resp.getheader('Retry-After')):
+                return resp
+
+    def get(self, uri, headers=None):
+        return self._request("GET", uri, headers=headers)
+
+    def patch(self, uri, body=None, headers=None):
+        return self._request("PATCH", uri, body=body, headers=headers)
+
+    def post(self, uri, body=None, headers=None):
+        return self._request("POST", uri, body=body, headers=headers)
+
+    def discover_system(self):
         # get Systems
         self.systems_uri = self.redfish.root['Systems']['@odata.id']
-        self.systems_response = self.redfish.get(self.systems_uri)  # ie: /redfish/v1/Systems
-        self.systems_members_uri = next(iter(self.systems_response.dict['Members']))['@odata.id']
-        self.systems_members_response = self.redfish.get(self.systems_members_uri)  # ie: /redfish/v1/Systems/1
+        if self.cached_uri('systems_members_uri'):
+            self.systems_members_uri = self.cached_uri('systems_members_uri')
+        else:
+            systems_response = self.get(self.systems_uri)  # ie: /redfish/v1/Systems
+            self.systems_members_uri = next(iter(systems_response.dict['Members']))['@odata.id']
+        systems_members_response = self.get(self.systems_members_uri)  # ie: /redfish/v1/Systems/1
+        if self.cache_missed(systems_members_response):
+            return self.discover_system()
+        system = systems_members_response.dict
 
         # get bios identification info
-        self.manufacturer = self.systems_members_response.dict.get('Manufacturer', None)
-        self.model = self.systems_members_response.dict.get('Model', None)
-        self.bios_version = self.systems_members_response.dict.get('BiosVersion', None)
-
-        self.systems_members_response_actions = self.systems_members_response.dict['Actions']
+        self.manufacturer = system.get('Manufacturer', None)
+        self.model = system.get('Model', None)
+        self.bios_version = system.get('BiosVersion', None)
+
+        self.power_state = system.get('PowerState', None)
+        self.cpu_model = (system.get('ProcessorSummary') or {}).get('Model', None)
+        self.proc_uri = (system.get('Processors') or {}).get('@odata.id', None)
+        self.system_bios_uri = system['Bios']['@odata.id']
+        self.reset_action = system['Actions']['#ComputerSystem.Reset']
+        self.reset_target = self.reset_action['target']
+
+    def discover_reset_types(self):
         try:
-            self.system_reset_types = self.systems_members_response_actions['#ComputerSystem.Reset']['ResetType@Redfish.AllowableValues']
+            self.system_reset_types = self.reset_action['ResetType@Redfish.AllowableValues']
         except KeyError:
             #self.system_reset_types = None   # SMC doesn't have this key...
-            self.system_reset_action_info = self.redfish.get(
-                        self.systems_members_response_actions['#ComputerSystem.Reset']['@Redfish.ActionInfo'])
-            self.system_reset_types = self.system_reset_action_info.dict['Parameters'][0]['AllowableValues']
-
-        # get Processors
-        self.proc_uri = self.systems_members_response.dict['Processors']['@odata.id']
-        self.proc_data = self.redfish.get(self.proc_uri)
-        self.proc_members_uri = next(iter(self.proc_data.dict['Members']))['@odata.id']
-        self.proc_members_response = self.redfish.get(self.proc_members_uri)  # ie: /redfish/v1/Processors/1
+            action_info = self.get(self.reset_action['@Redfish.ActionInfo'])
+            self.system_reset_types = action_info.dict['Parameters'][0]['AllowableValues']
+
+    def discover_processors(self):
+        proc_data = self.get(self.proc_uri)
+        self.proc_members_uri = next(iter(proc_data.dict['Members']))['@odata.id']
+        proc_members_response = self.get(self.proc_members_uri)  # ie: /redfish/v1/Processors/1
+        self.proc_model = proc_members_response.dict.get("Model", None)
+
+    def discover_arch(self):
+        # most BMCs summarize the processors in the Systems member; only walk the Processors collection if not
+        cpu_model = self.cpu_model or self.proc_model
         # note the architecture
-        self.arch = "AMD" if self.proc_members_response.dict.get("Model", None)[0] == 'A' else "Intel"
+        self.arch = "AMD" if cpu_model[0] == 'A' else "Intel"
 
+    def discover_bios(self):
         # fetch the actual BIOS settings
-        self.bios_uri = self.systems_members_response.dict['Bios']['@odata.id']
-        self.bios_data = self.redfish.get(self.bios_uri)  # ie: /redfish/v1/Systems/1/Bios
-
-        if 'error' in self.bios_data.dict:
-            #log.error(f"Error fetching BIOS settings for {self.name}: {self.bios_data.dict['error']['@Message.ExtendedInfo']}")
-            raise Exception(f"Error fetching BIOS settings for {self.name}: {self.bios_data.dict['error']['@Message.ExtendedInfo']}")
-        self.bios_actions_dict = self.bios_data.dict['Actions']
-        self.reset_bios_uri = self.bios_actions_dict['#Bios.ResetBios']['target']
-        
-        if '@Redfish.Settings' not in self.bios_data.dict:
-            log.error(f"Error retrieving settings from {hostname} even though credentials are fine - check any pending/scheduled changes to the BMC and reboot" )
-
-        self.bios_settings_uri = self.bios_data.dict['@Redfish.Settings']['SettingsObject']['@odata.id']
-        #self.redfish_settings = self.bios_data.dict['@Redfish.Settings']
-        if 'SupportedApplyTimes' in self.bios_data.dict['@Redfish.Settings']:
-            self.supported_apply_times = self.bios_data.dict['@Redfish.Settings']['SupportedApplyTimes']
-        else:
-            self.supported_apply_times = None
-        
+        self.bios_uri = self.cached_uri('bios_uri') or self.system_bios_uri
+        bios_data = self.get_bios_data()  # ie: /redfish/v1/Systems/1/Bios
+        if self.cache_missed(bios_data):
+            return self.discover_bios()
+        self.load_bios(bios_data.dict)
+
+    def load_bios(self, data):
+        # keep what we use of a Bios resource: its attributes (compactly - see HostState) and its URIs
+        if 'error' in data:
+            #log.error(f"Error fetching BIOS settings for {self.name}: {data['error']['@Message.ExtendedInfo']}")
+            raise Exception(f"Error fetching BIOS settings for {self.name}: {data['error']['@Message.ExtendedInfo']}")
+        self.bios_attributes = BiosAttributes(data['Attributes'])
+        self.index_supermicro_keys()
+        self.reset_bios_uri = data['Actions']['#Bios.ResetBios']['target']
+        self.attribute_registry_name = data.get('AttributeRegistry', None)
+
+        if '@Redfish.Settings' not in data:
+            log.error(f"Error retrieving settings from {self.name} even though credentials are fine - check any pending/scheduled changes to the BMC and reboot" )
+
+        self.bios_settings_uri = data['@Redfish.Settings']['SettingsObject']['@odata.id']
+        #self.redfish_settings = data['@Redfish.Settings']
+        self.supported_apply_times = data['@Redfish.Settings'].get('SupportedApplyTimes', None)
+
+    def bios_resource(self):
+        # a Bios resource with just what load_bios() needs, to save in the discovery cache
+        settings = {'SettingsObject': {'@odata.id': self.bios_settings_uri}}
+        if self.supported_apply_times is not None:
+            settings['SupportedApplyTimes'] = self.supported_apply_times
+        data = {'Attributes': dict(self.bios_attributes),
+                'Actions': {'#Bios.ResetBios': {'target': self.reset_bios_uri}},
+                '@Redfish.Settings': settings}
+        if self.attribute_registry_name:
+            data['AttributeRegistry'] = self.attribute_registry_name
+        return data
+
+    def discover_registry(self):
+        # the BIOS AttributeRegistry, shared by all the servers of the same model and bios version.  None if we
+        # weren't given a registry_cache, or the BMC doesn't publish one.
+        self.attribute_registry = None
+        if self.registry_cache is None:
+            return
+        try:
+            index = self.registry_cache.get((self.manufacturer, self.model, self.bios_version),
+                                            self.fetch_attribute_registry)
+        except Exception as exc:
+            log.warning(f"{self.name}: unable to fetch the BIOS attribute registry: {exc}")
+            return
+        if index is not None:
+            self.attribute_registry = AttributeRegistry(index)
+
+    def fetch_attribute_registry(self):
+        # find the registry the Bios resource names (ie: BiosAttributeRegistry.v1_0_0) in the Registries collection
+        name = self.attribute_registry_name
+        if not name or 'Registries' not in self.redfish.root:
+            log.debug(f"{self.name}: no BIOS attribute registry")
+            return None
+        base = name.split('.')[0]
+        registries = self.registry_get(self.redfish.root['Registries']['@odata.id'])
+        if registries is None:
+            return None
+        for member in registries.dict.get('Members', []):
+            if member['@odata.id'].rstrip('/').split('/')[-1].split('.')[0] != base:
+                continue
+            registry_file = self.registry_get(member['@odata.id'])
+            if registry_file is None:
+                continue
+            # prefer the English copy hosted on the BMC itself
+            locations = sorted((location for location in registry_file.dict.get('Location', []) if 'Uri' in location),
+                               key=lambda location: location.get('Language', 'en') != 'en')
+            if len(locations) == 0:
+                continue
+            registry = self.registry_get(locations[0]['Uri'])
+            if registry is not None:
+                log.debug(f"{self.name}: fetched BIOS attribute registry {locations[0]['Uri']}")
+                return index_registry(registry.dict)
+        log.debug(f"{self.name}: BIOS attribute registry {name} not found")
+        return None
 
+    def registry_get(self, uri):
+        # None if the BMC says there's no such resource.  Any other failure may be passing (ie: a busy BMC), so it's
+        # raised rather than taken to mean there's no registry, which would be cached (see RegistryCache)
+        resp = self.get(uri)
+        if resp.status == 404:
+            return None
+        if resp.status != 200:
+            raise RegistryUnavailable(f"{uri} answered {resp.status}")
+        return resp
+
+    def discover_managers(self):
         self.managers_uri = self.redfish.root['Managers']['@odata.id']
-        self.managers_data = self.redfish.get(self.managers_uri)
-        self.managers_members_uri = next(iter(self.managers_data.dict['Members']))['@odata.id']
-        self.managers_members_response = self.redfish.get(self.managers_members_uri)  # ie: /redfish/v1/Managers/1
-        self.managers_members_actions = self.managers_members_response.dict['Actions']
-        self.bmc_firmware_version = self.managers_members_response.dict['FirmwareVersion']
+        if self.cached_uri('managers_members_uri'):
+            self.managers_members_uri = self.cached_uri('managers_members_uri')
+        else:
+            managers_data = self.get(self.managers_uri)
+            self.managers_members_uri = next(iter(managers_data.dict['Members']))['@odata.id']
+        managers_members_response = self.get(self.managers_members_uri)  # ie: /redfish/v1/Managers/1
+        if self.cache_missed(managers_members_response):
+            return self.discover_managers()
+        self.bmc_firmware_version = managers_members_response.dict['FirmwareVersion']
+        self.virtual_media_uri = (managers_members_response.dict.get('VirtualMedia') or {}).get('@odata.id', None)
+
+        # the cached URIs are only good for the BMC firmware they were discovered on (an entry with no firmware
+        # version is from an older bios_tool, so there's no telling what it was discovered on)
+        cached_version = self.discovery.get('bmc_firmware_version') if self.discovery else None
+        if self.discovery and cached_version != self.bmc_firmware_version:
+            log.info(f"{self.name}: BMC firmware changed from {cached_version} to {self.bmc_firmware_version}; " +
+                     "discarding cached discovery data")
+            self.discovery = None
         #print()
 
+    # the discovery cache - see BMCcache.DiscoveryCache
+    def cached_uri(self, name):
+        return self.discovery['uris'].get(name) if self.discovery else None
+
+    def cache_missed(self, resp):
+        # a cached URI that no longer exists means the cache is stale - drop it so the caller can rediscover
+        if self.discovery and resp.status == 404:
+            log.info(f"{self.name}: cached RedFish URIs are out of date; rediscovering")
+            self.discovery = None
+            return True
+        return False
+
+    def get_bios_data(self):
+        # fetch the Bios resource; if we have a copy with an ETag, a 304 lets us use our copy instead
+        cached_bios = self.discovery.get('bios') if self.discovery else None
+        headers = {'If-None-Match': cached_bios['etag']} if cached_bios else None
+        resp = self.get(self.bios_uri, headers=headers)
+        if resp.status == 304:
+            log.debug(f"{self.name}: Bios resource unchanged, using cached copy")
+            self.bios_etag = cached_bios['etag']
+            return CachedResponse(cached_bios['data'])
+        self.bios_etag = resp.getheader('ETag') if resp.status == 200 else None
+        return resp
+
+    def discovery_entry(self):
+        # what to save in the discovery cache: what we've discovered this run, plus anything we were told last time
+        entry = dict(self.discovery) if self.discovery else {'uris': dict()}
+        entry['uris'] = dict(entry['uris'])
+        for name in CACHED_URIS:
+            if self.__dict__.get(name):
+                entry['uris'][name] = self.__dict__[name]
+        if 'bmc_firmware_version' in self.__dict__:
+            entry['bmc_firmware_version'] = self.bmc_firmware_version
+        if 'bios_attributes' in self.__dict__:
+            if self.bios_etag:
+                entry['bios'] = {'etag': self.bios_etag, 'data': self.bios_resource()}
+            else:
+                entry.pop('bios', None)
+        return entry
+
     def get_bios_settings(self):
-        return self.bios_data.dict['Attributes']
+        return self.bios_attributes
 
 
     def get_cdrom_info(self):
         # get the Virtual CD-ROM
-        self.virtual_media_uri = self.managers_members_response.dict['VirtualMedia']['@odata.id']
-        self.virtual_media_data = self.redfish.get(self.virtual_media_uri)  # ie: /redfish/v1/Managers/1/VirtualMedia
+        self.virtual_media_data = self.get(self.virtual_media_uri)  # ie: /redfish/v1/Managers/1/VirtualMedia
         self.virtual_media_list = list()
         for device in self.virtual_media_data.dict['Members']:
-            vdev = self.redfish.get(device['@odata.id'])
-            # self.virtual_media_list.append(self.redfish.get(device['@odata.id']))
+            vdev = self.get(device['@odata.id'])
+            # self.virtual_media_list.append(self.get(device['@odata.id']))
             for mediatype in vdev.obj.MediaTypes:
                 if mediatype == 'CD' or mediatype == "DVD":
                     # found it!
@@ -152,6 +586,22 @@ class RedFishBMC(object):
         #    if settings_dict is None:
         #        return False
 
+        # drop anything that's already set, and then anything the BMC would reject (see AttributeRegistry).  This is
+        # the only place the settings are validated - check_settings() reports an invalid value as just another
+        # setting that isn't as it should be.
+        current = self.get_bios_settings()
+        settings_dict = {key: value for key, value in settings_dict.items() if current.get(key, None) != value}
+        if len(settings_dict) == 0:
+            log.info(f"{self.name}: all settings are already set")
+            return True
+        if self.attribute_registry is not None:
+            settings_dict, problems = self.attribute_registry.validate(settings_dict, current)
+            for key, problem in problems.items():
+                log.error(f"{self.name}: not setting {key}: {problem}")
+            if len(settings_dict) == 0:
+                log.error(f"{self.name}: none of the settings can be set")
+                return False
+
         # body = {'Attributes': {bios_property: property_value}}
         body = dict()
         body['Attributes'] = settings_dict
@@ -160,15 +610,15 @@ class RedFishBMC(object):
         if self.supported_apply_times is not None and "OnReset" in self.supported_apply_times:
             body["@Redfish.SettingsApplyTime"] = {"ApplyTime": "OnReset"}
 
-        # make sure a patch, which can take a lot of time, doesn't time out like a new connection
-        #self.redfish._timeout = None
-        resp = self.redfish.patch(self.bios_settings_uri, body=body)
+        # a patch can take a lot of time, so it has a longer timeout than other requests (see Deadlines)
+        resp = self.patch(self.bios_settings_uri, body=body)
 
         # If iLO responds with something outside of 200 or 201 then lets check the iLO extended info
         # error message to see what went wrong
         if resp.status == 400:
             try:
-                print(json.dumps(resp.dict['error']['@Message.ExtendedInfo'], indent=4, sort_keys=True))
+                log.error(f"{self.name} rejected the settings: " +
+                          json.dumps(resp.dict['error']['@Message.ExtendedInfo'], indent=4, sort_keys=True))
             except Exception as exc:
                 log.error(f"A response exception occurred, unable to access Extended information {exc}")
         elif resp.status not in [200,201,202]:
@@ -180,25 +630,56 @@ class RedFishBMC(object):
 
         return False
 
-    def check_settings(self, settings):
+    # known_good is an optional BMCcache.ComplianceCache of hosts previously found to have these settings
+    # quiet=True only logs the settings that differ at debug level (see Watch)
+    def check_settings(self, settings, known_good=None, quiet=False):
+        self.deltas = dict()
         if settings is None:
             log.info(f"{self.name} There are no settings for this platform in the bios settings configuration file")
             return 0
 
-        count = 0
-        for key, value in settings.items():
-            if key not in self.bios_data.obj.Attributes:
-                log.error(f"desired key ({key}) is not part of {self.name}'s bios!")
+        attributes = self.get_bios_settings()
+
+        # fast path: if the host had these settings last time and its Bios resource hasn't changed (same ETag), it's
+        # compliant - no need to look at each key.  That needs the BMC to send an ETag with the Bios resource.
+        desired = state = None
+        if known_good is not None:
+            desired = desired_fingerprint(settings)
+            if self.bios_etag:
+                state = f"etag:{self.bios_etag}"
+                if known_good.is_compliant(self.name, desired, state):
+                    log.debug(f"{self.name}: BIOS unchanged since it was last found compliant")
+                    return 0
             else:
-                if self.bios_data.obj.Attributes[key] != value:
-                    log.info(f"{self.name}: BIOS setting {key} is {self.bios_data.obj.Attributes[key]}, " +
-                             f"but should be {value}")
-                    count += 1
+                log.info(f"{self.name}: the BMC sends no ETag with the BIOS settings, so --fingerprints can't " +
+                         f"skip checking them")
+        if all(attributes.get(key, None) == value for key, value in settings.items()):
+            if state is not None:
+                known_good.record(self.name, desired, state)
+            return 0
 
-        return count
+        self.deltas = self.setting_deltas(settings)
+        for key, (current_value, value) in self.deltas.items():
+            log.log(logging.DEBUG if quiet else logging.INFO, f"{self.name}: BIOS setting {key} is {current_value}, " +
+                    f"but should be {value}")
+        return len(self.deltas)
+
+    def setting_deltas(self, settings):
+        # the desired settings that differ from the server's: {key: (current value, desired value)}.  Keys the
+        # server doesn't have are logged, and left out.
+        attributes = self.get_bios_settings()
+        deltas = dict()
+        for key, value in settings.items():
+            if key not in attributes and self.vendor == "Supermicro":
+                key = self.supermicro_find_key(key) or key    # may be from a different bios version
+            if key not in attributes:
+                log.error(f"desired key ({key}) is not part of {self.name}'s bios!")
+            elif attributes[key] != value:
+                deltas[key] = (attributes[key], value)
+        return deltas
 
     def reset_settings_to_default(self):
-        resp = self.redfish.post(self.reset_bios_uri, body={})
+        resp = self.post(self.reset_bios_uri, body={})
         if resp.status not in [200,201,202,203,204]:
             error_dict = resp.dict['error'] if 'error' in resp.dict else None
             log.error(f"An http response of '{resp.status}' was returned attempting to reset bios to default on {self.name}.")
@@ -208,14 +689,12 @@ class RedFishBMC(object):
             return True
 
     def print_settings(self):
-        print(f"{self.name} Current BIOS settings:")
-        print(json.dumps(self.bios_data.obj.Attributes, indent=4, sort_keys=True))
+        print_bios_settings(self.name, self.get_bios_settings())
 
     def reboot(self):
-        action = self.systems_members_response.obj.Actions['#ComputerSystem.Reset']['target']
-        # print(json.dumps(self.systems_members_response.obj.Actions['#ComputerSystem.Reset']))
+        action = self.reset_target
         body = dict()
-        if self.systems_members_response.obj.PowerState != "On":
+        if self.power_state != "On":
             body['ResetType'] = 'On'
         else:
             if 'GracefulRestart' in self.system_reset_types:
@@ -225,14 +704,70 @@ class RedFishBMC(object):
             else:
                 body['ResetType'] = 'On'
 
-        resp = self.redfish.post(action, body=body)
-        print(f'reset status: {resp.status}')
+        resp = self.post(action, body=body)
+        log.debug(f"{self.name}: reset status {resp.status}")
         if resp.status not in [200,201,202,203,204]:
             log.error(f"An http response of '{resp.status}' was returned attempting to reboot {self.name}.\n")
             return False
         else:
             return True
 
+    def get_if_changed(self, uri, etag=None):
+        # conditional GET - returns None if the resource still has the given ETag
+        resp = self.get(uri, headers={'If-None-Match': etag} if etag else None)
+        if resp.status == 304:
+            return None
+        if resp.status != 200:
+            raise Exception(f"An http response of '{resp.status}' was returned reading {uri} from {self.name}")
+        return resp
+
+    def event_stream_uri(self):
+        # the EventService's server-sent event stream, or None if the BMC doesn't have one
+        if 'EventService' not in self.redfish.root:
+            return None
+        resp = self.get(self.redfish.root['EventService']['@odata.id'])
+        if resp.status != 200 or resp.dict.get('ServiceEnabled') is False:
+            return None
+        return resp.dict.get('ServerSentEventUri', None)
+
+    def events(self, uri):
+        # yields the events the BMC pushes over its server-sent event stream, until the stream ends.
+        # The redfish library reads whole responses, so the stream is read with its underlying requests session -
+        # or with a session of its own, so the stream doesn't hold one of the transport's connections to the BMC.
+        session = self.redfish._session
+        if self.transport is not None:
+            import requests
+            session = self.transport.mount(requests.Session())
+        resp = session.get(self.redfish.get_base_url() + uri, stream=True, verify=False, timeout=(10, None),
+                           headers={'X-Auth-Token': self.redfish.get_session_key(),
+                                    'Accept': 'text/event-stream'})
+        if resp.status_code != 200:
+            resp.close()
+            raise Exception(f"An http response of '{resp.status_code}' was returned subscribing to events on {self.name}")
+        try:
+            data = list()
+            # read a byte at a time - with bigger reads, an event can sit in the buffer until more arrive
+            for line in resp.iter_lines(chunk_size=1, decode_unicode=True):
+                if line.startswith('data:'):
+                    data.append(line[5:].strip())
+                elif line == '' and len(data) > 0:   # a blank line ends an event
+                    yield json.loads('\n'.join(data))
+                    data = list()
+        finally:
+            resp.close()
+
+    def get_power_state(self):
+        # (PowerState, BootProgress LastState) from a fresh read of the Systems member.  LastState is None if the
+        # BMC doesn't report BootProgress.
+        resp = self.get(self.systems_members_uri)
+        if resp.status != 200:
+            raise Exception(f"An http response of '{resp.status}' was returned reading the power state of {self.name}")
+        return resp.dict.get('PowerState', None), (resp.dict.get('BootProgress') or {}).get('LastState', None)
+
+    def refresh_bios(self):
+        # re-read the Bios resource, ie: after a reboot has applied the pending settings
+        self.load_bios(self.get_bios_data().dict)
+
     def adjust_supermicro_settings(self, settings_dict):
         new_settings_dict = dict()
 
@@ -251,11 +786,16 @@ class RedFishBMC(object):
     def supermicro_find_key(self, key):
         # Supermicro (sometimes) uses a different key for the same setting (they add a _ and 4-digit hex number: xxx_010F
         # This function will convert the key to the correct one for Supermicro
-        #keys = list(self.bios_data.obj.Attributes.keys())
-        for server_key in self.bios_data.obj.Attributes.keys():
-            if "_" in server_key and len(server_key) > 5 and server_key[-5] == "_" and is_hex(server_key[-4]) and server_key[:-5] == key:
-                return server_key
-            else:
-                if server_key == key:
-                    return server_key
-        return None
+        if key in self.get_bios_settings():
+            return key
+        return self.supermicro_index.get(trim_supermicro_key(key), None)
+
+    def index_supermicro_keys(self):
+        # map each trimmed key to the server's real key, so that translating a key is a dict lookup.  The index is
+        # shared by every server with the same BIOS keys (see HostState.KeyTable).
+        self.supermicro_index = self.get_bios_settings().table.trimmed_index(trim_supermicro_key)
+
+    def trimmed_bios_settings(self):
+        # the BIOS settings keyed by their trimmed names - the same for a live host as for one read from a shard's
+        # results (see Shards.ShardHost)
+        return trim_supermicro_dict(self.get_bios_settings())
@@ -0,0 +1,71 @@
+# ResultStream.py - one JSON record per host, written as soon as the host is finished with (see --ndjson)
+#
+# The output is newline-delimited JSON: each line is a complete record, flushed as it's written, so downstream tools
+# can consume results while the run is still going, and a run over thousands of hosts never holds them all at once.
+import json
+import sys
+import threading
+from logging import getLogger
+
+log = getLogger(__name__)
+
+
+class NDJSONWriter(object):
+    def __init__(self, filename="-"):
+        # "-" is stdout (the log goes to stderr)
+        self.filename = filename
+        self.file = sys.stdout if filename == "-" else open(filename, "w")
+        self._lock = threading.Lock()
+        self.count = 0
+
+    def write(self, record):
+        line = json.dumps(record, default=str)
+        with self._lock:
+            self.file.write(line + "\n")
+            self.file.flush()
+            self.count += 1
+
+    def close(self):
+        if self.file is not sys.stdout:
+            self.file.close()
+        log.debug(f"Wrote {self.count} records to {self.filename}")
+
+
+def identity(server):
+    # what every record says about the host.  arch is only included if it's already been discovered.
+    bmc = server.bmc
+    record = {"host": server.hostname, "manufacturer": bmc.manufacturer, "model": bmc.model,
+              "bios_version": bmc.bios_version}
+    if "arch" in bmc.__dict__:
+        record["arch"] = bmc.arch
+    return record
+
+
+def dump_record(server):
+    record = identity(server)
+    record["attributes"] = dict(server.bios_settings)
+    return record
+
+
+def check_record(result):
+    # the outcome of check_host() (and any fix/reboot) for one host
+    # a host that failed part way through may not have got far enough to identify it
+    if result.server.bmc is not None and result.error is None:
+        record = identity(result.server)
+    else:
+        record = {"host": result.server.hostname}
+    record.update({"compliant": result.changes_needed == 0 and result.error is None,
+                   "changes_needed": result.changes_needed,
+                   "deltas": {key: {"current": current, "desired": desired}
+                              for key, (current, desired) in result.deltas.items()},
+                   "fixed": result.fixed,
+                   "reset": result.reset,
+                   "rebooted": result.rebooted,
+                   "verified": result.verified,
+                   "error": str(result.error) if result.error is not None else None})
+    return record
+
+
+def error_record(server):
+    # a host we couldn't connect to
+    return {"host": server.hostname, "error": server.error}
@@ -0,0 +1,161 @@
+# RollingReboot.py - reboot hosts in waves, and make sure each one comes back (see --reboot and --wave-size)
+#
+# Each host in a wave is rebooted, then its PowerState and BootProgress are polled (backing off between polls) until
+# it has gone down and come back up.  If we know what its BIOS settings should be, the Bios resource is then read
+# again to confirm the pending settings were applied.  The next wave starts as soon as enough of the current wave is
+# back (wave_ready), so a slow host doesn't hold up the cluster - but once more than max_failures hosts have failed to
+# come back at all, no more waves are started.  (By default that's the first one to fail.)
+# The host we're running on (if it's in the list) is rebooted last, by itself, once everything else is done.
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from logging import getLogger
+
+log = getLogger(__name__)
+
+# BootProgress LastState values that mean POST has finished
+BOOTED = ("SystemHardwareInitializationComplete", "OSBootStarted", "OSRunning")
+
+
+class RollingReboot(object):
+    def __init__(self, wave_size=10, wave_ready=1.0, timeout=30 * 60, poll_interval=5.0, max_poll_interval=30.0,
+                 min_boot_time=60.0, max_failures=0):
+        """
+        :param wave_size: how many hosts are rebooted at once
+        :param wave_ready: fraction of a wave that must be back up before the next wave starts
+        :param timeout: seconds a host has to come back up
+        :param poll_interval: seconds before the first poll; the interval grows by half each poll...
+        :param max_poll_interval: ...up to this
+        :param min_boot_time: for BMCs that never show the host going down, how long to wait before trusting
+            that PowerState On means it has rebooted
+        :param max_failures: how many hosts may fail to reboot (or to come back) before no more waves are started
+        """
+        self.wave_size = max(1, wave_size)
+        self.wave_ready = min(1.0, max(0.0, wave_ready))
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.min_boot_time = min_boot_time
+        self.max_failures = max(0, max_failures)
+
+    def run(self, results, last=None, on_done=None):
+        """
+        Reboot the hosts of the given HostResults, in waves
+        :param results: HostResults for the hosts to reboot.  If result.settings is set, it's verified after the reboot
+        :param last: the Server we're running on, if any - it's rebooted last, and not waited for
+        :param on_done: optional function called with each result as soon as that host is finished with (including
+            hosts that were never rebooted because the waves were halted)
+        :return: None - each result's rebooted/verified/error are filled in
+        """
+        on_done = on_done or (lambda result: None)
+        local = [result for result in results if result.server is last]
+        results = [result for result in results if result.server is not last]
+        waves = [results[index:index + self.wave_size] for index in range(0, len(results), self.wave_size)]
+        log.info(f"Rebooting {len(results) + len(local)} hosts in waves of up to {self.wave_size}")
+
+        halted = False
+        failures = 0
+        in_flight = dict()      # future -> (wave number, result)
+        with ThreadPoolExecutor(max_workers=self.wave_size * 2, thread_name_prefix="reboot") as executor:
+            for number, wave in enumerate(waves, start=1):
+                log.info(f"Starting reboot wave {number} of {len(waves)}: " +
+                         ", ".join(result.server.hostname for result in wave))
+                for result in wave:
+                    in_flight[executor.submit(self.reboot_host, result)] = (number, result)
+
+                # wait until enough of this wave is back before starting the next one
+                needed = math.ceil(len(wave) * self.wave_ready) if number < len(waves) else len(wave)
+                healthy = 0
+                while healthy < needed and not halted:
+                    this_wave = [future for future, (wave_number, _) in in_flight.items() if wave_number == number]
+                    if len(this_wave) == 0:
+                        break
+                    done, _ = wait(in_flight.keys(), return_when=FIRST_COMPLETED)
+                    for future in done:
+                        wave_number, result = in_flight.pop(future)
+                        on_done(result)
+                        if result.rebooted and wave_number == number:
+                            healthy += 1
+                        elif not result.rebooted:
+                            failures += 1
+                            if failures > self.max_failures:
+                                log.error(f"{result.server.hostname} did not come back from its reboot " +
+                                          f"({result.error}) - no more waves will be started")
+                                halted = True
+                            else:
+                                log.error(f"{result.server.hostname} did not come back from its reboot " +
+                                          f"({result.error}) - {failures} of {self.max_failures} failures allowed")
+                if halted:
+                    break
+
+            # let the stragglers from the last waves finish
+            for future in list(in_flight):
+                wave_number, result = in_flight.pop(future)
+                future.result()
+                on_done(result)
+
+        skipped = [result for wave in waves[number:] for result in wave] if halted else list()
+        for result in skipped + (local if halted else list()):
+            log.warning(f"{result.server.hostname} was not rebooted")
+            on_done(result)
+
+        if len(local) > 0 and not halted:
+            # we're about to go down ourselves, so there's no waiting for this one
+            result = local[0]
+            log.info(f"Rebooting this host ({result.server.hostname}) last")
+            try:
+                with result.server.phase("reboot"):
+                    result.rebooted = result.server.bmc.reboot()
+                if not result.rebooted:
+                    result.error = "reboot request failed"
+            except Exception as exc:
+                log.error(f"Error rebooting {result.server.hostname}: {exc}")
+                result.error = exc
+            on_done(result)
+
+    def reboot_host(self, result):
+        server = result.server
+        try:
+            with server.phase("reboot"):
+                if not server.bmc.reboot():
+                    result.error = "reboot request failed"
+                    return result
+                started = time.monotonic()
+            with server.phase("wait_for_boot"):
+                if not self.wait_for_boot(server, started):
+                    result.error = f"timed out after {self.timeout} seconds"
+                    return result
+            result.rebooted = True
+            log.info(f"{server.hostname} is back up after {time.monotonic() - started:.0f} seconds")
+
+            if result.settings is not None:
+                with server.phase("verify"):
+                    server.bmc.refresh_bios()
+                    result.verified = server.bmc.check_settings(result.settings) == 0
+                if result.verified:
+                    log.info(f"{server.hostname}: BIOS settings verified")
+                else:
+                    log.error(f"{server.hostname}: BIOS settings were not applied by the reboot")
+        except Exception as exc:
+            log.error(f"Error rebooting {server.hostname}: {exc}")
+            result.error = exc
+        return result
+
+    def wait_for_boot(self, server, started):
+        # the host has rebooted once it's been seen off or part way through POST, and is now on with POST complete
+        delay = self.poll_interval
+        seen_down = False
+        while time.monotonic() - started < self.timeout:
+            time.sleep(delay)
+            delay = min(delay * 1.5, self.max_poll_interval)
+            try:
+                power_state, boot_progress = server.bmc.get_power_state()
+            except Exception as exc:
+                log.debug(f"{server.hostname}: unable to read power state: {exc}")  # BMCs can be busy during POST
+                continue
+            log.debug(f"{server.hostname}: PowerState {power_state}, BootProgress {boot_progress}")
+            if power_state != "On" or (boot_progress is not None and boot_progress not in BOOTED):
+                seen_down = True
+            elif seen_down or time.monotonic() - started >= self.min_boot_time:
+                return True
+        return False
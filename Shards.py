@@ -0,0 +1,173 @@
+# Shards.py - split one run over several bios_tool processes, or machines, and merge their results (see --shard)
+#
+# One process can only keep so many BMCs busy (it has the GIL, and one vantage point on the management network).
+# With --shard i/N, a run only works on its share of the host config: each host belongs to the shard picked by a hash
+# of its name, so every process (on any machine) agrees on the split, without talking to the others, and a host stays
+# in the same shard as the config grows.  Each shard writes its results as NDJSON records (see ResultStream), after a
+# first record that says which shard of which run it is.  --merge reads the shard files back and reports on them as
+# a single run would have.  --processes runs the shards as local processes, one per CPU core, and merges them.
+import hashlib
+import json
+import os
+import subprocess
+import sys
+from logging import getLogger
+
+from HostState import BiosAttributes
+from RedFishBMC import trim_supermicro_dict
+
+log = getLogger(__name__)
+
+
+# --shard 2/8
+def shard_spec(value):
+    import argparse
+    index, _, count = value.partition("/")
+    try:
+        index, count = int(index), int(count)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected INDEX/COUNT (ie: 1/4), not '{value}'")
+    if count < 1 or not 1 <= index <= count:
+        raise argparse.ArgumentTypeError(f"shard {value}: the index must be from 1 to the number of shards")
+    return index, count
+
+
+def shard_of(hostname, count):
+    # which shard (1 to count) a host belongs to.  hash() is salted per process, so it's no good here.
+    digest = hashlib.sha256(hostname.encode()).digest()
+    return int.from_bytes(digest[:8], "big") % count + 1
+
+
+def select_shard(hosts, index, count):
+    # the host config entries ({name, user, password}) in shard index of count, in their config order
+    return [host for host in hosts if shard_of(host['name'], count) == index]
+
+
+def shard_header(index, count, hosts, mode, fix=False, reboot=False):
+    # the first record of a shard's results.  It has no "host", so tools reading the records can tell it apart.
+    return {"shard": f"{index}/{count}", "hosts": hosts, "mode": mode, "fix": fix, "reboot": reboot}
+
+
+def read_header(filename):
+    # a shard file's header, and how many host records follow it
+    with open(filename) as f:
+        first = f.readline()
+        header = json.loads(first) if first.strip() != "" else None
+        if not isinstance(header, dict) or "shard" not in header:
+            raise ValueError(f"{filename} is not the output of a --shard run")
+        return header, sum(1 for line in f if line.strip() != "")
+
+
+def check_shards(filenames):
+    """
+    Check that the shard files are the results of one run
+    :param filenames: the shards' NDJSON files, in any order
+    :return: (header, complete): the first shard's header, and whether all of the run's shards are there, each with
+        all its hosts.  Raises ValueError if the files aren't from the same run.
+    """
+    headers = dict()
+    complete = True
+    for filename in filenames:
+        header, records = read_header(filename)
+        if header["shard"] in headers:
+            raise ValueError(f"{filename}: shard {header['shard']} was given twice")
+        if len(headers) > 0:
+            first = next(iter(headers.values()))
+            if header["shard"].split("/")[1] != first["shard"].split("/")[1] or \
+                    [header[key] for key in ("mode", "fix", "reboot")] != \
+                    [first[key] for key in ("mode", "fix", "reboot")]:
+                raise ValueError(f"{filename} is from a different run (shard {header['shard']}, {header['mode']}) " +
+                                 f"than shard {first['shard']} ({first['mode']})")
+        headers[header["shard"]] = header
+        if records < header["hosts"]:
+            log.warning(f"Shard {header['shard']} has results for only {records} of its {header['hosts']} hosts - " +
+                        f"was it interrupted?")
+            complete = False
+
+    header = next(iter(headers.values()))
+    count = int(header["shard"].split("/")[1])
+    missing = [f"{index}/{count}" for index in range(1, count + 1) if f"{index}/{count}" not in headers]
+    if len(missing) > 0:
+        log.warning(f"Missing the results of shard{'s' if len(missing) > 1 else ''} {', '.join(missing)}")
+        complete = False
+    return header, complete
+
+
+def shard_records(filenames):
+    # every shard's host records, read a line at a time, so merging doesn't hold them all at once
+    for filename in filenames:
+        with open(filename) as f:
+            f.readline()        # the header
+            for line in f:
+                if line.strip() != "":
+                    yield json.loads(line)
+
+
+class ShardHost(object):
+    # a host as recorded by a shard's --dump, with what fleet_diff() needs of a Server
+    __slots__ = ("hostname", "manufacturer", "arch", "model", "bios_settings")
+
+    def __init__(self, record):
+        self.hostname = record["host"]
+        self.manufacturer = record["manufacturer"]
+        self.arch = record.get("arch")
+        self.model = record["model"]
+        self.bios_settings = BiosAttributes(record["attributes"])     # as a live host's are
+
+    @property
+    def bmc(self):
+        return self
+
+    def trimmed_bios_settings(self):
+        return trim_supermicro_dict(self.bios_settings)
+
+
+def shard_argv(argv, index, count, filename, max_rate=None, vendor_rates=None, metrics_out=None):
+    # the command line for one shard: the driver's own options, with these added after them (so they win).  The
+    # run-wide rate limits are shared out between the shards.
+    argv = list(argv) + ["--shard", f"{index}/{count}", "--ndjson", filename]
+    if max_rate is not None:
+        argv += ["--max-rate", str(max_rate / count)]
+    for vendor, rate in (vendor_rates or {}).items():
+        argv += ["--vendor-rate", f"{vendor}={rate / count}"]
+    if metrics_out is not None:
+        root, ext = os.path.splitext(metrics_out)
+        argv += ["--metrics-out", f"{root}.shard-{index}-of-{count}{ext}"]
+    return argv
+
+
+def shard_command(script):
+    # how to run bios_tool again.  In the PyInstaller binary (see pyinstall.sh), sys.executable is bios_tool itself.
+    if getattr(sys, "frozen", False):
+        return [sys.executable]
+    return [sys.executable, script]
+
+
+def run_local_shards(script, argv, processes, directory, **shared):
+    """
+    Run the shards of a run at once, as processes on this machine
+    :param script: bios_tool.py (unless we're the PyInstaller binary)
+    :param argv: its command-line options for the whole run
+    :param processes: how many shards (and so processes)
+    :param directory: where the shards write their results
+    :param shared: max_rate, vendor_rates and metrics_out, shared out between the shards (see shard_argv())
+    :return: (the shards' result files, True if every shard succeeded)
+    """
+    running = list()
+    try:
+        for index in range(1, processes + 1):
+            filename = os.path.join(directory, f"shard-{index}-of-{processes}.ndjson")
+            command = shard_command(script) + shard_argv(argv, index, processes, filename, **shared)
+            running.append((index, filename, subprocess.Popen(command)))
+        log.info(f"Running {processes} shards")
+        ok = True
+        for index, filename, process in running:
+            if process.wait() != 0:
+                log.error(f"Shard {index}/{processes} failed (exit status {process.returncode})")
+                ok = False
+    finally:
+        # ie: interrupted - don't leave the shards running
+        for index, filename, process in running:
+            if process.poll() is None:
+                process.terminate()
+    return [filename for index, filename, process in running if os.path.exists(filename)], ok
@@ -0,0 +1,183 @@
+# Watch.py - keep watching the hosts' BIOS settings for drift (see --watch)
+#
+# The sessions are opened (and discovery done) once.  After that, only the Bios resource and its pending
+# Bios/Settings are re-read, with If-None-Match so an unchanged resource costs a 304, and only changes are reported:
+# settings that changed, settings pending for the next reboot, and hosts going in or out of compliance.
+# BMCs with a server-sent event stream in their EventService push their changes; those hosts are re-read when an
+# event arrives, and otherwise only polled every KEEPALIVE seconds to keep their sessions alive.
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from logging import getLogger
+
+from RedFishBMC import settings_fingerprint
+
+log = getLogger(__name__)
+
+# how often hosts that push events are polled anyway - BMC sessions time out after 30 minutes or so of idling
+KEEPALIVE = 10 * 60
+
+
+class WatchedHost(object):
+    def __init__(self, server, desired):
+        self.server = server
+        self.desired = desired          # the settings it should have, or None if there's no definition for it
+        self.bios = None                # the current attributes, and the ETag (or fingerprint) they came with
+        self.bios_etag = None
+        self.pending = dict()           # attributes set in Bios/Settings that differ from the current ones
+        self.pending_etag = None
+        self.changes_needed = None
+        self.streaming = False          # events are being pushed for this host
+        self.next_poll = 0.0
+
+
+class BiosWatcher(object):
+    def __init__(self, servers, desired_settings, interval=300, workers=10, use_events=True):
+        """
+        :param servers: connected Servers
+        :param desired_settings: hostname -> the settings the host should have (ie: from find_bios_settings())
+        :param interval: seconds between polls of hosts that don't push events
+        :param workers: how many hosts are polled at once
+        :param use_events: subscribe to the BMCs' event streams where they have them
+        """
+        self.hosts = {server.hostname: WatchedHost(server, desired_settings.get(server.hostname))
+                      for server in servers}
+        self.interval = interval
+        self.workers = workers
+        self.use_events = use_events
+        self.wakeup = queue.Queue()     # hostnames to poll now, because they've pushed an event
+        self.stopping = threading.Event()
+
+    def run(self, rounds=None):
+        # watch until interrupted (or for the given number of polling rounds)
+        for server in (host.server for host in self.hosts.values()):
+            server.bmc.keep_alive = True
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="watch") as executor:
+            # the first round just notes where everything stands
+            list(executor.map(self.start, self.hosts.values()))
+            noncompliant = [host for host in self.hosts.values() if host.changes_needed]
+            log.info(f"Watching {len(self.hosts)} hosts; {len(noncompliant)} are not compliant")
+            if self.use_events:
+                for host in self.hosts.values():
+                    threading.Thread(target=self.listen, args=(host,), daemon=True,
+                                     name=f"events-{host.server.hostname}").start()
+
+            try:
+                while not self.stopping.is_set() and (rounds is None or rounds > 0):
+                    self.wait_for_next_poll()
+                    now = time.monotonic()
+                    due = [host for host in self.hosts.values() if host.next_poll <= now]
+                    list(executor.map(self.poll, due))
+                    if rounds is not None:
+                        rounds -= 1
+            except KeyboardInterrupt:
+                log.info("Stopping watch")
+            finally:
+                self.stopping.set()
+
+    def wait_for_next_poll(self):
+        # sleep until a host is due to be polled, or an event says one has changed
+        timeout = max(0.0, min(host.next_poll for host in self.hosts.values()) - time.monotonic())
+        try:
+            hostnames = [self.wakeup.get(timeout=timeout)]
+        except queue.Empty:
+            return
+        while not self.wakeup.empty():
+            hostnames.append(self.wakeup.get_nowait())
+        for hostname in hostnames:
+            self.hosts[hostname].next_poll = 0.0
+
+    def start(self, host):
+        # start from the Bios resource read when the session was opened, so the first poll can be conditional
+        bmc = host.server.bmc
+        host.bios = bmc.get_bios_settings()
+        host.bios_etag = bmc.bios_etag
+        if host.desired is not None:
+            host.changes_needed = bmc.check_settings(host.desired, quiet=True)
+        self.poll(host, initial=True)
+
+    def poll(self, host, initial=False):
+        host.next_poll = time.monotonic() + (max(KEEPALIVE, self.interval) if host.streaming else self.interval)
+        bmc = host.server.bmc
+        bmc.budget.restart()        # each poll has the host's whole request time budget (see Deadlines)
+        try:
+            resp = bmc.get_if_changed(bmc.bios_uri, host.bios_etag)
+            if resp is not None:
+                self.bios_changed(host, resp, initial)
+            resp = bmc.get_if_changed(bmc.bios_settings_uri, host.pending_etag)
+            if resp is not None:
+                self.pending_changed(host, resp, initial)
+        except Exception as exc:
+            log.error(f"{host.server.hostname}: unable to read BIOS settings: {exc}")
+
+    def bios_changed(self, host, resp, initial):
+        hostname = host.server.hostname
+        attributes = resp.dict.get('Attributes', {})
+        # BMCs that don't do ETags return the whole resource every time - check whether it really changed
+        etag = resp.getheader('ETag')
+        if etag is None and host.bios is not None and settings_fingerprint(attributes) == \
+                settings_fingerprint(host.bios):
+            return
+        if not initial:
+            for key in sorted(set(attributes) | set(host.bios)):
+                if attributes.get(key) != host.bios.get(key):
+                    log.warning(f"{hostname}: BIOS setting {key} changed from {host.bios.get(key)} to " +
+                                f"{attributes.get(key)}")
+
+        # check it against what it should be
+        bmc = host.server.bmc
+        bmc.load_bios(resp.dict)
+        bmc.bios_etag = etag
+        host.bios = bmc.get_bios_settings()
+        host.bios_etag = etag
+        if host.desired is None:
+            return
+        was = host.changes_needed
+        host.changes_needed = bmc.check_settings(host.desired, quiet=True)
+        if initial or was == host.changes_needed:
+            return
+        if host.changes_needed == 0:
+            log.info(f"{hostname} is compliant again")
+        else:
+            log.warning(f"{hostname} is out of compliance: {host.changes_needed} settings differ")
+
+    def pending_changed(self, host, resp, initial):
+        hostname = host.server.hostname
+        # some BMCs list every attribute in Bios/Settings; only the ones that differ are really pending
+        current = host.bios or {}
+        pending = {key: value for key, value in resp.dict.get('Attributes', {}).items() if current.get(key) != value}
+        host.pending_etag = resp.getheader('ETag')
+        if pending == host.pending:
+            return
+        for key, value in sorted(pending.items()):
+            if host.pending.get(key) != value:
+                log.warning(f"{hostname}: BIOS setting {key} will change to {value} at the next reboot")
+        if len(pending) == 0 and not initial:
+            log.info(f"{hostname}: no BIOS changes are pending")
+        host.pending = pending
+
+    def listen(self, host):
+        # read the host's event stream (if it has one), waking the main loop for each event.  If the stream fails
+        # the host goes back to being polled.
+        hostname = host.server.hostname
+        try:
+            uri = host.server.bmc.event_stream_uri()
+            if uri is None:
+                log.debug(f"{hostname} does not push events; polling it every {self.interval} seconds")
+                return
+            host.streaming = True
+            log.debug(f"{hostname}: subscribed to {uri}")
+            for event in host.server.bmc.events(uri):
+                if self.stopping.is_set():
+                    return
+                log.debug(f"{hostname}: event {event}")
+                self.wakeup.put(hostname)
+            log.info(f"{hostname}: event stream closed; polling instead")
+        except Exception as exc:
+            log.info(f"{hostname}: event stream failed ({exc}); polling instead")
+        finally:
+            if host.streaming:
+                host.streaming = False
+                host.next_poll = 0.0
+                self.wakeup.put(hostname)
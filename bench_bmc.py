@@ -0,0 +1,192 @@
+# bench_bmc.py - end-to-end scaling benchmark: run bios_tool against a fleet of simulated BMCs (see MockBMC.py)
+#
+# For each fleet size and mode, bios_tool is run as a separate process against the mock, and the wall time, request
+# rate, connections (and TLS handshakes) made, peak RSS of the bios_tool process and per-phase BMC latencies are
+# reported.
+#
+# usage: python bench_bmc.py --hosts 10 100 1000 --modes dump check fix --latency 0.2 -- --workers 50
+#        (anything after -- is passed on to bios_tool)
+#
+# With --startup, bios_tool's start-up time is measured instead (no mock is needed): short invocations are run with
+# python -X importtime, and their wall and import times reported, along with any of the heavy dependencies they
+# loaded.  These should only be imported by the code paths that use them, so the exit status is 1 if any were.
+import argparse
+import json
+import os
+import subprocess
+import statistics
+import sys
+import tempfile
+import time
+
+from tabulate import tabulate
+
+from MockBMC import PHASES, host_config, start_server
+
+# bios_tool options for each benchmarked mode
+MODES = {"dump": ["--dump"],
+         "check": [],
+         "fix": ["--fix"],
+         "reset": ["--reset-bios"]}
+
+# bios_tool invocations for --startup, and the modules they shouldn't need to import
+STARTUP_COMMANDS = {"version": ["--version"],
+                    "help": ["--help"]}
+HEAVY_MODULES = ["redfish", "requests", "urllib3", "asyncio", "paramiko", "fabric", "invoke", "yaml", "tabulate",
+                 "rapidfuzz", "wekapyutils"]
+
+
+def percentile(values, pct):
+    if len(values) == 0:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def run_bios_tool(hostfile, mode, extra_args):
+    # run bios_tool, returning (wall time, exit status, peak RSS in MB)
+    here = os.path.dirname(os.path.abspath(__file__))
+    command = [sys.executable, os.path.join(here, "bios_tool.py"), "-c", hostfile] + MODES[mode] + extra_args
+    start = time.monotonic()
+    process = subprocess.Popen(command, cwd=here, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    _, status, usage = os.wait4(process.pid, 0)
+    elapsed = time.monotonic() - start
+    return elapsed, os.waitstatus_to_exitcode(status), usage.ru_maxrss / 1024     # ru_maxrss is in KB on Linux
+
+
+def benchmark(server, hosts, mode, extra_args):
+    with tempfile.NamedTemporaryFile("w", prefix="bench-hosts-", suffix=".csv", delete=False) as f:
+        hostfile = f.name
+    try:
+        host_config(hosts, server.server_address[1], hostfile, scheme=server.scheme)
+        server.reset_stats()
+        elapsed, returncode, peak_rss = run_bios_tool(hostfile, mode, extra_args)
+    finally:
+        os.unlink(hostfile)
+
+    stats = server.stats()
+    result = {"hosts": hosts, "mode": mode, "wall_time": round(elapsed, 3), "exit_status": returncode,
+              "requests": stats["requests"], "errors": stats["errors"], "connections": stats["connections"],
+              "tls_handshakes": stats["tls_handshakes"], "tls_resumed": stats["tls_resumed"],
+              "requests_per_sec": round(stats["requests"] / elapsed, 1) if elapsed > 0 else None,
+              "peak_rss_mb": round(peak_rss, 1), "phases": dict()}
+    for phase in PHASES:
+        latencies = stats["phase_latencies"][phase]
+        if len(latencies) > 0:
+            result["phases"][phase] = {"count": len(latencies),
+                                       **{f"p{pct}": round(percentile(latencies, pct) * 1000, 1)
+                                          for pct in (50, 95, 99)}}
+    return result
+
+
+def startup_benchmark(name, runs):
+    # run one of the STARTUP_COMMANDS runs times, returning the median wall and import times, and the heavy modules
+    # it imported
+    here = os.path.dirname(os.path.abspath(__file__))
+    command = [sys.executable, "-X", "importtime", os.path.join(here, "bios_tool.py")] + STARTUP_COMMANDS[name]
+    wall_times = list()
+    import_times = list()
+    heavy = set()
+    for _ in range(runs):
+        start = time.monotonic()
+        process = subprocess.run(command, cwd=here, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+        wall_times.append(time.monotonic() - start)
+        # lines are "import time: <self us> | <cumulative us> | <module>", with submodules indented under the module
+        # that imported them, so the total is the sum of the top-level (unindented) modules' cumulative times
+        total = 0
+        for line in process.stderr.splitlines():
+            if not line.startswith("import time:") or line.endswith("| imported package"):
+                continue
+            _, cumulative, module = line[len("import time:"):].split("|")
+            if not module[1:].startswith(" "):
+                total += int(cumulative)
+            if module.strip().split(".")[0] in HEAVY_MODULES:
+                heavy.add(module.strip().split(".")[0])
+        import_times.append(total / 1e6)
+    return {"command": name, "runs": runs, "wall_time": round(statistics.median(wall_times), 3),
+            "import_time": round(statistics.median(import_times), 3), "heavy_imports": sorted(heavy)}
+
+
+def print_startup_results(results):
+    print(tabulate([[r["command"], r["runs"], r["wall_time"], r["import_time"], ", ".join(r["heavy_imports"])]
+                    for r in results],
+                   headers=["Command", "Runs", "Wall (s)", "Imports (s)", "Heavy imports"]))
+
+
+def print_results(results):
+    print(tabulate([[r["hosts"], r["mode"], r["wall_time"], r["exit_status"], r["requests"], r["errors"],
+                     r["requests_per_sec"], r["connections"], f"{r['tls_handshakes']} ({r['tls_resumed']} resumed)",
+                     r["peak_rss_mb"]] for r in results],
+                   headers=["Hosts", "Mode", "Wall (s)", "Exit", "Requests", "Errors", "Req/s", "Connections",
+                            "TLS handshakes", "Peak RSS (MB)"]))
+    print()
+    rows = list()
+    for r in results:
+        for phase, stats in r["phases"].items():
+            rows.append([r["hosts"], r["mode"], phase, stats["count"], stats["p50"], stats["p95"], stats["p99"]])
+    print(tabulate(rows, headers=["Hosts", "Mode", "Phase", "Requests", "p50 (ms)", "p95 (ms)", "p99 (ms)"]))
+
+
+def main():
+    argv = sys.argv[1:]
+    extra_args = list()
+    if "--" in argv:
+        extra_args = argv[argv.index("--") + 1:]
+        argv = argv[:argv.index("--")]
+
+    parser = argparse.ArgumentParser(description="Benchmark bios_tool against a fleet of simulated BMCs")
+    parser.add_argument("--hosts", type=int, nargs="+", default=[10, 100, 1000, 5000],
+                        help="Fleet sizes to benchmark. Default is 10 100 1000 5000")
+    parser.add_argument("--modes", nargs="+", choices=MODES.keys(), default=["dump", "check", "fix", "reset"],
+                        help="bios_tool modes to benchmark. Default is all of them")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds each simulated BMC request takes")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Random +/- seconds added to each request")
+    parser.add_argument("--error-rate", dest="error_rate", type=float, default=0.0,
+                        help="Fraction of requests that fail with a 503")
+    parser.add_argument("--stall-rate", dest="stall_rate", type=float, default=0.0,
+                        help="Fraction of requests that hang for --stall-time seconds")
+    parser.add_argument("--stall-time", dest="stall_time", type=float, default=60.0,
+                        help="Seconds a stalled request hangs for. Default is 60")
+    parser.add_argument("--dead-every", dest="dead_every", type=int, default=None,
+                        help="Every Nth simulated BMC stops answering once it has been logged in to")
+    parser.add_argument("--bmc-rate", dest="bmc_rate", type=float, default=None,
+                        help="Most requests/second each simulated BMC answers; the rest get a 429")
+    parser.add_argument("--session-limit", dest="session_limit", type=int, default=None,
+                        help="Maximum number of open sessions per BMC")
+    parser.add_argument("--tls-cert", dest="tls_cert", default=None,
+                        help="Have the mock serve HTTPS with this certificate (PEM), to measure TLS handshakes")
+    parser.add_argument("--tls-key", dest="tls_key", default=None,
+                        help="The private key for --tls-cert, if it isn't in the same file")
+    parser.add_argument("--startup", dest="startup", type=int, default=None, metavar="RUNS",
+                        help="Measure bios_tool's start-up time instead, over this many runs of each short command")
+    parser.add_argument("--json", dest="json", type=str, default=None, help="Also write the results to this file")
+    args = parser.parse_args(argv)
+
+    if args.startup is not None:
+        results = [startup_benchmark(name, args.startup) for name in STARTUP_COMMANDS]
+        print_startup_results(results)
+        if args.json is not None:
+            with open(args.json, "w") as f:
+                json.dump(results, f, indent=4)
+        sys.exit(1 if any(len(result["heavy_imports"]) > 0 for result in results) else 0)
+
+    server = start_server(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                          session_limit=args.session_limit, seed=0, certfile=args.tls_cert, keyfile=args.tls_key,
+                          stall_rate=args.stall_rate, stall_time=args.stall_time, dead_every=args.dead_every,
+                          bmc_rate=args.bmc_rate)
+    results = list()
+    for hosts in args.hosts:
+        for mode in args.modes:
+            result = benchmark(server, hosts, mode, extra_args)
+            print(f"{hosts} hosts, {mode}: {result['wall_time']}s, {result['requests']} requests", file=sys.stderr)
+            results.append(result)
+    server.shutdown()
+
+    print_results(results)
+    if args.json is not None:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=4)
+
+
+if __name__ == '__main__':
+    main()
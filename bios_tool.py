@@ -1,97 +1,147 @@
 import argparse
 import logging
+import os
 import sys
-import redfish
-import yaml
-from redfish.rest.v1 import RetriesExhaustedError
-
-from wekapyutils.wekalogging import configure_logging, register_module
-from RedFishBMC import RedFishBMC
-from BMCsetup import bmc_setup, get_ipmi_ip
-from tabulate import tabulate
+import time
+
+from RedFishBMC import DISCOVERY_STEPS, print_bios_settings
+from AdaptiveConcurrency import AdaptiveConcurrency
+from BMCcache import SessionCache, DiscoveryCache, ComplianceCache, RegistryCache
+from ConfigFiles import load_config
+from Deadlines import Deadlines
+from DefaultsDB import open_defaults_db, convert_defaults_db
+from FleetDiff import fleet_diff, print_fleet_diff
+from KeyResolver import KeyResolver
+from Metrics import Tracer, null_tracer, PHASE
+from RateShaper import RateShaper
+from ResultStream import NDJSONWriter, dump_record, check_record, error_record
+from RollingReboot import RollingReboot
+from Shards import shard_spec, select_shard, shard_header, check_shards, shard_records, run_local_shards, ShardHost
+from Watch import BiosWatcher
+
+# The heavy dependencies (redfish and requests, asyncio, BMCsetup's SSH stack, yaml, tabulate, rapidfuzz and even
+# wekapyutils) are imported where they're used, not here, so --version and the runs that don't need them start
+# quickly.  bench_bmc.py --startup measures it.
 
 # get root logger
 log = logging.getLogger()
 
 class Server(object):
-    def __init__(self, hostname, username, password):
+    __slots__ = ("hostname", "username", "password", "bmc_options", "tracer", "bmc", "error")
+
+    # bmc_options are passed on to RedFishBMC (ie: session_cache, discovery_cache, tracer)
+    def __init__(self, hostname, username, password, **bmc_options):
         self.hostname = hostname
         self.username = username
         self.password = password
+        self.bmc_options = bmc_options
+        self.tracer = bmc_options.get("tracer") or null_tracer
         self.bmc = None
-        self.bios_settings = None
-        self.manufacturer = None
-        self.arch = None
-        self.model = None
+        self.error = None       # why we couldn't connect, if we couldn't
+
+    # time one phase of the work on this host (see Metrics)
+    def phase(self, name):
+        return self.tracer.span(self.hostname, PHASE, name)
+
+    # these come from the bmc, which only fetches them from the server when they're first needed
+    @property
+    def bios_settings(self):
+        return self.bmc.get_bios_settings() if self.bmc else None
 
+    @property
+    def manufacturer(self):
+        return self.bmc.manufacturer if self.bmc else None
 
-    def connect(self):
+    @property
+    def arch(self):
+        return self.bmc.arch if self.bmc else None
+
+    @property
+    def model(self):
+        return self.bmc.model if self.bmc else None
+
+    # discover is the list of RedFishBMC discovery steps to run now (see discovery_steps()), rather than on first use
+    def connect(self, discover=DISCOVERY_STEPS):
+        from redfish.rest.v1 import InvalidCredentialsError, RetriesExhaustedError
+        from RedFishBMC import RedFishBMC
         try:
             # need to add a timeout here...
-            self.bmc = RedFishBMC(self.hostname, username=self.username, password=self.password)
-            self.bios_settings = self.bmc.get_bios_settings()
-            self.manufacturer = self.bmc.manufacturer
-            self.arch = self.bmc.arch
-            self.model = self.bmc.model
-            log.info(f"Connected to {self.hostname}")
+            with self.phase("connect"):
+                self._connected(RedFishBMC(self.hostname, username=self.username, password=self.password,
+                                           discover=discover, **self.bmc_options))
+            return self
+        except InvalidCredentialsError:
+            self.error = "invalid credentials"
+            log.error(f"Invalid credentials for {self.hostname}")
+        except RetriesExhaustedError:
+            self.error = "retries exhausted"
+            log.error(f"Error connecting to {self.hostname}: Retries exhausted.  Is the server running?")
+        except Exception as exc:
+            self.error = str(exc)
+            log.error(f"Error opening connections to {self.hostname}: {exc}")
+
+        return None
+
+    # same as connect(), but runs on an event loop - see AsyncRedFishBMC
+    async def connect_async(self, executor=None, discover=DISCOVERY_STEPS):
+        from redfish.rest.v1 import InvalidCredentialsError, RetriesExhaustedError
+        from AsyncRedFishBMC import AsyncRedFishBMC
+        try:
+            with self.phase("connect"):
+                self._connected(await AsyncRedFishBMC.open(self.hostname, username=self.username,
+                                                           password=self.password, executor=executor,
+                                                           discover=discover, **self.bmc_options))
             return self
-        except redfish.rest.v1.InvalidCredentialsError:
+        except InvalidCredentialsError:
+            self.error = "invalid credentials"
             log.error(f"Invalid credentials for {self.hostname}")
         except RetriesExhaustedError:
+            self.error = "retries exhausted"
             log.error(f"Error connecting to {self.hostname}: Retries exhausted.  Is the server running?")
         except Exception as exc:
+            self.error = str(exc)
             log.error(f"Error opening connections to {self.hostname}: {exc}")
 
         return None
 
 
+    def _connected(self, bmc):
+        self.bmc = bmc
+        log.info(f"Connected to {self.hostname}")
+
+    # closing drops the bmc (and the BIOS settings it holds), so a host's memory is released once it's finished with
     def close(self):
         if self.bmc:
-            self.bmc.redfish.logout()
-
-
-def csv_load(f):
-    """
-    Load a CSV file into a list of dictionaries
-    :param f: file object
-    :return: list of dictionaries
-    """
-    import csv
-    reader = None
-    exc = None
-    try:
-        reader = csv.DictReader(f)
-    except Exception as exc:
-        #log.error(f"Error reading CSV file: {exc}")
-        return None, exc
-    return {"hosts":list(reader)}, exc
+            with self.phase("close"):
+                self.bmc.close()
+            self.bmc = None
+
+
+# which parts of the RedFish tree each mode needs - everything else is skipped (or fetched on first use)
+def discovery_steps(args):
+    if args.dump:
+        # a shard's dump may be merged into a fleet diff (see merge_shards()), which needs each host's arch
+        steps = ["bios"] if args.shard is None else ["system", "arch", "bios"]
+    elif args.diff or args.fleet_diff:
+        steps = ["system", "arch", "bios"]
+    else:
+        steps = ["arch", "bios"]
+    if args.reboot:
+        steps.append("reset_types")
+    return steps
+
+
+# the most threads that may be sending RedFish requests at once - those opening sessions, and (as the sessions are
+# streamed to it) the pipeline's
+def request_threads(args):
+    if args.use_async:
+        opening = (args.workers or 200) * 4     # see async_executor()
+    elif args.adaptive:
+        opening = AdaptiveConcurrency().maximum
+    else:
+        opening = args.workers or 10
+    return opening + (args.workers or PIPELINE_WORKERS)
 
-def yaml_load(f):
-    data = None
-    exc = None
-    try:
-        data = yaml.unsafe_load(f)
-    except Exception as exc:
-        pass
-        #log.error(f"Error reading YAML file: {exc}")
-        #raise
-    return data, exc
-
-# load a config file - either CSV or YAML
-def load_config(inputfile):
-    data = None
-    try:
-        f = open(inputfile)
-    except Exception as exc:
-        raise
-    data, exc = yaml_load(f)
-    if type(data) is not dict:   # yaml_load returns a dict; if not a dict, it's an error reading file
-        f.seek(0)   # rewind the file
-        data, exc = csv_load(f)     # try CSV
-    if type(data) is not dict:
-        log.error(f"Error reading config file: {exc}")
-        return None
-    return data
 
 def generate_config(bmc_ips, bmc_username, bmc_password):
     conf = dict()
@@ -101,82 +151,61 @@ def generate_config(bmc_ips, bmc_username, bmc_password):
     return conf
 
 def save_bmc_db(redfish_list, defaults_database, force=False):
-    bmc_db = None
     changes_made = False
     try:
-        bmc_db = load_config(defaults_database)
-    except FileNotFoundError: # it's ok if it doesn't exist - we'll create it
-        log.info(f"Bios database {defaults_database} does not exist, creating")
-        pass
+        bmc_db = open_defaults_db(defaults_database)
     except Exception as exc:
         log.error(f"Database file {defaults_database} file: {exc}")
         return False
 
-    if bmc_db is None:
-        bmc_db = dict()
-
-    # build the in-memory db
+    # only the models that change are written
     for server in redfish_list:
         manufacturer = server.manufacturer
         model = server.model
         architecture = server.arch
-        if manufacturer not in bmc_db:
-            bmc_db[manufacturer] = dict()
-        if architecture not in bmc_db[manufacturer]:
-            bmc_db[manufacturer][architecture] = dict()
 
         # always overwrite any old settings?
-        if model in bmc_db[manufacturer][architecture]:
+        if bmc_db.has(manufacturer, architecture, model):
             if force:
                 log.warning(f"{manufacturer}/{architecture}/{model} found in database, forcing overwrite")
-                bmc_db[manufacturer][architecture][model] = server.bios_settings
+                bmc_db.put(manufacturer, architecture, model, dict(server.bios_settings))
                 changes_made = True
             else:
                 log.info(f"{manufacturer}/{architecture}/{model} found in database; to force overwrite use --force")
         else:
-            bmc_db[manufacturer][architecture][model] = server.bios_settings
+            bmc_db.put(manufacturer, architecture, model, dict(server.bios_settings))
             changes_made = True
 
-    if changes_made:
-        with open(defaults_database, 'w') as f:
-            f.write('# Bios Defaults Database\n')
-            f.write('# This should contain the default/factory reset values\n')
-            yaml.dump(bmc_db, f, default_flow_style=False)
-
+    bmc_db.save()
     return changes_made
 
 # Generate the bios defs for a server model so we can later set the values on new servers
 def diff_defaults(defaults_database, redfish_list):
-    bmc_db = None
+    import yaml
     custom_settings = dict()
     try:
-        bmc_db = load_config(defaults_database)
-    except FileNotFoundError: # it's ok if it doesn't exist - we'll create it
-        log.info(f"Bios database {defaults_database} does not exist, creating")
+        bmc_db = open_defaults_db(defaults_database)
     except Exception as exc:
         log.error(f"Database file {defaults_database} file: {exc}")
         return False
 
-    if bmc_db is None:
-        bmc_db = dict()
-
     for server in redfish_list:
         manufacturer = server.bmc.manufacturer
         model = server.bmc.model
         arch = server.bmc.arch
-        bios_settings = server.bmc.bios_data.dict['Attributes']  # bios settings on the target server
+        bios_settings = server.bios_settings  # bios settings on the target server
 
-        if manufacturer not in bmc_db:
+        if not bmc_db.has(manufacturer):
             log.error(f"There are no default settings for {manufacturer}")
             return False
-        if arch not in bmc_db[manufacturer]:
+        if not bmc_db.has(manufacturer, arch):
             log.error(f"There are no default settings for {manufacturer}/{arch}")
             return False
-        if model not in bmc_db[manufacturer][arch]:
+        if not bmc_db.has(manufacturer, arch, model):
             log.error(f"There are no default settings for {manufacturer}/{arch}/{model}")
             return False
 
-        defaults = bmc_db[manufacturer][arch][model]
+        defaults = bmc_db.get(manufacturer, arch, model)
 
         # make a list of setting that differ on this server compared to factory defaults
         log.info(f"Looking at defaults for {server.hostname}: {manufacturer}/{arch}/{model}:")
@@ -214,6 +243,7 @@ def diff_defaults(defaults_database, redfish_list):
 
 
 def bios_diff(hostlist):
+    from tabulate import tabulate
     hosta = hostlist[0]
     hostb = hostlist[1]
 
@@ -228,15 +258,15 @@ def bios_diff(hostlist):
     if hosta.bmc.bios_version != hostb.bmc.bios_version:
         print()
         print(f"WARNING: Hosts have different BIOS versions! {hosta.bmc.bios_version} vs {hostb.bmc.bios_version}")
-        # note:  Supermicro has a different BIOS keys in every bios version (all end in _XXXX, where XXXX is hex)
-        # the XXXX is different in different versions.  This means that the BIOS settings are not comparable
-        # between different versions of the BIOS.
-        # Perhaps we should trim the keys to remove the _XXXX part so we can compare different BIOS versions?
-        # This could be implemented by copying the hosta_bios and hostb_bios dictionaries and removing the _XXXX
-        # from the keys.  Then we could compare the two dictionaries.
 
     hosta_bios = hostlist[0].bios_settings
     hostb_bios = hostlist[1].bios_settings
+    if hosta.manufacturer == "Supermicro" and hosta.bmc.bios_version != hostb.bmc.bios_version:
+        # note:  Supermicro has a different BIOS keys in every bios version (all end in _XXXX, where XXXX is hex)
+        # the XXXX is different in different versions, so compare them on their trimmed keys (from each host's
+        # Supermicro key index) so that the same setting lines up between the two BIOS versions.
+        hosta_bios = hosta.bmc.trimmed_bios_settings()
+        hostb_bios = hostb.bmc.trimmed_bios_settings()
 
     diff = list()                  #  Entries are [setting, value_a, value_b]
     settings_not_present = list()  #  Entries are [setting, value_a, value_b]
@@ -285,51 +315,80 @@ def diff_dicts(dict1, dict2):
     return (diff, keys_not_present_in1, keys_not_present_in2)
 
 
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+
+# open sessions to the hosts, yielding each Server as soon as its session is open (in completion order, so one slow
+# BMC doesn't hold up the rest).  With adaptive=True, the number of concurrent logins starts at workers and is
+# raised or lowered according to how quickly (and how successfully) the BMCs respond.
+def iter_open_sessions(hostlist, workers=10, adaptive=False, discover=DISCOVERY_STEPS):
+    limiter = AdaptiveConcurrency(initial=workers) if adaptive else None
+
+    def timed_connect(host):
+        start = time.monotonic()
+        return host.connect(discover), time.monotonic() - start
+
+    pending = iter(hostlist)
+    in_flight = set()
+    with ThreadPoolExecutor(max_workers=limiter.maximum if adaptive else workers) as executor:
+        while True:
+            limit = limiter.limit if adaptive else workers
+            while len(in_flight) < limit:
+                host = next(pending, None)
+                if host is None:
+                    break
+                in_flight.add(executor.submit(timed_connect, host))
+            if not in_flight:
+                break
 
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                result, elapsed = future.result()
+                if adaptive:
+                    limiter.record(elapsed, error=result is None)
+                if result is not None:
+                    yield result
 
-def parallel_open_sessions(hostlist):
-    opened_list = list()
-    with ThreadPoolExecutor(max_workers=10) as executor:
-        futures = [executor.submit(Server.connect, host) for host in hostlist]
-        for future in futures:
-            result = future.result()
-            if result is not None:
-                opened_list.append(result)
+    if adaptive:
+        log.debug(f"Adaptive concurrency finished at {limiter.limit} workers ({limiter.errors} failed logins)")
 
 
-    return opened_list
+# like iter_open_sessions(), but wait for all of them and return the opened Servers in hostlist order
+def parallel_open_sessions(hostlist, workers=10, adaptive=False, discover=DISCOVERY_STEPS):
+    return in_host_order(iter_open_sessions(hostlist, workers=workers, adaptive=adaptive, discover=discover), hostlist)
 
 
+# open sessions from a single event loop, with up to max_in_flight hosts connecting at once
+def async_open_sessions(hostlist, max_in_flight=200, discover=DISCOVERY_STEPS):
+    import asyncio
+    from AsyncRedFishBMC import async_executor
+
+    async def open_all(executor):
+        in_flight = asyncio.Semaphore(max_in_flight)
+
+        async def open_one(host):
+            async with in_flight:
+                return await host.connect_async(executor, discover)
+
+        return await asyncio.gather(*[open_one(host) for host in hostlist])
+
+    with async_executor(max_in_flight) as executor:
+        results = asyncio.run(open_all(executor))
+    return [result for result in results if result is not None]
+# collect the opened Servers, in the order they were given in hostlist
+def in_host_order(opened, hostlist):
+    order = {id(host): index for index, host in enumerate(hostlist)}
+    return sorted(opened, key=lambda host: order[id(host)])
 
 def close_sessions(hostlist):
     for host in hostlist:
         host.close()
 
-def ends_with_hex(s):
-    """Check if string ends with _ and 4 hex digits"""
-    if len(s) < 5:  # Need at least 5 chars: _XXXX
-        return False
-    if s[-5] != '_':  # Must have underscore
-        return False
-    try:
-        # Try to convert last 4 chars to hex
-        int(s[-4:], 16)
-        return True
-    except ValueError:
-        return False
-
-def trim_trailing_hex(s):
-    """Trim trailing hex digits from string, return the string without trailing hex digits"""
-    if not ends_with_hex(s):
-        return s
-    else:
-        return s[:-5]
-
 # for the given server (bmc), try to find the settings in all_bios_settings, verify that the keys match, then return it
 # match the keys using fuzzy logic, and return the actual keys (prevents failures).
 # If there is no match for the server model, try finding one that matches closely?
-from rapidfuzz import process, fuzz
+key_resolver = KeyResolver()
+
 def find_bios_settings(server, all_bios_settings, force=False):
     base_settings = None
     wild = False
@@ -353,20 +412,21 @@ def find_bios_settings(server, all_bios_settings, force=False):
         return None
 
     derived_keys = dict()
-    preprocessor = trim_trailing_hex if server.manufacturer == "Supermicro" else None
+    trim_hex = server.manufacturer == "Supermicro"
 
-    log.debug(f"{server.manufacturer} using {preprocessor}")
+    log.debug(f"{server.manufacturer} trimming hex suffixes: {trim_hex}")
     # server_full_bios are what is set on the server now - all bios settings
     server_full_bios = server.bios_settings.keys()
     # base settings are a subset of settings from the bios_settings.yml file - what we want the settings to be
+    # check to see if the settings we want to make are actual settings in the BIOS of this server
+    matches = key_resolver.resolve(base_settings.keys(), server_full_bios, trim_hex=trim_hex,
+                                   identity=(server.manufacturer, server.model, server.bmc.bios_version))
     for setting in base_settings.keys():
-        # check to see if the settings we want to make are actual settings in the BIOS of this server
-        keyword = process.extract(setting, server_full_bios, processor=preprocessor, scorer=fuzz.ratio, limit=1)
-        if len(keyword) == 0:
+        if setting not in matches:
             log.error(f"Server {server.hostname}: Unknown setting: {setting}. Aborting.")
             return None
 
-        keyword, similarity, _ = keyword[0]
+        keyword, similarity = matches[setting]
         # is it an exact match?
         if similarity != 100.0:
             #log.warning(
@@ -402,6 +462,235 @@ def find_bios_settings(server, all_bios_settings, force=False):
     return this_servers_settings
 
 
+# how many hosts are checked/fixed/rebooted at once, once their sessions are open
+PIPELINE_WORKERS = 10
+
+# the outcome of the pipeline for one host
+class HostResult(object):
+    __slots__ = ("server", "changes_needed", "fixed", "reset", "needs_reboot", "rebooted", "settings", "verified",
+                 "deltas", "error")
+
+    def __init__(self, server):
+        self.server = server
+        self.changes_needed = 0
+        self.fixed = False
+        self.reset = False
+        self.needs_reboot = False
+        self.rebooted = False
+        self.settings = None        # the settings to verify after the reboot, if any
+        self.verified = None
+        self.deltas = dict()        # the settings that differ: {key: (current, desired)}
+        self.error = None
+
+
+# check one host's bios settings, and fix it if asked.  Hosts to reboot are marked with needs_reboot - they're
+# rebooted afterwards, in waves (see RollingReboot)
+# With known_good (a ComplianceCache), compliant hosts are remembered and only the hosts needing changes are reported
+def check_host(server, all_bios_settings, fix=False, reboot=False, known_good=None):
+    result = HostResult(server)
+    with server.phase("find_settings"):
+        settings = find_bios_settings(server, all_bios_settings)
+    quiet = logging.DEBUG if known_good is not None else logging.INFO
+    log.log(quiet, f"Looking at {server.hostname}: {server.bmc.manufacturer}/{server.bmc.arch}/{server.bmc.model}:")
+    with server.phase("check"):
+        result.changes_needed = server.bmc.check_settings(settings, known_good=known_good)
+    result.deltas = server.bmc.deltas
+    if result.changes_needed > 0:
+        log.info(f"{result.changes_needed} changes are needed on {server.hostname}")
+        if fix:
+            with server.phase("fix"):
+                fixed = server.bmc.change_settings(settings)
+            if fixed:
+                result.fixed = True
+                result.settings = settings
+            else:
+                log.error(f"Unable to fix {server.hostname}")
+    else:
+        log.log(logging.DEBUG if known_good is not None else logging.WARNING,
+                f"No changes are needed on {server.hostname}")
+
+    # --fix --reboot implies rebooting only the hosts that were fixed; --reboot alone reboots all hosts
+    result.needs_reboot = reboot and (result.fixed or not fix)
+    return result
+
+
+# reset one host's bios to factory defaults, and mark it to be rebooted if asked
+def reset_host(server, reboot=False):
+    result = HostResult(server)
+    with server.phase("reset"):
+        result.reset = server.bmc.reset_settings_to_default()
+    log.info(f"{server.bmc.name} has been reset to factory defaults")
+    result.needs_reboot = reboot
+    return result
+
+
+# reboot the hosts that need it, in waves; the host we're running on goes last.  on_done is called with each
+# host's result once it's been rebooted (see RollingReboot.run())
+def reboot_hosts(results, args, last=None, on_done=None):
+    to_reboot = [result for result in results if result.needs_reboot and result.error is None]
+    if len(to_reboot) == 0:
+        return
+    RollingReboot(wave_size=args.wave_size, wave_ready=args.wave_ready,
+                  timeout=args.reboot_timeout * 60, min_boot_time=args.min_boot_time,
+                  max_failures=args.max_reboot_failures).run(to_reboot, last=last, on_done=on_done)
+
+
+# with --ndjson, each host's record is written (and the host closed) as soon as it's finished with.  Hosts that are
+# going to be rebooted aren't finished until their reboot is done.
+def stream_results(stream):
+    def finished(result):
+        stream.write(check_record(result))
+        result.server.close()
+
+    def pipeline_done(result):
+        if not result.needs_reboot or result.error is not None:
+            finished(result)
+
+    return pipeline_done, finished
+
+
+# run func(server) over the hosts, workers at a time, and return their HostResults.  servers may be a generator
+# (see iter_open_sessions()); each host is started as soon as it arrives.
+# If last is given (the host we're running on), it runs by itself after all the others have finished, so
+# that it is rebooted last.
+# on_done, if given, is called with each host's result as soon as it's finished
+def run_pipeline(servers, func, last=None, workers=PIPELINE_WORKERS, on_done=None):
+    def run_one(server):
+        try:
+            result = func(server)
+        except Exception as exc:
+            log.error(f"Error processing {server.hostname}: {exc}")
+            result = HostResult(server)
+            result.error = exc
+        if on_done is not None:
+            on_done(result)
+        return result
+
+    held_back = list()
+
+    def hold_back_last():
+        for server in servers:
+            if server is last:
+                held_back.append(server)
+            else:
+                yield server
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(run_one, hold_back_last()))
+    for server in held_back:
+        results.append(run_one(server))
+    return results
+
+
+# the end-of-run report of a check (and --fix, and --reboot).  Merged shards are reported the same way (see
+# merge_shards()), so it's given just the counts.
+def check_summary(needing_changes, fixed, rebooted, verified, fix=False, reboot=False, prefix=""):
+    if not fix:
+        log.info(f"{prefix}There are {needing_changes} hosts needing changes")
+    elif not reboot:
+        log.info(f"{prefix}{fixed} have been modified.  Please reboot them to activate changes.")
+    else:
+        log.info(f"{prefix}{rebooted} have been successfully modified and rebooted, " +
+                 f"{verified} with their new BIOS settings verified.")
+
+
+# what a sharded run does (see Shards) - only the modes whose results are per host can be split up and merged again.
+# A fleet diff is sharded as a dump, and the diff done when the shards are merged.
+def shard_mode(args):
+    if args.bmc_config or args.diff or args.diff_defaults or args.save or args.watch:
+        return None
+    if args.fleet_diff:
+        return "dump"
+    if args.reset_bios:
+        return "reset"
+    return "dump" if args.dump else "check"
+
+
+# --merge: report on the results of a sharded run as a single run would have, and with --ndjson, write all of the
+# shards' records to one file.  Returns False if any of its shards' results are missing.
+def merge_shards(args, filenames):
+    try:
+        header, complete = check_shards(filenames)
+    except (OSError, ValueError) as exc:
+        log.error(f"Unable to merge the shards: {exc}")
+        return False
+    if args.fleet_diff and header["mode"] != "dump":
+        log.error(f"Can't diff the fleet from the shards of a {header['mode']} run - shard a --dump or --fleet-diff")
+        return False
+
+    stream = NDJSONWriter(args.ndjson) if args.ndjson is not None else None
+    fleet = list()
+    needing_changes = fixed = rebooted = verified = 0
+    for record in shard_records(filenames):
+        if stream is not None:
+            stream.write(record)
+        if record.get("error") is not None:
+            if "compliant" in record:
+                log.error(f"Error processing {record['host']}: {record['error']}")
+            else:
+                log.error(f"Error opening connections to {record['host']}: {record['error']}")
+        if "attributes" in record:
+            if args.fleet_diff:
+                fleet.append(ShardHost(record))
+            elif stream is None:
+                print_bios_settings(record["host"], record["attributes"])
+        elif "compliant" in record:
+            needing_changes += record["changes_needed"] > 0
+            fixed += record["fixed"]
+            rebooted += record["rebooted"]
+            verified += record["rebooted"] and record["verified"] is True
+    if stream is not None:
+        stream.close()
+
+    if args.fleet_diff:
+        # in host config order, as a single run has them, if we have the config
+        try:
+            order = {host['name']: index for index, host in enumerate(load_config(args.hostconfigfile)['hosts'])}
+            fleet.sort(key=lambda host: order.get(host.hostname, len(order)))
+        except Exception as exc:
+            log.debug(f"Not sorting the hosts: {exc}")
+        print_fleet_diff(fleet_diff(fleet), as_json=args.json)
+    elif header["mode"] == "check":
+        check_summary(needing_changes, fixed, rebooted, verified, fix=header["fix"], reboot=header["reboot"])
+    return complete
+
+
+# --processes: run the shards on this machine, one process each, and merge their results
+def run_processes(args):
+    import shutil
+    import tempfile
+    directory = tempfile.mkdtemp(prefix="bios_tool-shards-")
+    filenames, ok = run_local_shards(os.path.abspath(__file__), sys.argv[1:], args.processes, directory,
+                                     max_rate=args.max_rate, vendor_rates=dict(args.vendor_rates),
+                                     metrics_out=args.metrics_out)
+    merged = len(filenames) > 0 and merge_shards(args, filenames)
+    if ok and merged:
+        shutil.rmtree(directory)
+    else:
+        log.warning(f"The shards' results are in {directory}")
+    return ok and merged
+
+
+# --host-rate 10, --max-rate 200 (requests/second)
+def positive_rate(value):
+    try:
+        rate = float(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected a number of requests per second, not '{value}'")
+    if not rate > 0:
+        raise argparse.ArgumentTypeError(f"the rate must be more than 0, not {value}")
+    return rate
+
+
+# --vendor-rate Dell=50
+def vendor_rate(value):
+    vendor, _, rate = value.partition("=")
+    try:
+        float(rate)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected VENDOR=RATE (ie: Dell=50), not '{value}'")
+    return vendor, positive_rate(rate)
+
 
 def main():
     # parse arguments
@@ -424,11 +713,30 @@ def main():
                         help="Save default BIOS settings to defaults-database - should be factory reset values")
     parser.add_argument("--defaults-database", dest="defaults_database", default="defaults-db.yml",
                         help="Filename of the factory defaults-database.  Default is defaults-db.yml")
+    parser.add_argument("--convert-defaults", dest="convert_defaults", type=str, default=None,
+                        help="Copy the defaults-database into a new database (ie: a sharded directory) and exit")
     parser.add_argument("-f", "--force", dest="force", default=False, action="store_true",
                         help="Force overwriting existing BIOS settings and such")
+    parser.add_argument("--wave-size", dest="wave_size", type=int, default=10,
+                        help="With --reboot, how many hosts are rebooted at once. Default is 10")
+    parser.add_argument("--wave-ready", dest="wave_ready", type=float, default=1.0,
+                        help="With --reboot, the fraction of a wave that must be back up before the next wave " +
+                             "starts. Default is 1.0 (all of it)")
+    parser.add_argument("--reboot-timeout", dest="reboot_timeout", type=float, default=30,
+                        help="With --reboot, minutes a host has to come back up. Default is 30")
+    parser.add_argument("--min-boot-time", dest="min_boot_time", type=float, default=60,
+                        help="With --reboot, seconds to wait before a host that never showed itself going down " +
+                             "(powered off, or in POST) is taken to have rebooted. Default is 60")
+    parser.add_argument("--max-reboot-failures", dest="max_reboot_failures", type=int, default=0,
+                        help="With --reboot, how many hosts may fail to come back before no more waves are " +
+                             "started. Default is 0 (stop at the first)")
     parser.add_argument("--reset-bios", dest="reset_bios", default=False, action="store_true",
                         help="Reset BIOS to default settings.  To also reboot, add the --reboot option")
     parser.add_argument("--diff", dest="diff", nargs=2, default=False, help="Compare 2 hosts BIOS settings")
+    parser.add_argument("--fleet-diff", dest="fleet_diff", default=False, action="store_true",
+                        help="Group all hosts by identical BIOS settings and report the settings that differ")
+    parser.add_argument("--json", dest="json", default=False, action="store_true",
+                        help="Print --fleet-diff results as JSON")
     parser.add_argument("--diff-defaults", dest="diff_defaults", default=False, action="store_true",
                         help="Compare hosts BIOS settings to factory defaults")
     parser.add_argument("--version", dest="version", default=False, action="store_true",
@@ -439,6 +747,73 @@ def main():
                         help="a username to use on all hosts in --bmc_ips", default=None)
     parser.add_argument("--bmc-password", dest="bmc_password", type=str, nargs=1,
                         help="a password to use on all hosts in --bmc_ips", default=None)
+    parser.add_argument("--workers", dest="workers", type=int, default=None,
+                        help="Number of hosts to work on at once. Default is 10 (200 with --async)")
+    parser.add_argument("--adaptive", dest="adaptive", default=False, action="store_true",
+                        help="Adjust the number of concurrent logins based on BMC latency and errors, " +
+                             "starting at --workers")
+    parser.add_argument("--session-cache", dest="session_cache", default=False, action="store_true",
+                        help="Reuse RedFish sessions left open by previous runs, and leave them open for the next one")
+    parser.add_argument("--discovery-cache", dest="discovery_cache", default=False, action="store_true",
+                        help="Remember each BMC's RedFish URIs and Bios ETag, so later runs skip discovery and " +
+                             "only re-download BIOS settings that have changed")
+    parser.add_argument("--fingerprints", dest="fingerprints", default=False, action="store_true",
+                        help="Remember hosts found compliant and skip re-checking them while their BIOS is " +
+                             "unchanged; only hosts needing changes are reported")
+    parser.add_argument("--async", dest="use_async", default=False, action="store_true",
+                        help="Open sessions with the asyncio engine, which keeps many more hosts in flight at once")
+    parser.add_argument("--watch", dest="watch", default=False, action="store_true",
+                        help="Keep the sessions open and report BIOS changes and drift from the bios settings " +
+                             "until interrupted")
+    parser.add_argument("--watch-interval", dest="watch_interval", type=float, default=300,
+                        help="With --watch, seconds between polls of BMCs that don't push events. Default is 300")
+    parser.add_argument("--bmc-connections", dest="bmc_connections", type=int, default=2,
+                        help="Most HTTP connections open to any one BMC at once. Default is 2")
+    parser.add_argument("--no-keep-alive", dest="no_keep_alive", default=False, action="store_true",
+                        help="Open a new connection for every RedFish request, for BMCs that mishandle keep-alive")
+    parser.add_argument("--no-tls-resume", dest="no_tls_resume", default=False, action="store_true",
+                        help="Do a full TLS handshake for every new connection, rather than resuming the last session")
+    parser.add_argument("--request-timeout", dest="request_timeout", type=float, default=30.0,
+                        help="Seconds a RedFish GET may take before it's tried again. Default is 30")
+    parser.add_argument("--patch-timeout", dest="patch_timeout", type=float, default=300.0,
+                        help="Seconds the PATCH of the BIOS settings may take. Default is 300")
+    parser.add_argument("--reset-timeout", dest="reset_timeout", type=float, default=120.0,
+                        help="Seconds a BIOS or system reset request may take. Default is 120")
+    parser.add_argument("--discovery-timeout", dest="discovery_timeout", type=float, default=120.0,
+                        help="Seconds each discovery step may take, retries included. Default is 120")
+    parser.add_argument("--host-timeout", dest="host_timeout", type=float, default=900.0,
+                        help="Seconds of RedFish requests each host may use in all before it's given up on. " +
+                             "Default is 900")
+    parser.add_argument("--breaker-failures", dest="breaker_failures", type=int, default=3,
+                        help="Stop sending requests to a BMC after this many failures in a row. Default is 3")
+    parser.add_argument("--no-hedge", dest="no_hedge", default=False, action="store_true",
+                        help="Don't send a second copy of GETs that take far longer than the fleet's p95")
+    parser.add_argument("--host-rate", dest="host_rate", type=positive_rate, default=10.0,
+                        help="Most RedFish requests per second to any one BMC. Default is 10")
+    parser.add_argument("--vendor-rate", dest="vendor_rates", type=vendor_rate, action="append", default=[],
+                        metavar="VENDOR=RATE",
+                        help="Most RedFish requests per second to all of one vendor's BMCs together (ie: Dell=50). " +
+                             "May be given once per vendor")
+    parser.add_argument("--max-rate", dest="max_rate", type=positive_rate, default=None,
+                        help="Most RedFish requests per second to all the BMCs together. Default is no limit")
+    parser.add_argument("--no-registry", dest="no_registry", default=False, action="store_true",
+                        help="Don't check settings against the BMC's BIOS attribute registry before setting them")
+    parser.add_argument("--metrics-out", dest="metrics_out", type=str, default=None,
+                        help="Time every RedFish request and phase per host, write the timings to this JSON file " +
+                             "and a Prometheus textfile (.prom) alongside it, and print the slowest hosts/endpoints")
+    parser.add_argument("--ndjson", dest="ndjson", type=str, default=None,
+                        help="Write one JSON record per host to this file ('-' for stdout) as soon as the host is " +
+                             "done: its BIOS settings with --dump, otherwise its compliance, the settings that " +
+                             "differ, and any errors")
+    parser.add_argument("--shard", dest="shard", type=shard_spec, default=None, metavar="INDEX/COUNT",
+                        help="Work on just one shard of the hosts (ie: 1/4), picked by a hash of the host name, and " +
+                             "write its results for --merge to the --ndjson file (default shard-INDEX-of-COUNT.ndjson)")
+    parser.add_argument("--merge", dest="merge", type=str, nargs="+", default=None, metavar="FILE",
+                        help="Report on the results of the shards of a run, as a single run would have, and exit. " +
+                             "With --fleet-diff, diff the hosts of dumped shards")
+    parser.add_argument("--processes", dest="processes", type=int, nargs="?", const=os.cpu_count(), default=None,
+                        help="Split the run into this many shards (default one per CPU core), run them as processes " +
+                             "on this machine, and merge their results")
     parser.add_argument("-v", "--verbose", dest='verbosity', action='store_true', help="enable verbose mode")
 
     args = parser.parse_args()
@@ -447,9 +822,26 @@ def main():
         print(f"{progname} version 2026.01.06")
         sys.exit(0)
 
+    from wekapyutils.wekalogging import configure_logging, register_module
+
     # local modules - override a module's logging level
     register_module("RedFishBMC", logging.INFO)
+    register_module("AsyncRedFishBMC", logging.INFO)
+    register_module("AdaptiveConcurrency", logging.INFO)
+    register_module("BMCcache", logging.INFO)
+    register_module("ConfigFiles", logging.INFO)
+    register_module("DefaultsDB", logging.INFO)
+    register_module("FleetDiff", logging.INFO)
+    register_module("Metrics", logging.INFO)
+    register_module("RollingReboot", logging.INFO)
+    register_module("Watch", logging.INFO)
+    register_module("AttributeRegistry", logging.INFO)
     register_module("BMCsetup", logging.INFO)
+    register_module("ResultStream", logging.INFO)
+    register_module("BMCTransport", logging.INFO)
+    register_module("Deadlines", logging.INFO)
+    register_module("RateShaper", logging.INFO)
+    register_module("Shards", logging.INFO)
     register_module("redfish.rest.v1", logging.ERROR)
     register_module("paramiko", logging.ERROR)
 
@@ -457,6 +849,28 @@ def main():
     configure_logging(log, args.verbosity)
     #log_to_file("paramiko.log", logging.DEBUG)
 
+    if args.convert_defaults is not None:
+        count = convert_defaults_db(args.defaults_database, args.convert_defaults)
+        log.info(f"Copied {count} models from {args.defaults_database} to {args.convert_defaults}")
+        sys.exit(0)
+
+    if args.merge is not None:
+        sys.exit(0 if merge_shards(args, args.merge) else 1)
+
+    # a sharded run, or one that runs the shards?
+    mode = None
+    if args.shard is not None or args.processes is not None:
+        mode = shard_mode(args)
+        if mode is None:
+            log.error("Only checks (with --fix and --reboot), --reset-bios, --dump and --fleet-diff can be sharded")
+            sys.exit(1)
+    if args.processes is not None and args.shard is None:
+        if args.reboot:
+            # the shard with this host in it would reboot it before the others were done
+            log.error("--processes can't be used with --reboot; run the shards with --shard instead")
+            sys.exit(1)
+        sys.exit(0 if run_processes(args) else 1)
+
     # if they provided a list of BMC IPs, they must also provide a username and password
     if args.bmc_ips is not None:
         if args.bmc_username is None or args.bmc_password is None:
@@ -472,23 +886,58 @@ def main():
             log.error(f"Unable to open host configuration file: {exc}")
             sys.exit(1)
 
+    # did the user ask us to make sure the BMC is set with ipmi over lan and redfish, etc?
+    if args.bmc_config:
+        from BMCsetup import parallel_bmc_setup, print_setup_report
+        log.info(f"Configuring {len(conf['hosts'])} BMCs")
+        results = parallel_bmc_setup([(host['name'], host['user'], host['password']) for host in conf['hosts']],
+                                     workers=args.workers or 10)
+        print_setup_report(results)
+        sys.exit(0 if all(result.ok for result in results) else 1)
+
+    shard_prefix = ""
+    if args.shard is not None:
+        index, count = args.shard
+        conf['hosts'] = select_shard(conf['hosts'], index, count)
+        shard_prefix = f"Shard {index}/{count}: "
+        log.info(f"{shard_prefix}{len(conf['hosts'])} hosts")
+        if args.ndjson is None:
+            args.ndjson = f"shard-{index}-of-{count}.ndjson"
+        if args.fleet_diff:
+            # the shard just dumps its hosts' settings; --merge does the diff
+            args.fleet_diff, args.reset_bios, args.dump = False, False, True
+
+    # all RedFish traffic goes over pooled, keep-alive connections (see BMCTransport)
+    from BMCTransport import BMCTransport
+    transport = BMCTransport(connections=args.bmc_connections, keep_alive=not args.no_keep_alive,
+                             tls_resume=not args.no_tls_resume)
+    # and nothing waits on a BMC for ever (see Deadlines)
+    deadlines = Deadlines(request=args.request_timeout, patch=args.patch_timeout, reset=args.reset_timeout,
+                          discovery=args.discovery_timeout, host=args.host_timeout, hedge=not args.no_hedge,
+                          breaker_failures=args.breaker_failures, workers=request_threads(args))
+    # at no more than the rates the BMCs (and the management network) can take (see RateShaper)
+    shaper = RateShaper(host_rate=args.host_rate, vendor_rates=dict(args.vendor_rates), max_rate=args.max_rate)
+    bmc_options = dict(transport=transport, deadlines=deadlines, shaper=shaper)
+
+    # reuse the sessions left open by previous runs?
+    if args.session_cache:
+        bmc_options['session_cache'] = SessionCache()
+    if args.discovery_cache:
+        bmc_options['discovery_cache'] = DiscoveryCache()
+    if not args.no_registry:
+        bmc_options['registry_cache'] = RegistryCache()
+    tracer = None
+    if args.metrics_out is not None:
+        tracer = bmc_options['tracer'] = Tracer()
+
     # create objects from the config in the input file or command-line
     servers_list = list()
     for host in conf['hosts']:   # host is a dict, {name, user, password}
-        servers_list.append(Server(host['name'], host['user'], host['password']))
-
-    # did the user ask us to make sure the BMC is set with ipmi over lan and redfish, etc?
-    if args.bmc_config:
-        log.info("Configuring BMCs")
-        for host in servers_list:
-            log.info(f"Configuring {host['name']}")
-            bmc_setup(host.hostname, host.username, host.password)
-        log.info("BMCs have been configured")
-        sys.exit(0)
+        servers_list.append(Server(host['name'], host['user'], host['password'], **bmc_options))
 
     # try to load the BIOS settings (the entire database) (the entire database, all server types/models)
     try:
-        all_bios_settings = load_config(args.bios)
+        all_bios_settings = load_config(args.bios, cache=True)
     except Exception as exc:
         log.error(f"Unable to parse bios settings configuration file: {exc}")
         sys.exit(1)
@@ -506,7 +955,9 @@ def main():
         # all hosts
         hostlist = servers_list
 
+    local_host = None
     if args.reboot:
+        from BMCsetup import get_ipmi_ip
         this_hosts_ip = get_ipmi_ip()
 
         # if we're running on one of the servers we're looking at, most this server to the end of the list
@@ -522,75 +973,94 @@ def main():
             if my_entry is not None:
                 hostlist.remove(my_entry)
                 hostlist.append(my_entry)
+                local_host = my_entry
 
-    # open connections to all the hosts - redfish_list is a list of RedFishBMC objects
+    # open connections to all the hosts - opened yields Servers as their sessions are opened
     log.info("Opening sessions to hosts:")
-    redfish_list = parallel_open_sessions(hostlist)
+    discover = discovery_steps(args)
+    if args.use_async:
+        opened = async_open_sessions(hostlist, max_in_flight=args.workers or 200, discover=discover)
+    else:
+        opened = iter_open_sessions(hostlist, workers=args.workers or 10, adaptive=args.adaptive,
+                                    discover=discover)
+    pipeline_workers = args.workers or PIPELINE_WORKERS
+
+    # stream the results?  Otherwise, they're printed/logged as before
+    stream = None
+    pipeline_done = reboot_done = None
+    if args.ndjson is not None:
+        stream = NDJSONWriter(args.ndjson)
+        pipeline_done, reboot_done = stream_results(stream)
+        if args.shard is not None:
+            stream.write(shard_header(*args.shard, len(hostlist), mode, fix=args.fix, reboot=args.reboot))
 
     if args.diff:
+        redfish_list = in_host_order(opened, hostlist)
         if len(redfish_list) != 2:
             log.error(f"you must specify exactly 2 hosts to diff them")
         elif not bios_diff(redfish_list):
             log.info("The servers have identical BIOS settings")
+    elif args.fleet_diff:
+        redfish_list = in_host_order(opened, hostlist)
+        print_fleet_diff(fleet_diff(redfish_list), as_json=args.json)
     elif args.diff_defaults:
+        redfish_list = in_host_order(opened, hostlist)
         diff_defaults(args.defaults_database, redfish_list)
-        pass
     elif args.reset_bios:
-        for server in redfish_list:
-            # rest the bios...
-            server.bmc.reset_settings_to_default()
-            log.info(f"{server.bmc.name} has been reset to factory defaults")
-            if args.reboot:
-                server.bmc.reboot()
-                log.info(f"{server.bmc.name} has been rebooted")
+        results = run_pipeline(opened, lambda server: reset_host(server, reboot=args.reboot),
+                               last=local_host, workers=pipeline_workers, on_done=pipeline_done)
+        reboot_hosts(results, args, last=local_host, on_done=reboot_done)
+        redfish_list = [result.server for result in results]
     elif args.save:
+        redfish_list = in_host_order(opened, hostlist)
         save_bmc_db(redfish_list, args.defaults_database, force=args.force)
-    else:
-        # check BIOS settings
-        hosts_needing_changes = list()
-        fixed_hosts = list()
-        systems_rebooted = list()
-        # Loop through the servers
-        for server in redfish_list:
-            if args.dump:
-                server.bmc.print_settings()
-                continue
-            else:
-                settings = find_bios_settings(server, all_bios_settings)
-                log.info(f"Looking at {server.hostname}: {server.bmc.manufacturer}/{server.bmc.arch}/{server.bmc.model}:")
-                count = server.bmc.check_settings(settings)
-            #log.info(f"")
-            if count > 0:
-                log.info(f"{count} changes are needed on {server.hostname}")
-                hosts_needing_changes.append(server)
-                if args.fix:
-                    if server.bmc.change_settings(settings):
-                        fixed_hosts.append(server)
-                    else:
-                        log.error(f"Unable to fix {server.hostname}")
-            else:
-                log.warning(f"No changes are needed on {server.hostname}")
-            log.info("")
-            # if they said reboot, reboot
-            if args.reboot:
-                if args.fix and server in fixed_hosts: # --fix --reboot implies rebooting only the hosts that were fixed
-                    log.info(f"Rebooting {server.hostname}")
-                    server.bmc.reboot()
-                    systems_rebooted.append(server)
-                elif not args.fix:  # they asked to reboot all hosts
-                    log.info(f"Rebooting {server.hostname}")
-                    server.bmc.reboot()
-                    systems_rebooted.append(server)
-
-        if not args.fix:
-            log.info(f"There are {len(hosts_needing_changes)} hosts needing changes")
-        else:
-            if not args.reboot:
-                log.info(f"{len(fixed_hosts)} have been modified.  Please reboot them to activate changes.")
+    elif args.watch:
+        redfish_list = in_host_order(opened, hostlist)
+        desired = {server.hostname: find_bios_settings(server, all_bios_settings) for server in redfish_list}
+        BiosWatcher(redfish_list, desired, interval=args.watch_interval, workers=pipeline_workers).run()
+    elif args.dump:
+        redfish_list = list()
+        for server in opened:
+            if stream is not None:
+                stream.write(dump_record(server))
+                server.close()
             else:
-                log.info(f"{len(systems_rebooted)} have been successfully modified and rebooted.")
+                server.bmc.print_settings()
+            redfish_list.append(server)
+    else:
+        # check BIOS settings - checking starts on the first host while the others are still logging in
+        known_good = ComplianceCache() if args.fingerprints else None
+        results = run_pipeline(opened,
+                               lambda server: check_host(server, all_bios_settings, fix=args.fix, reboot=args.reboot,
+                                                         known_good=known_good),
+                               last=local_host, workers=pipeline_workers, on_done=pipeline_done)
+        if known_good is not None:
+            known_good.save()
+        reboot_hosts(results, args, last=local_host, on_done=reboot_done)
+        redfish_list = [result.server for result in results]
+        hosts_needing_changes = [result for result in results if result.changes_needed > 0]
+        fixed_hosts = [result for result in results if result.fixed]
+        systems_rebooted = [result for result in results if result.rebooted]
+
+        verified = [result for result in systems_rebooted if result.verified]
+        check_summary(len(hosts_needing_changes), len(fixed_hosts), len(systems_rebooted), len(verified),
+                      fix=args.fix, reboot=args.reboot, prefix=shard_prefix)
 
     close_sessions(redfish_list)
+    if stream is not None:
+        # and the hosts we never got to
+        for server in hostlist:
+            if server.error is not None:
+                stream.write(error_record(server))
+        stream.close()
+    if args.session_cache:
+        bmc_options['session_cache'].save()
+    transport.summary()
+    deadlines.summary()
+    shaper.summary()
+    if tracer is not None:
+        tracer.summary()
+        tracer.save(args.metrics_out)
 
 
 if __name__ == '__main__':
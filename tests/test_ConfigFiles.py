@@ -0,0 +1,40 @@
+import io
+
+import pytest
+
+from ConfigFiles import config_format, load_config
+
+
+@pytest.mark.parametrize("filename, content, expected", [
+    ("hosts.csv", "name: not really yaml\n", "csv"),
+    ("hosts.YML", "name,user,password\n", "yaml"),
+    ("hosts.yaml", "", "yaml"),
+    ("hosts", "# a comment\n\nname,user,password\n", "csv"),
+    ("hosts", "# a comment\n\nhosts:\n", "yaml"),
+    ("hosts", "- name: a\n", "yaml"),
+    ("hosts", "\n# nothing but comments\n", "yaml"),
+])
+def test_config_format(filename, content, expected):
+    f = io.StringIO(content)
+    assert config_format(filename, f) == expected
+    assert f.tell() == 0        # rewound for the loader
+
+
+def test_load_csv(tmp_path):
+    path = tmp_path / "hosts"
+    path.write_text("name,user,password\n10.0.0.1,root,secret\n")
+    assert load_config(str(path)) == {"hosts": [{"name": "10.0.0.1", "user": "root", "password": "secret"}]}
+
+
+def test_load_yaml(tmp_path):
+    path = tmp_path / "hosts.cfg"
+    path.write_text("# hosts\nhosts:\n  - name: 10.0.0.1\n    user: root\n")
+    assert load_config(str(path)) == {"hosts": [{"name": "10.0.0.1", "user": "root"}]}
+
+
+def test_unreadable_file(tmp_path):
+    path = tmp_path / "broken.yml"
+    path.write_text("hosts: [unclosed\n")
+    assert load_config(str(path)) is None
+    with pytest.raises(FileNotFoundError):
+        load_config(str(tmp_path / "missing.yml"))
@@ -0,0 +1,108 @@
+import threading
+import time
+
+import pytest
+
+import Deadlines
+from Deadlines import CircuitBreaker, CircuitOpen, DeadlineExceeded
+
+
+class Response(object):
+    def __init__(self, status=200):
+        self.status = status
+
+
+@pytest.fixture(autouse=True)
+def no_retry_pause(monkeypatch):
+    monkeypatch.setattr(Deadlines, "RETRY_PAUSE", 0.0)
+
+
+def test_breaker_opens_after_failures_in_a_row():
+    breaker = CircuitBreaker("host", failures=3, reset_after=60.0)
+    breaker.failure()
+    breaker.failure()
+    breaker.success()
+    breaker.failure()
+    breaker.failure()
+    breaker.check()
+    breaker.failure()
+    assert breaker.is_open
+    with pytest.raises(CircuitOpen):
+        breaker.check()
+    assert breaker.trips == 1
+
+
+def test_breaker_lets_one_trial_through():
+    breaker = CircuitBreaker("host", failures=1, reset_after=0.0)
+    breaker.failure()
+    breaker.check()                 # the trial
+    with pytest.raises(CircuitOpen):
+        breaker.check()             # ... and only the one
+    breaker.success()
+    assert not breaker.is_open
+    breaker.check()
+
+
+def test_server_errors_trip_the_breaker():
+    deadlines = Deadlines.Deadlines(breaker_failures=3, hedge=False)
+    budget = deadlines.host("host")
+    for _ in range(3):
+        assert deadlines.send(budget, "GET", lambda timeout: Response(500)).status == 500
+    assert budget.breaker.is_open
+
+
+def test_busy_answers_dont_trip_the_breaker():
+    deadlines = Deadlines.Deadlines(breaker_failures=3, hedge=False)
+    budget = deadlines.host("host")
+    for _ in range(5):
+        deadlines.send(budget, "GET", lambda timeout: Response(503))
+    assert not budget.breaker.is_open
+
+
+def test_gets_are_retried_and_others_are_not():
+    deadlines = Deadlines.Deadlines(retries=2, breaker_failures=10, hedge=False)
+    budget = deadlines.host("host")
+    sent = list()
+
+    def failing(timeout):
+        sent.append(timeout)
+        raise ConnectionError("no answer")
+
+    with pytest.raises(ConnectionError):
+        deadlines.send(budget, "GET", failing)
+    assert len(sent) == 3
+    with pytest.raises(ConnectionError):
+        deadlines.send(budget, "PATCH", failing)
+    assert len(sent) == 4
+    assert deadlines.counts["retries"] == 2
+
+
+def test_host_budget():
+    deadlines = Deadlines.Deadlines(request=30.0, host=10.0)
+    budget = deadlines.host("host")
+    assert budget.timeout("GET") == 10.0
+    budget.spend(10.0)
+    with pytest.raises(DeadlineExceeded):
+        budget.timeout("GET")
+    budget.restart()
+    assert budget.timeout("GET") == 10.0
+
+
+def test_full_hedging_pool_doesnt_queue_requests():
+    deadlines = Deadlines.Deadlines(workers=1, hedge_min=0.05, hedge_factor=1.0)
+    for _ in range(50):
+        deadlines.latency.record(0.01)
+    budget = deadlines.host("host")
+
+    def slow(timeout):
+        time.sleep(0.3)
+        return Response()
+
+    threads = [threading.Thread(target=deadlines.send, args=(budget, "GET", slow)) for _ in range(6)]
+    start = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # with the pool's two threads busy, the other GETs are sent from their own threads rather than waiting
+    assert time.monotonic() - start < 0.55
@@ -0,0 +1,57 @@
+from FleetDiff import fleet_diff, is_identity_setting, config_label
+
+
+class Host(object):
+    def __init__(self, hostname, settings, manufacturer="Dell Inc.", model="PowerEdge R6615"):
+        self.hostname = hostname
+        self.manufacturer = manufacturer
+        self.arch = "AMD"
+        self.model = model
+        self.bios_settings = settings
+
+    @property
+    def bmc(self):
+        return self
+
+
+def test_identity_settings():
+    for setting in ("SerialNumber", "SystemServiceTag", "AssetTag", "NicMacAddress", "SystemUuid", "Port1_MAC"):
+        assert is_identity_setting(setting), setting
+    for setting in ("SerialConsolePort", "AssetTagProtection", "MachineCheck", "LogicalProc"):
+        assert not is_identity_setting(setting), setting
+
+
+def test_config_labels():
+    assert [config_label(index) for index in (0, 1, 25, 26, 27)] == ["A", "B", "Z", "AA", "AB"]
+
+
+def test_clusters_hosts_by_settings():
+    hosts = [Host(f"host{index}", {"LogicalProc": "Enabled", "SerialNumber": f"SN{index}"}) for index in range(3)]
+    hosts.append(Host("host3", {"LogicalProc": "Disabled", "SerialNumber": "SN3"}))
+    hosts.append(Host("other", {"LogicalProc": "Disabled"}, model="PowerEdge R7625"))
+    report = fleet_diff(hosts)
+
+    assert [(group["model"], group["hosts"]) for group in report] == [("PowerEdge R6615", 4), ("PowerEdge R7625", 1)]
+    group = report[0]
+    assert group["ignored_settings"] == ["SerialNumber"]
+    assert [(config["config"], config["hosts"]) for config in group["configs"]] == \
+        [("A", ["host0", "host1", "host2"]), ("B", ["host3"])]
+    assert group["divergent_settings"] == [{"setting": "LogicalProc", "usual": "Enabled", "hosts_differing": 1,
+                                            "values": {"A": "Enabled", "B": "Disabled"}}]
+
+
+def test_settings_different_on_every_host_are_compared_and_pointed_out():
+    hosts = [Host(f"host{index}", {"BootSeq": f"order{index}"}) for index in range(3)]
+    group = fleet_diff(hosts)[0]
+    assert group["unique_settings"] == ["BootSeq"]
+    assert len(group["configs"]) == 3
+
+
+def test_supermicro_hosts_compared_on_trimmed_keys():
+    class Supermicro(Host):
+        def trimmed_bios_settings(self):
+            return {key[:-5]: value for key, value in self.bios_settings.items()}
+
+    hosts = [Supermicro("old", {"QuietBoot_002B": True}, manufacturer="Supermicro"),
+             Supermicro("new", {"QuietBoot_00AA": True}, manufacturer="Supermicro")]
+    assert len(fleet_diff(hosts)[0]["configs"]) == 1
@@ -0,0 +1,31 @@
+from HostState import BiosAttributes, KeyTables
+
+
+def test_used_like_a_dict():
+    attributes = BiosAttributes({"LogicalProc": "Enabled", "NumaNodesPerSocket": 1}, tables=KeyTables())
+    assert attributes["LogicalProc"] == "Enabled"
+    assert "NumaNodesPerSocket" in attributes
+    assert "Missing" not in attributes
+    assert attributes.get("Missing", "default") == "default"
+    assert list(attributes) == ["LogicalProc", "NumaNodesPerSocket"]
+    assert len(attributes) == 2
+    assert dict(attributes) == {"LogicalProc": "Enabled", "NumaNodesPerSocket": 1}
+    assert attributes == {"LogicalProc": "Enabled", "NumaNodesPerSocket": 1}
+
+
+def test_hosts_share_key_tables_and_values():
+    tables = KeyTables()
+    first = BiosAttributes({"LogicalProc": "Enabled", "BootMode": "Uefi"}, tables=tables)
+    second = BiosAttributes({"LogicalProc": "Dis" + "abled", "BootMode": "".join(["Ue", "fi"])}, tables=tables)
+    other = BiosAttributes({"BootMode": "Uefi"}, tables=tables)
+    assert first.table is second.table
+    assert other.table is not first.table
+    assert len(tables) == 2
+    assert first["BootMode"] is second["BootMode"]      # interned
+
+
+def test_trimmed_index_first_key_wins():
+    attributes = BiosAttributes({"QuietBoot_002B": 1, "QuietBoot_00AA": 2, "Other": 3}, tables=KeyTables())
+    index = attributes.table.trimmed_index(lambda key: key.split("_")[0])
+    assert index == {"QuietBoot": "QuietBoot_002B", "Other": "Other"}
+    assert attributes.table.trimmed_index(None) is index   # built once
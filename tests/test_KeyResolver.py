@@ -0,0 +1,36 @@
+from KeyResolver import KeyResolver, ends_with_hex, trim_trailing_hex
+
+
+def test_trim_trailing_hex():
+    assert ends_with_hex("QuietBoot_002B")
+    assert not ends_with_hex("QuietBoot_XYZW")
+    assert not ends_with_hex("_02B")
+    assert trim_trailing_hex("QuietBoot_002B") == "QuietBoot"
+    assert trim_trailing_hex("QuietBoot") == "QuietBoot"
+
+
+def test_exact_matches():
+    resolved = KeyResolver().resolve(["ProcX2Apic", "LogicalProc"], ["LogicalProc", "ProcX2Apic", "BootMode"])
+    assert resolved == {"ProcX2Apic": ("ProcX2Apic", 100.0), "LogicalProc": ("LogicalProc", 100.0)}
+
+
+def test_trimmed_matches_first_key_wins():
+    server_keys = ["QuietBoot_002B", "QuietBoot_00AA", "SMTControl_0037"]
+    resolved = KeyResolver().resolve(["QuietBoot_1234", "SMTControl"], server_keys, trim_hex=True)
+    assert resolved == {"QuietBoot_1234": ("QuietBoot_002B", 100.0), "SMTControl": ("SMTControl_0037", 100.0)}
+
+
+def test_fuzzy_match():
+    resolved = KeyResolver().resolve(["PowerProfileSelect"], ["PowerProfileSelection", "BootMode"])
+    key, similarity = resolved["PowerProfileSelect"]
+    assert key == "PowerProfileSelection"
+    assert 75 < similarity < 100
+
+
+def test_remembered_per_identity():
+    resolver = KeyResolver()
+    identity = ("Dell Inc.", "PowerEdge R6615", "1.2.3")
+    first = resolver.resolve(["LogicalProc"], ["LogicalProc"], identity=identity)
+    # the same identity has the same keys, so they aren't looked at again
+    assert resolver.resolve(["LogicalProc"], ["SomethingElse"], identity=identity) is first
+    assert resolver.resolve(["LogicalProc"], ["SomethingElse"], identity=identity + ("other",)) is not first
@@ -0,0 +1,55 @@
+import time
+
+import pytest
+
+from RateShaper import TokenBucket, RateShaper, MIN_RATE, retry_after_seconds
+
+
+@pytest.mark.parametrize("rate", [0, -1, 0.0])
+def test_rate_must_be_positive(rate):
+    with pytest.raises(ValueError):
+        TokenBucket("host", rate)
+
+
+def test_burst_then_waits():
+    bucket = TokenBucket("host", 10.0)
+    waits = [bucket.reserve() for _ in range(10)]
+    assert max(waits) < 0.05        # a second's worth of tokens to start with
+    assert bucket.reserve() == pytest.approx(0.1, abs=0.05)
+    assert bucket.reserve() == pytest.approx(0.2, abs=0.05)
+
+
+def test_unlimited_bucket_never_waits():
+    bucket = TokenBucket("host", float("inf"), burst=1.0)
+    assert all(bucket.reserve() == 0.0 for _ in range(100))
+
+
+def test_slow_down_and_speed_up():
+    bucket = TokenBucket("host", 1.0)
+    for _ in range(10):
+        bucket.slow_down(0.5)
+    assert bucket.rate == MIN_RATE
+    bucket.slow_down(0.5, pause=10.0)
+    assert bucket.reserve() > 9.0
+    for _ in range(1000):
+        bucket.speed_up()
+    assert bucket.rate == bucket.limit
+
+
+def test_busy_answers_are_retried_then_given_up_on():
+    shaper = RateShaper(retries=2)
+    assert shaper.record("host", None, 503, "0")
+    assert shaper.record("host", None, 429, "0")
+    assert not shaper.record("host", None, 503, "0")
+    assert not shaper.record("host", None, 200)
+    assert shaper.host("host").busy == 0
+    assert shaper.busy_answers == 3
+
+
+def test_retry_after():
+    assert retry_after_seconds(None) is None
+    assert retry_after_seconds("5") == 5.0
+    assert retry_after_seconds("-5") == 0.0
+    assert retry_after_seconds("soon") is None
+    when = time.strftime("%a, %d %b %Y %H:%M:%S GMT", time.gmtime(time.time() + 30))
+    assert retry_after_seconds(when) == pytest.approx(30, abs=2)
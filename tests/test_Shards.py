@@ -0,0 +1,77 @@
+import argparse
+import json
+
+import pytest
+
+from HostState import BiosAttributes
+from RedFishBMC import trim_supermicro_dict
+from Shards import shard_spec, shard_of, select_shard, shard_header, check_shards, shard_records, ShardHost
+
+HOSTS = [{"name": f"10.0.{index // 256}.{index % 256}"} for index in range(1000)]
+
+
+def test_shard_spec():
+    assert shard_spec("2/8") == (2, 8)
+    for value in ("0/4", "5/4", "1/0", "a/b", "3"):
+        with pytest.raises(argparse.ArgumentTypeError):
+            shard_spec(value)
+
+
+def test_hosts_split_between_the_shards():
+    shards = [select_shard(HOSTS, index, 4) for index in range(1, 5)]
+    assert sorted(host["name"] for shard in shards for host in shard) == sorted(host["name"] for host in HOSTS)
+    assert all(150 < len(shard) < 350 for shard in shards)
+    # in config order
+    assert shards[0] == [host for host in HOSTS if host in shards[0]]
+
+
+def test_a_host_always_hashes_to_the_same_shard():
+    # the same in every process (and on every machine) - not python's salted hash()
+    assert shard_of("10.0.0.1", 8) == shard_of("10.0.0.1", 8)
+    assert shard_of("10.0.0.1", 8) == 1 + int.from_bytes(
+        __import__("hashlib").sha256(b"10.0.0.1").digest()[:8], "big") % 8
+
+
+def write_shard(path, index, count, records, hosts=None, mode="dump"):
+    with open(path, "w") as f:
+        f.write(json.dumps(shard_header(index, count, len(records) if hosts is None else hosts, mode)) + "\n")
+        for record in records:
+            f.write(json.dumps(record) + "\n")
+    return str(path)
+
+
+def dump_record(host, attributes):
+    return {"host": host, "manufacturer": "Supermicro", "arch": "Intel", "model": "X13", "attributes": attributes}
+
+
+def test_merge_shards(tmp_path):
+    files = [write_shard(tmp_path / "2.ndjson", 2, 2, [dump_record("b", {"Key_0001": 2})]),
+             write_shard(tmp_path / "1.ndjson", 1, 2, [dump_record("a", {"Key_0001": 1})])]
+    header, complete = check_shards(files)
+    assert complete and header["mode"] == "dump"
+    assert [record["host"] for record in shard_records(files)] == ["b", "a"]
+
+
+def test_incomplete_or_mismatched_shards(tmp_path):
+    first = write_shard(tmp_path / "1.ndjson", 1, 3, [dump_record("a", {})])
+    short = write_shard(tmp_path / "2.ndjson", 2, 3, [], hosts=1)
+    assert check_shards([first, short]) == (json.loads(open(first).readline()), False)
+
+    other_run = write_shard(tmp_path / "other.ndjson", 2, 3, [], mode="check")
+    with pytest.raises(ValueError):
+        check_shards([first, other_run])
+    with pytest.raises(ValueError):
+        check_shards([first, first])
+    not_a_shard = tmp_path / "plain.ndjson"
+    not_a_shard.write_text(json.dumps(dump_record("a", {})) + "\n")
+    with pytest.raises(ValueError):
+        check_shards([str(not_a_shard)])
+
+
+def test_merged_hosts_trimmed_as_live_hosts_are():
+    # two keys trim to the same name: the first wins, whether the host is live or read back from a shard
+    attributes = {"QuietBoot_002B": "Enabled", "QuietBoot_00AA": "Disabled", "BootMode_0001": "Uefi"}
+    expected = {"QuietBoot": "Enabled", "BootMode": "Uefi"}
+    assert trim_supermicro_dict(attributes) == expected
+    assert trim_supermicro_dict(BiosAttributes(attributes)) == expected
+    assert ShardHost(dump_record("a", attributes)).trimmed_bios_settings() == expected
@@ -0,0 +1,25 @@
+# bios_tool --version (and every run that doesn't need them) mustn't pay for importing the heavy dependencies
+import os
+import subprocess
+import sys
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY = ("redfish", "requests", "yaml", "paramiko")
+
+VERSION = """
+import runpy, sys
+sys.argv = ["bios_tool.py", "--version"]
+try:
+    runpy.run_path("bios_tool.py", run_name="__main__")
+except SystemExit:
+    pass
+print(" ".join(sorted(name for name in sys.modules if name.split(".")[0] in %r)))
+"""
+
+
+def test_version_imports_no_heavy_dependencies():
+    result = subprocess.run([sys.executable, "-c", VERSION % (HEAVY,)], cwd=REPO, capture_output=True, text=True,
+                            check=True)
+    lines = result.stdout.splitlines()
+    assert lines[0].startswith("bios_tool.py version ")
+    assert lines[1:] in ([], [""])